@@ -0,0 +1,110 @@
+import re
+from functools import lru_cache
+
+# number of distinct affiliations whose filtered form is remembered
+MEMO_SIZE = 200000
+# tokens of an affiliation that name the institution rather than a department
+INSTITUTION_KEYWORDS = ('univ', 'insti', 'school', 'college', 'lab', 'center')
+# children of an aff element that number the affiliations, e.g. <sup>1</sup> or <label>a</label>
+LABEL_TAGS = ('label', 'sup')
+# a label is short, e.g. '1', 'a', '12' or '*'; longer superscripts are part of the text
+LABEL_REGEX = re.compile(r'^\W{0,2}\w{0,3}\W{0,2}$')
+# children of an aff element that are not part of the affiliation
+SKIPPED_TAGS = ('email', 'ext-link', 'uri')
+WHITESPACE_REGEX = re.compile(r'\s+')
+
+def cleanAffiliation(text):
+    """Collapse the whitespace of an affiliation and trim its separators, e.g. ' Univ X, and ' -> 'Univ X'"""
+    text = WHITESPACE_REGEX.sub(' ', text).strip(' ,;.')
+    if text.endswith(' and'):
+        text = text[:-4].rstrip(' ,;')
+    return text
+
+def isLabel(node):
+    return node.tag in LABEL_TAGS and LABEL_REGEX.match((node.text or '').strip()) is not None
+
+def splitAffiliation(aff):
+    """Split an aff element into its labelled affiliations, in one pass over its children
+
+    An aff element holds one affiliation, optionally preceded by a label, or
+    several affiliations each preceded by a <sup> or <label> number. The
+    text of the other children (institution, addr-line, country, ...) is
+    part of the affiliation they are in; emails and links are left out.
+
+    Args:
+        aff (xml.etree.ElementTree.Element): The aff element
+
+    Returns:
+        [(str, str)]: The label (None if there is none) and the text of every affiliation
+
+    """
+    parts = []
+    label = None
+    text = [aff.text or '']
+    for child in aff:
+        if isLabel(child):
+            parts.append((label, ''.join(text)))
+            label = (child.text or '').strip()
+            text = []
+        elif child.tag not in SKIPPED_TAGS:
+            text.extend(child.itertext())
+        text.append(child.tail or '')
+    parts.append((label, ''.join(text)))
+
+    result = []
+    for label, text in parts:
+        text = cleanAffiliation(text)
+        if text:
+            result.append((label, text))
+    return result
+
+def extractAffiliations(article_meta):
+    """Extract the affiliations of a PMC article
+
+    Every aff element under article-meta is visited once, including the ones
+    inside contrib-group, so papers with hundreds of affiliations stay linear.
+
+    Args:
+        article_meta (xml.etree.ElementTree.Element): The article-meta element
+
+    Returns:
+        [str]: The distinct affiliations, in the order of the article
+
+    """
+    affiliations = []
+    seen = set()
+    if article_meta is None:
+        return affiliations
+    for aff in article_meta.iter('aff'):
+        for label, text in splitAffiliation(aff):
+            if text not in seen:
+                seen.add(text)
+                affiliations.append(text)
+    return affiliations
+
+@lru_cache(maxsize=MEMO_SIZE)
+def filterAffiliation(affiliation):
+    """Drop the leading parts of an affiliation that come before the institution
+
+    The affiliation is split on commas and kept from the last part that
+    names an institution (and not a department), e.g.
+    'Dept. of Biology, University of X, City' -> 'University of X, City'.
+
+    Args:
+        affiliation (str): The affiliation
+
+    Returns:
+        str: The filtered affiliation, the whole affiliation if no part names an institution
+
+    """
+    tokens = affiliation.split(',')
+    found_idx = 0
+    for token_idx, token in enumerate(tokens):
+        token_lower = token.lower()
+        if 'department' not in token_lower and any(keyword in token_lower for keyword in INSTITUTION_KEYWORDS):
+            found_idx = token_idx
+    return ', '.join(token.strip() for token in tokens[found_idx:])
+
+def filterAffiliations(affiliations):
+    """Filter every affiliation, see filterAffiliation"""
+    return [filterAffiliation(affiliation) for affiliation in affiliations]
@@ -0,0 +1,328 @@
+import json, os, re, sys, time, copy
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+
+import scrape, integrate, corpusStore, idMap, nameScoring
+
+FIXTURE_DIR = './fixtures/'
+GOLDEN_FILE = FIXTURE_DIR+'golden.json'
+
+# keys whose values depend on the time of the run
+VOLATILE_KEYS = ['dateCreated', 'dateUpdated']
+
+fixture_cache = {}
+
+def fixturePath(link):
+    """Map the link of an HTTP request to the local fixture that answers it
+
+    Args:
+        link (str): The link/url that would be requested
+
+    Returns:
+        str: The path of the fixture file. Returns None if there is no fixture for the link.
+
+    """
+    m = re.search(r'idconv\/v1\.0\/.*[?&]ids=([^&]+)', link)
+    if m:
+        return FIXTURE_DIR+'idconv/'+unquote(m.group(1)).lower().replace('/', '_')+'.json'
+
+    m = re.search(r'efetch\.fcgi\?db=(pubmed|pmc)&format=xml&id=(?:pmc)?([\d]+)', link, re.IGNORECASE)
+    if m:
+        return FIXTURE_DIR+m.group(1)+'/'+m.group(2)+'.xml'
+
+    m = re.search(r'api\.crossref\.org\/works\/([^?]+)', link)
+    if m:
+        return FIXTURE_DIR+'crossref/'+unquote(m.group(1)).lower().replace('/', '_')+'.json'
+
+    m = re.search(r'sourceforge\.net\/rest\/p\/([\w.-]+?)(\/activity)?$', link)
+    if m:
+        return FIXTURE_DIR+'sourceforge/'+m.group(1).lower()+('_activity' if m.group(2) else '')+'.json'
+    m = re.search(r'sourceforge\.net\/projects\/([\w.-]+)\/files\/stats\/json', link)
+    if m:
+        return FIXTURE_DIR+'sourceforge/'+m.group(1).lower()+'_stats.json'
+
+    if re.search(r'bioconductor\.org\/packages\/release\/bioc\/$', link):
+        return FIXTURE_DIR+'bioc/index.html'
+    if re.search(r'bioconductor\.org\/packages\/stats\/$', link):
+        return FIXTURE_DIR+'bioc/stats.html'
+    m = re.search(r'bioconductor\.org\/packages\/release\/bioc\/html\/([\w.]+)\.html', link)
+    if m:
+        return FIXTURE_DIR+'bioc/'+m.group(1)+'.html'
+
+    return None
+
+def fixtureGraphQL(data):
+    """Stand-in for the GitHub GraphQL endpoint
+
+    Answers every 'rN: repository(owner: "o", name: "n")' alias of the query
+    with the fixture github/o_n.json, or null if there is none.
+
+    Args:
+        data (str): The body of the request, {"query": "..."}
+
+    Returns:
+        str: The json response
+
+    """
+    query = json.loads(data)['query']
+    response = {'data': {}}
+    for alias, owner, name in re.findall(r'(r[\d]+): repository\(owner: ("[^"]*"), name: ("[^"]*")\)', query):
+        path = FIXTURE_DIR+'github/'+json.loads(owner).lower()+'_'+json.loads(name).lower()+'.json'
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                response['data'][alias] = json.load(f)
+        else:
+            response['data'][alias] = None
+            response.setdefault('errors', []).append({'type': 'NOT_FOUND', 'path': [alias]})
+    return json.dumps(response)
+
+def fixtureCrossRef(link):
+    """Stand-in for the Crossref filter=doi:a,doi:b,... queries
+
+    Answers with the works of the DOIs that have a fixture in crossref/.
+
+    Args:
+        link (str): The link of the query
+
+    Returns:
+        str: The json response
+
+    """
+    m = re.search(r'filter=([^&]+)', link)
+    items = []
+    for doi in m.group(1).split(','):
+        path = FIXTURE_DIR+'crossref/'+unquote(doi[len('doi:'):]).lower().replace('/', '_')+'.json'
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                items.append(json.load(f)['message'])
+    return json.dumps({'status': 'ok', 'message-type': 'work-list', 'message': {'total-results': len(items), 'items': items}})
+
+def fixtureRequest(link, data=None, headers=None):
+    """Drop-in replacement of makeRequest that answers from the local fixtures
+
+    Args:
+        link (str): The link/url of the website
+        data (str, optional): The body of a POST request. Default is None.
+        headers ([str], optional): Ignored. Default is None.
+
+    Returns:
+        str: The content of the fixture
+
+    """
+    if link==integrate.CONFIG.GITHUB_GRAPHQL_URL:
+        return fixtureGraphQL(data)
+    if link.startswith(integrate.CONFIG.CROSSREF_URL+'?'):
+        return fixtureCrossRef(link)
+    path = fixturePath(link)
+    if path is None or not os.path.isfile(path):
+        raise KeyError('No fixture for '+link)
+    if path not in fixture_cache:
+        with open(path, 'rb') as f:
+            fixture_cache[path] = f.read().decode('iso-8859-1')
+    return fixture_cache[path]
+
+def useFixtures():
+    """Route every network call of scrape and integrate to the local fixtures"""
+    scrape.makeRequest = fixtureRequest
+    integrate.makeRequest = fixtureRequest
+    # links are reported as broken, like a run without network access
+    scrape.isWorkingLink = lambda link: False
+    # keep the bioconductor index of the fixtures in memory only
+    integrate.saveBioCIndex = lambda index, cache_file=None: None
+    integrate.bioc_index = None
+    # read every article from the fixtures, not from the local corpus store
+    corpusStore.store_file = None
+    # resolve every id with the idconv fixtures, not with the local id map
+    idMap.store_file = None
+    idMap.missed.clear()
+    # github repositories are resolved by the stand-in GraphQL endpoint
+    integrate.CONFIG.GITHUB_TOKEN = 'fixture'
+    integrate.github_cache.clear()
+    integrate.sourceforge_cache.clear()
+    integrate.sourceforge_moved.clear()
+    integrate.crossref_cache.clear()
+
+def loadCases():
+    """Build the benchmark cases from the fixtures
+
+    Returns:
+        [(str, str, function)]: A list of (function name, case id, call) triples.
+        Every call runs the function once on one fixture.
+
+    """
+    with open(FIXTURE_DIR+'text_cases.json', 'r') as f:
+        text_cases = json.load(f)
+
+    pmc_files = sorted(os.listdir(FIXTURE_DIR+'pmc'))
+    pmc_roots = {}
+    for filename in pmc_files:
+        pmc_roots[filename] = ET.parse(FIXTURE_DIR+'pmc/'+filename).getroot()
+
+    cases = []
+    for case in text_cases:
+        cases.append(('extractLinks', case['id'], lambda case=case: scrape.extractLinks(case['abstract'])))
+    for filename, root in sorted(pmc_roots.items()):
+        cases.append(('extractLinks', 'pmc/'+filename, lambda root=root: scrape.extractLinks('', fileXML=root, searchFull=True)))
+
+    for case in text_cases:
+        cases.append(('extractName', case['id'], lambda case=case: scrape.extractName(case['title'], case['abstract'])))
+
+    for case in text_cases:
+        cases.append(('getGrants', case['id'], lambda case=case: scrape.getGrants(case['funding'])))
+
+    for filename in pmc_files:
+        path = FIXTURE_DIR+'pmc/'+filename
+        cases.append(('extractFromXML', 'pmc/'+filename, lambda path=path: scrape.extractFromXML(path)))
+        cases.append(('extractFromXML', 'pmc/'+filename+'#body', lambda path=path: scrape.extractFromXML(path, getAbstractOnly=False)))
+
+    # repository lookups are measured without their caches
+    def uncached(func, link, *caches):
+        for cache in caches:
+            cache.clear()
+        return func(link)
+    for filename in sorted(os.listdir(FIXTURE_DIR+'sourceforge')):
+        if '_' not in filename:
+            link = 'https://sourceforge.net/projects/'+filename[:-5]+'/'
+            cases.append(('getSourceforgeData', 'sourceforge/'+filename[:-5], lambda link=link: uncached(integrate.getSourceforgeData,
+                link, integrate.sourceforge_cache, integrate.github_cache)))
+
+    pmcids = [filename[:-4] for filename in pmc_files]
+    for pmcid in pmcids:
+        cases.append(('extractFromPubmed', 'pmc/'+pmcid, lambda pmcid=pmcid: scrape.extractFromPubmed('', pmc=pmcid)))
+    for filename in sorted(os.listdir(FIXTURE_DIR+'crossref')):
+        doi = filename[:-5].replace('_', '/')
+        cases.append(('extractFromPubmed', 'doi/'+doi, lambda doi=doi: scrape.extractFromPubmed('', doi=doi)))
+
+    for pmcid in pmcids:
+        cases.append(('generateCompleteJSON', 'pmc/'+pmcid, lambda pmcid=pmcid: integrate.generateCompleteJSON(pmc=pmcid)))
+
+    # converToSolrFormat is measured on its own, from already aggregated entries
+    for pmcid in pmcids:
+        entry = integrate.generateCompleteJSON(pmc=pmcid)
+        cases.append(('converToSolrFormat', 'pmc/'+pmcid, lambda entry=entry: integrate.converToSolrFormat(copy.deepcopy(entry))))
+
+    return cases
+
+def normalize(result):
+    """Convert a result to plain json values and drop the time dependent keys"""
+    result = json.loads(json.dumps(result))
+
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        return value
+
+    return strip(result)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values)-1, int(fraction*len(values)))]
+
+def runBenchmark(repeat=20):
+    """Time every case and collect its (normalized) output
+
+    Args:
+        repeat (int, optional): The number of times every case is run. Default is 20.
+
+    Returns:
+        (dict, dict): The first value is the report per function:
+        {'extractLinks': {'calls': 140, 'mean_ms': 0.1, 'p50_ms': 0.1, 'p95_ms': 0.2, 'per_second': 9000.0},...}
+        The second value maps 'function/case id' to the output of the case.
+
+    """
+    useFixtures()
+    cases = loadCases()
+
+    latencies = {}
+    results = {}
+    for func_name, case_id, call in cases:
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = call()
+            latencies.setdefault(func_name, []).append(time.perf_counter()-start)
+        results[func_name+'/'+case_id] = normalize(result)
+
+    report = {}
+    for func_name, values in latencies.items():
+        report[func_name] = {
+            'calls': len(values),
+            'mean_ms': 1000*sum(values)/len(values),
+            'p50_ms': 1000*percentile(values, 0.5),
+            'p95_ms': 1000*percentile(values, 0.95),
+            'per_second': len(values)/sum(values)
+        }
+    return (report, results)
+
+def compareGolden(results, golden):
+    """Compare the outputs of a run with the golden results
+
+    Args:
+        results (dict): The outputs returned by runBenchmark
+        golden (dict): The golden outputs
+
+    Returns:
+        [str]: The keys of the cases whose output differs, is missing or is new.
+
+    """
+    mismatches = []
+    for key in sorted(set(results) | set(golden)):
+        if results.get(key)!=golden.get(key):
+            mismatches.append(key)
+    return mismatches
+
+def main():
+    """Run the benchmark
+
+    Usage:
+        python benchmark.py [--update] [--repeat N] [--json report.json]
+
+    --update records the outputs of this run as the golden results. Without it,
+    the outputs are checked against fixtures/golden.json and the script exits
+    with status 1 if any output changed or if there are no golden results.
+    It also fails if nameScoring.extractNames disagrees with extractName on
+    the text cases.
+
+    """
+    args = sys.argv[1:]
+    repeat = 20
+    if '--repeat' in args:
+        repeat = int(args[args.index('--repeat')+1])
+
+    report, results = runBenchmark(repeat)
+
+    print('%-22s %8s %10s %10s %10s %12s' % ('function', 'calls', 'mean ms', 'p50 ms', 'p95 ms', 'calls/s'))
+    for func_name, stats in report.items():
+        print('%-22s %8d %10.3f %10.3f %10.3f %12.1f' % (func_name, stats['calls'], stats['mean_ms'], stats['p50_ms'], stats['p95_ms'], stats['per_second']))
+
+    if '--json' in args:
+        with open(args[args.index('--json')+1], 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if '--update' in args:
+        with open(GOLDEN_FILE, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print('golden results written to', GOLDEN_FILE)
+        return
+
+    if not os.path.isfile(GOLDEN_FILE):
+        print('no golden results found, run with --update to record them')
+        sys.exit(1)
+
+    with open(GOLDEN_FILE, 'r') as f:
+        golden = json.load(f)
+    mismatches = compareGolden(results, golden)
+    for key in mismatches:
+        print('output changed:', key)
+    # the batch name extraction must rank the names like extractName
+    records = nameScoring.loadTextCases(FIXTURE_DIR+'text_cases.json')
+    disagreements = nameScoring.compareWithExtractName(records)
+    for idx, expected, names in disagreements:
+        print('extractNames differs from extractName:', records[idx][0])
+    if mismatches or disagreements:
+        sys.exit(1)
+    print('all', len(results), 'outputs match the golden results')
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,66 @@
+import os
 
 OLD_SOLR_URL = 'http://dev.aztec.io:8983/solr/BD2K/'
 NEW_SOLR_URL = 'http://localhost:8983/solr/BD2K/'
 JOURNAL_DIRS = ['../bioinformatics/has_repo/','../bioinformatics/abstract_only/has_repo/','../bioinformatics/abstract_only/', '../bioinformatics/']
+
+# paging options used when migrating the old Solr core
+MIGRATE_PAGE_SIZE = 1000
+MIGRATE_UNIQUE_KEY = 'id'
+MIGRATE_CURSOR_FILE = './migrate_cursor.json'
+
+# local index of bioconductor packages, rebuilt once a day
+BIOC_INDEX_FILE = './utilities/bioc_index.json'
+BIOC_INDEX_MAX_AGE = 24*60*60
+# seconds before a failed download of the package list is tried again
+BIOC_INDEX_RETRY = 10*60
+# package pages parsed between two saves of the index, see flushBioCIndex
+BIOC_SAVE_EVERY = 100
+
+# file the run metrics are written to: Prometheus text if it ends with .prom,
+# json lines otherwise. None disables the export.
+METRICS_FILE = None
+
+# Solr field that holds the top LDA topics of a document
+TOPIC_FIELD = 'topics'
+
+# local store of the PMC articles (compressed XML and text fields), shared by
+# scrape, lda, word2vec and insertScript
+CORPUS_STORE_FILE = './corpus/articles.db'
+# documents a DocumentSource keeps in memory, the least recently used are dropped
+DOCUMENT_CACHE_SIZE = 1000
+
+# GitHub GraphQL API; the token is read from the environment, without it the
+# REST API is queried anonymously, one repository at a time
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+# repositories resolved per GraphQL query
+GITHUB_BATCH_SIZE = 50
+# seconds the metadata of a repository is reused
+GITHUB_CACHE_TTL = 6*60*60
+
+# seconds the metadata of a bitbucket or sourceforge repository is reused
+REPO_CACHE_TTL = 6*60*60
+# threads shared by the concurrent requests of the repository lookups
+SUBREQUEST_THREADS = 32
+# moved repositories followed before giving up
+MAX_REDIRECTS = 3
+
+# Crossref works API; with a contact email the requests are served by the polite pool
+CROSSREF_URL = 'https://api.crossref.org/works'
+CROSSREF_MAILTO = os.environ.get('CROSSREF_MAILTO')
+USER_AGENT = 'BD2K-Scrape-Pipeline/1.0'
+# DOIs looked up per request
+CROSSREF_BATCH_SIZE = 50
+
+# local PMID/PMCID/DOI map loaded from NCBI's PMC-ids dump, reloaded once a week
+ID_MAP_FILE = './corpus/idmap.db'
+PMC_IDS_URL = 'https://ftp.ncbi.nlm.nih.gov/pub/pmc/PMC-ids.csv.gz'
+ID_MAP_MAX_AGE = 7*24*60*60
+# seconds an id that idconv did not find is not requested again
+ID_MISS_MAX_AGE = 7*24*60*60
+# identify the pipeline to the NCBI services (idconv)
+NCBI_TOOL = 'bd2k_scrape_pipeline'
+NCBI_EMAIL = os.environ.get('NCBI_EMAIL')
+# ids resolved per idconv request (at most 200)
+IDCONV_BATCH_SIZE = 200
@@ -0,0 +1,257 @@
+import os, re, zlib, sqlite3, threading, queue, time
+import xml.etree.ElementTree as ET
+
+import config.config as CONFIG
+import metrics
+
+# path of the SQLite store; None disables the store (every read is a miss)
+store_file = CONFIG.CORPUS_STORE_FILE
+
+# one connection per thread, sqlite connections can not be shared
+local = threading.local()
+# serializes the writes of all threads
+write_lock = threading.Lock()
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS articles (
+    pmcid TEXT PRIMARY KEY,
+    xml BLOB NOT NULL,
+    title TEXT,
+    abstract TEXT,
+    body TEXT,
+    fetched REAL
+)'''
+
+def normalizeID(pmcid):
+    """Reduce a PMC ID such as 'PMC4321001' or 4321001 to its digits"""
+    pmcid = str(pmcid).strip()
+    if pmcid.lower().startswith('pmc'):
+        pmcid = pmcid[3:]
+    return pmcid
+
+def getConnection():
+    """Open (once per thread) the connection to the store
+
+    Returns:
+        sqlite3.Connection: The connection. Returns None if the store is disabled.
+
+    """
+    if store_file is None:
+        return None
+    conn = getattr(local, 'conn', None)
+    if conn is None or getattr(local, 'file', None)!=store_file:
+        directory = os.path.dirname(store_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(store_file, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(SCHEMA)
+        conn.commit()
+        local.conn = conn
+        local.file = store_file
+    return conn
+
+def nodeText(node):
+    if node is None:
+        return ''
+    return ET.tostring(node, encoding='utf-8', method='text').decode('utf-8').strip()
+
+def extractFields(xml_text):
+    """Extract the text fields of a PMC article
+
+    Args:
+        xml_text (str): The XML returned by the PMC efetch
+
+    Returns:
+        dict: The 'title', 'abstract' and 'body' of the article.
+        Returns None if the XML does not contain an article (e.g. an error message).
+
+    """
+    try:
+        root = ET.fromstring(xml_text)
+    except ET.ParseError:
+        return None
+    article = root if root.tag=='article' else root.find('./article')
+    if article is None:
+        return None
+    return {
+        'title': nodeText(article.find('./front/article-meta/title-group/article-title')),
+        'abstract': nodeText(article.find('./front/article-meta/abstract')),
+        'body': nodeText(article.find('./body'))
+    }
+
+def putArticle(pmcid, xml_text):
+    """Store the XML of an article with its extracted text fields
+
+    Args:
+        pmcid (str): The PMC ID of the article
+        xml_text (str): The XML returned by the PMC efetch
+
+    Returns:
+        bool: True if the article was stored, False if the XML has no article or the store is disabled.
+
+    """
+    conn = getConnection()
+    fields = extractFields(xml_text)
+    if conn is None or fields is None:
+        return False
+    row = (normalizeID(pmcid), zlib.compress(xml_text.encode('utf-8')), fields['title'], fields['abstract'], fields['body'], time.time())
+    with write_lock:
+        conn.execute('INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)', row)
+        conn.commit()
+    return True
+
+def getXML(pmcid):
+    """Read the XML of an article from the store
+
+    Args:
+        pmcid (str): The PMC ID of the article
+
+    Returns:
+        str: The XML. Returns None if the article is not stored.
+
+    """
+    conn = getConnection()
+    if conn is None:
+        return None
+    row = conn.execute('SELECT xml FROM articles WHERE pmcid=?', (normalizeID(pmcid),)).fetchone()
+    if row is None:
+        metrics.increment('cache_miss', cache='corpus')
+        return None
+    metrics.increment('cache_hit', cache='corpus')
+    return zlib.decompress(row[0]).decode('utf-8')
+
+def getArticle(pmcid, fetch=None):
+    """Read the text fields of an article from the store
+
+    Args:
+        pmcid (str): The PMC ID of the article
+        fetch (function, optional): Called with the PMC ID to retrieve the XML
+        of an article that is not stored yet. Default is None.
+
+    Returns:
+        dict: The 'pmcid', 'title', 'abstract' and 'body' of the article.
+        Returns None if the article is not stored (and could not be fetched).
+
+    """
+    conn = getConnection()
+    pmcid = normalizeID(pmcid)
+    row = None
+    if conn is not None:
+        row = conn.execute('SELECT pmcid, title, abstract, body FROM articles WHERE pmcid=?', (pmcid,)).fetchone()
+    if row is None and fetch is not None:
+        fields = extractFields(fetch(pmcid))
+        if fields is not None:
+            fields['pmcid'] = pmcid
+        return fields
+    if row is None:
+        return None
+    return {'pmcid': row[0], 'title': row[1], 'abstract': row[2], 'body': row[3]}
+
+def storedIDs(pmcids=None):
+    """Find the PMC IDs that are in the store
+
+    Args:
+        pmcids ([str], optional): The PMC IDs to look for. Default is None, every stored ID.
+
+    Returns:
+        set: The stored PMC IDs (digits only)
+
+    """
+    conn = getConnection()
+    if conn is None:
+        return set()
+    stored = set(row[0] for row in conn.execute('SELECT pmcid FROM articles'))
+    if pmcids is None:
+        return stored
+    return stored & set(normalizeID(pmcid) for pmcid in pmcids)
+
+def iterArticles(fields=['pmcid', 'title', 'abstract', 'body'], pmcids=None):
+    """Iterate over the stored articles, one at a time
+
+    Args:
+        fields ([str], optional): The columns returned. Default is every text field.
+        pmcids ([str], optional): Only return these articles. Default is None, every article.
+
+    Returns:
+        generator: Yields one dict per article with the requested fields
+
+    """
+    conn = getConnection()
+    if conn is None:
+        return
+    wanted = None if pmcids is None else set(normalizeID(pmcid) for pmcid in pmcids)
+    columns = ['pmcid']+[field for field in fields if field!='pmcid']
+    for row in conn.execute('SELECT '+', '.join(columns)+' FROM articles ORDER BY pmcid'):
+        if wanted is None or row[0] in wanted:
+            yield dict(zip(columns, row))
+
+class fetchThread(threading.Thread):
+    def __init__(self, threadID, pmcid_queue, fetch, counts):
+        threading.Thread.__init__(self)
+        self.threadID = threadID
+        self.pmcid_queue = pmcid_queue
+        self.fetch = fetch
+        self.counts = counts
+
+    def run(self):
+        while True:
+            pmcid = self.pmcid_queue.get()
+            # None tells the worker that no more IDs will arrive
+            if pmcid is None:
+                self.pmcid_queue.task_done()
+                break
+            try:
+                status = 'stored' if putArticle(pmcid, self.fetch(pmcid)) else 'failed'
+            except Exception as e:
+                metrics.increment('failures', stage='fillStore')
+                print('Could not fetch', pmcid, e)
+                status = 'failed'
+            try:
+                with write_lock:
+                    self.counts[status] += 1
+            finally:
+                self.pmcid_queue.task_done()
+
+def fillStore(pmcids, fetch, numThreads=16):
+    """Fetch every article that is not stored yet, in a single pass
+
+    Args:
+        pmcids ([str]): The PMC IDs of the articles
+        fetch (function): Called with a PMC ID, returns the XML of the article
+        numThreads (int, optional): The number of fetching threads. Default is 16.
+
+    Returns:
+        dict: The number of articles that were already 'present', newly 'stored' or 'failed'.
+
+    """
+    pmcids = [normalizeID(pmcid) for pmcid in pmcids]
+    present = storedIDs(pmcids)
+    pending = sorted(set(pmcids)-present)
+    counts = {'present': len(present), 'stored': 0, 'failed': 0}
+    if store_file is None or not pending:
+        return counts
+    print('fetching', len(pending), 'articles,', len(present), 'already stored')
+
+    pmcid_queue = queue.Queue()
+    threads = []
+    for i in range(min(numThreads, len(pending))):
+        t = fetchThread(i, pmcid_queue, fetch, counts)
+        threads.append(t)
+        t.start()
+    for pmcid in pending:
+        pmcid_queue.put(pmcid)
+    for t in threads:
+        pmcid_queue.put(None)
+    for t in threads:
+        t.join()
+    return counts
+
+def getJournalIDs(dirs=CONFIG.JOURNAL_DIRS):
+    """List the PMC IDs of the files in the journal directories"""
+    pmcids = []
+    for directory in dirs:
+        for f in os.listdir(directory):
+            pmc_regex = re.search(r'[\d]+', f)
+            if pmc_regex:
+                pmcids.append(pmc_regex.group(0))
+    return pmcids
@@ -0,0 +1,187 @@
+import os, re, threading
+from collections import OrderedDict
+
+import config.config as CONFIG
+import corpusStore
+import metrics
+
+class DocumentSource(object):
+    """Where the PubMed and PMC XML of the publications of a run comes from
+
+    A PMC article is read from the local journal files first, then from the
+    corpus store, and is only requested from PMC when it is in neither.
+    Documents that are not kept elsewhere, e.g. PubMed records, are remembered
+    in memory; only the maxDocuments most recently used are kept, so a long
+    run does not hold every document.
+
+    Example:
+        source = DocumentSource(fetchPMC=requestPMCXML, fetchPubMed=getPubMedXML)
+        pub = extractFromPubmed('', pmc='PMC4321001', docSource=source)
+
+    """
+
+    def __init__(self, fetchPMC=None, fetchPubMed=None, dirs=CONFIG.JOURNAL_DIRS, maxDocuments=CONFIG.DOCUMENT_CACHE_SIZE):
+        """
+        Args:
+            fetchPMC (function, optional): Called with a PMC ID, returns the XML requested from PMC. Default is None.
+            fetchPubMed (function, optional): Called with a PMID, returns the XML requested from PubMed. Default is None.
+            dirs ([str], optional): The directories of the local journal files. Default is CONFIG.JOURNAL_DIRS.
+            maxDocuments (int, optional): The number of documents kept in memory. Default is CONFIG.DOCUMENT_CACHE_SIZE.
+
+        """
+        self.fetchPMC = fetchPMC
+        self.fetchPubMed = fetchPubMed
+        self.dirs = dirs
+        self.files = None
+        self.maxDocuments = maxDocuments
+        self.documents = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def localFiles(self):
+        """Map the PMC IDs of the local journal files to their paths, listed once"""
+        with self.lock:
+            if self.files is None:
+                files = {}
+                for directory in self.dirs:
+                    if not os.path.isdir(directory):
+                        continue
+                    for f in os.listdir(directory):
+                        pmc_regex = re.search(r'[\d]+', f)
+                        if pmc_regex and f.endswith('.xml'):
+                            # the first directory wins, as in CONFIG.JOURNAL_DIRS
+                            files.setdefault(pmc_regex.group(0), os.path.join(directory, f))
+                self.files = files
+        return self.files
+
+    def add(self, kind, identifier, xml_text):
+        """Remember a document that was already retrieved, e.g. by a batched request
+
+        Args:
+            kind (str): 'pmc' or 'pubmed'
+            identifier (str): The PMC ID or the PMID
+            xml_text (str): The XML of the document
+
+        """
+        with self.lock:
+            self.remember((kind, self.normalizeID(kind, identifier)), xml_text)
+
+    def remember(self, key, xml_text):
+        """Keep a document in memory, dropping the least recently used ones; self.lock must be held"""
+        self.documents[key] = xml_text
+        self.documents.move_to_end(key)
+        while len(self.documents)>self.maxDocuments:
+            self.documents.popitem(last=False)
+
+    def normalizeID(self, kind, identifier):
+        if kind=='pmc':
+            return corpusStore.normalizeID(identifier)
+        return str(identifier).strip()
+
+    def fetchOnce(self, kind, identifier, fetch, remember=True):
+        """Call fetch once per document, even when several threads ask for it at the same time
+
+        Args:
+            kind (str): 'pmc' or 'pubmed'
+            identifier (str): The normalized PMC ID or PMID
+            fetch (function): Called with the identifier, returns the XML
+            remember (bool, optional): Keep the XML in memory, see maxDocuments. Default is True.
+
+        Returns:
+            str: The XML of the document
+
+        """
+        key = (kind, identifier)
+        with self.lock:
+            if key in self.documents:
+                metrics.increment('cache_hit', cache='documents')
+                self.documents.move_to_end(key)
+                return self.documents[key]
+            inflight = self.pending.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self.pending[key] = {'done': threading.Event(), 'xml': None}
+        if not owner:
+            # another thread is fetching it, wait for its result
+            inflight['done'].wait()
+            if inflight['xml'] is not None:
+                metrics.increment('cache_hit', cache='documents')
+                return inflight['xml']
+            return fetch(identifier)
+
+        metrics.increment('cache_miss', cache='documents')
+        try:
+            inflight['xml'] = fetch(identifier)
+            if remember:
+                with self.lock:
+                    self.remember(key, inflight['xml'])
+            return inflight['xml']
+        finally:
+            with self.lock:
+                del self.pending[key]
+            inflight['done'].set()
+
+    def readLocalPMC(self, pmcid):
+        """Read the XML of an article from the local journal files, None if there is no file"""
+        path = self.localFiles().get(pmcid)
+        if path is None:
+            return None
+        metrics.increment('cache_hit', cache='journal_files')
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def fetchPMCXML(self, pmcid):
+        """Retrieve the XML of an article from the local files or from PMC, without the corpus store
+
+        Used as the fetch function of corpusStore.fillStore, which stores the result.
+
+        Args:
+            pmcid (str/int): The PMC ID of the article
+
+        Returns:
+            str: The XML of the article
+
+        """
+        pmcid = corpusStore.normalizeID(pmcid)
+        xml_text = self.readLocalPMC(pmcid)
+        if xml_text is not None:
+            return xml_text
+        return self.fetchOnce('pmc', pmcid, self.fetchPMC, remember=False)
+
+    def getPMCXML(self, pmcid):
+        """Retrieve the XML of an article: local files, then the corpus store, then PMC
+
+        An article requested from PMC is added to the corpus store; it is only
+        remembered in memory if it could not be stored.
+
+        Args:
+            pmcid (str/int): The PMC ID of the article
+
+        Returns:
+            str: The XML of the article
+
+        """
+        pmcid = corpusStore.normalizeID(pmcid)
+        xml_text = self.readLocalPMC(pmcid)
+        if xml_text is None:
+            xml_text = corpusStore.getXML(pmcid)
+        if xml_text is None:
+            with self.lock:
+                xml_text = self.documents.get(('pmc', pmcid))
+        if xml_text is None:
+            xml_text = self.fetchOnce('pmc', pmcid, self.fetchPMC, remember=False)
+            if not corpusStore.putArticle(pmcid, xml_text):
+                self.add('pmc', pmcid, xml_text)
+        return xml_text
+
+    def getPubMedXML(self, pmid):
+        """Retrieve the PubMed XML of a publication, requested once while it is kept in memory
+
+        Args:
+            pmid (str/int): The PMID of the publication
+
+        Returns:
+            str: The XML returned by PubMed
+
+        """
+        return self.fetchOnce('pubmed', str(pmid).strip(), self.fetchPubMed)
@@ -1,5 +1,6 @@
 from io import BytesIO
-import pycurl, json, sys, re
+import pycurl, json, sys, re, os, tempfile
+from treeMap import buildTreeMap, saveTreeMap, fileVersion, aliasTokens
 
 query_link = 'https://query.wikidata.org/bigdata/namespace/wdq/sparql?format=json&query=SELECT%20?itemLabel%20?item%20?itemAltLabel%20WHERE%20{%20{%20?item%20wdt:P31%20wd:Q31855.%20}%20UNION%20{%20?item%20wdt:P31%20wd:Q3918.%20}%20UNION%20{%20?item%20wdt:P31%20wd:Q189004.%20}%20UNION%20{%20?item%20wdt:P31%20wd:Q902104.%20}%20UNION%20{%20?item%20wdt:P31%20wd:Q875538.%20}%20UNION%20{%20?item%20wdt:P31%20wd:Q43229.%20}%20UNION%20{%20?item%20wdt:P31%20wd:Q494230.%20}%20SERVICE%20wikibase:label%20{%20bd:serviceParam%20wikibase:language%20%22en%22.%20}%20}';
 
@@ -22,61 +23,222 @@ SELECT ?itemLabel ?item ?itemAltLabel WHERE {
 }
 '''
 
+# labels of wikidata items without an english label, e.g. Q123456
+ITEM_ID_REGEX = re.compile(r'^Q[\d]{1,8}$')
+WHITESPACE_REGEX = re.compile(r'\s+')
+# skips the whitespace and the comma between two bindings
+SEPARATOR_REGEX = re.compile(r'[\s,]*')
+
+def iterBindings(f, chunkSize=1<<16):
+    """Iterate over the bindings of a SPARQL json result without loading it whole
+
+    The file is read in chunks and the objects of the 'bindings' array are
+    decoded one at a time with json.JSONDecoder.raw_decode.
+
+    Args:
+        f (file): The SPARQL json result, opened in text mode
+        chunkSize (int, optional): The number of characters read at once. Default is 65536.
+
+    Returns:
+        generator: Yields one binding (dict) at a time
+
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    # skip the head of the result, up to the start of the bindings array
+    while True:
+        idx = buf.find('"bindings"')
+        start = buf.find('[', idx) if idx>=0 else -1
+        if start>=0:
+            buf = buf[start+1:]
+            break
+        chunk = f.read(chunkSize)
+        if not chunk:
+            return
+        buf += chunk
+
+    pos = 0
+    while True:
+        pos = SEPARATOR_REGEX.match(buf, pos).end()
+        if buf.startswith(']', pos):
+            return
+        try:
+            binding, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # the binding is not complete yet, read more of the file
+            chunk = f.read(chunkSize)
+            if not chunk:
+                raise ValueError('Incomplete SPARQL result')
+            buf = buf[pos:]+chunk
+            pos = 0
+            continue
+        yield binding
+
+def normalizeAlias(alias):
+    """Trim an alias and collapse its whitespace, e.g. ' AdW' -> 'AdW'"""
+    return WHITESPACE_REGEX.sub(' ', alias).strip()
+
+def addEntry(entries, name, aliases, source, entry_type):
+    """Add an institution or funder to the entries, merging it with an entry of the same name
+
+    Aliases are normalized and deduplicated on their tree map words, so that
+    aliases that only differ by case, commas or dashes are kept once.
+
+    Args:
+        entries (dict): The entries, by name
+        name (str): The name of the institution or funder
+        aliases ([str]): Its aliases
+        source (str): Where the entry comes from, e.g. 'wikidata' or 'funding'
+        entry_type (str): The type of the entry, e.g. 'institution' or 'gov'
+
+    """
+    name = normalizeAlias(name)
+    if not name or ITEM_ID_REGEX.match(name):
+        return
+    entry = entries.get(name)
+    if entry is None:
+        entry = {'name': name, 'aliases': [], 'sources': [], 'types': [], 'keys': set([tuple(aliasTokens(name))])}
+        entries[name] = entry
+    if source not in entry['sources']:
+        entry['sources'].append(source)
+    if entry_type and entry_type not in entry['types']:
+        entry['types'].append(entry_type)
+    for alias in aliases:
+        alias = normalizeAlias(alias)
+        key = tuple(aliasTokens(alias))
+        if key and key not in entry['keys']:
+            entry['keys'].add(key)
+            entry['aliases'].append(alias)
+
+def buildEntries(bindings, funders=[]):
+    """Merge the wikidata institutions and the funding agencies
+
+    Args:
+        bindings (iterable): The SPARQL bindings, see iterBindings
+        funders ([dict]): The funding agencies, with the format of utilities/funding.json
+
+    Returns:
+        [dict]: The entries sorted by name, with this format:
+        {'name': 'National Science Foundation', 'aliases': ['NSF'], 'sources': ['funding'], 'types': ['gov']}
+
+    """
+    entries = {}
+    for item in bindings:
+        aliases = []
+        if 'itemAltLabel' in item:
+            aliases = item['itemAltLabel']['value'].split(',')
+        addEntry(entries, item['itemLabel']['value'], aliases, 'wikidata', 'institution')
+    num_institutions = len(entries)
+    print('Processed', num_institutions, 'institutions')
+
+    for item in funders:
+        addEntry(entries, item['name'], item.get('aliases', []), 'funding', item.get('type', 'funder'))
+    print('Added', len(entries)-num_institutions, 'funding agencies')
+
+    result = []
+    for name in sorted(entries):
+        entry = entries[name]
+        del entry['keys']
+        result.append(entry)
+    return result
+
+def writeAliases(entries, output_filename, cached_file):
+    """Write the entries and their compiled tree map
+
+    Args:
+        entries ([dict]): The entries returned by buildEntries
+        output_filename (str): The alias file read by createTreeMap
+        cached_file (str): The compiled tree map, stamped with the version of the alias file
+
+    Returns:
+        str: The version (modification time and size) of the alias file, see fileVersion
+
+    """
+    with open(output_filename, 'w') as outfile:
+        json.dump(entries, outfile, sort_keys=True)
+    version = fileVersion(output_filename)
+    saveTreeMap(buildTreeMap(entries), version, cached_file)
+    return version
+
 def main():
-    args = sys.argv
+    """Usage:
+        python getInstitutions.py [output_file] [funding_file] [--sparql saved.json] [--cache cached_tree_map.json]
+
+    --sparql reads a saved SPARQL json result instead of querying wikidata.
+    """
+    args = sys.argv[1:]
+    sparql_file = None
+    if '--sparql' in args:
+        idx = args.index('--sparql')
+        sparql_file = args[idx+1]
+        del args[idx:idx+2]
+    cached_file = './utilities/cached_tree_map.json'
+    if '--cache' in args:
+        idx = args.index('--cache')
+        cached_file = args[idx+1]
+        del args[idx:idx+2]
+
     output_filename = './utilities/inst_alias.json'
-    if len(args)>1:
-        output_filename = args[1]
+    if len(args)>0:
+        output_filename = args[0]
 
     funding_file = None
-    if len(args)==3:
-        funding_file = args[2]
+    if len(args)==2:
+        funding_file = args[1]
 
-    new_list = []
-    try:
-        r_text = makeRequest(query_link)
-        json_body = json.loads(r_text)
-
-        inst_list = json_body['results']['bindings']
-        for item in inst_list:
-            name = item['itemLabel']['value']
-            m = re.search('^Q[\d]{1,8}$', name)
-            if m:
-                continue
-            institution = {'name': name}
-            if 'itemAltLabel' in item:
-                aliases_str = item['itemAltLabel']['value']
-                institution['aliases'] = aliases_str.split(',')
-            else:
-                institution['aliases'] = []
-            new_list.append(institution)
-    except:
-        print('Error')
-
-    print('Processed', len(new_list), 'entries')
+    funders = []
     if funding_file:
         with open(funding_file, 'r') as f:
-            json_body = json.load(f)
-            for item in json_body:
-                new_list.append({'name': item['name'], 'aliases':item['aliases']})
-        print('Added',len(json_body),'funding agencies')
-    with open(output_filename, 'w') as outfile:
-        json.dump(new_list, outfile)
+            funders = json.load(f)
+
+    downloaded = None
+    if not sparql_file:
+        downloaded = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        downloaded.close()
+        downloadFile(query_link, downloaded.name)
+        sparql_file = downloaded.name
+
+    try:
+        with open(sparql_file, 'r', encoding='utf-8') as f:
+            entries = buildEntries(iterBindings(f), funders)
+    finally:
+        if downloaded:
+            os.remove(downloaded.name)
 
+    # an empty or failed query would overwrite the aliases with the funders only
+    if not any('wikidata' in entry['sources'] for entry in entries):
+        print('No institutions found in the SPARQL result,', output_filename, 'was not written')
+        sys.exit(1)
+
+    version = writeAliases(entries, output_filename, cached_file)
+    print('Wrote', len(entries), 'entries, version', version)
+
+
+def downloadFile(link, filename):
+    """Stream the content of a link to a file"""
+    with open(filename, 'wb') as f:
+        c = pycurl.Curl()
+        c.setopt(c.URL, link)
+        c.setopt(c.HTTPHEADER, ['Accept: application/sparql-results+json'])
+        c.setopt(c.WRITEDATA, f)
+        try:
+            c.perform()
+        finally:
+            c.close()
 
 def makeRequest(link):
-	buffer = BytesIO()
-	c = pycurl.Curl()
-	c.setopt(c.URL, link)
-	c.setopt(c.WRITEDATA, buffer)
-	c.perform()
-	c.close()
-
-	body = buffer.getvalue()
-	# Body is a byte string.
-	# We have to know the encoding in order to print it to a text file
-	# such as standard output.
-	return body.decode('iso-8859-1')
+    buffer = BytesIO()
+    c = pycurl.Curl()
+    c.setopt(c.URL, link)
+    c.setopt(c.WRITEDATA, buffer)
+    c.perform()
+    c.close()
+
+    body = buffer.getvalue()
+    # Body is a byte string.
+    # We have to know the encoding in order to print it to a text file
+    # such as standard output.
+    return body.decode('iso-8859-1')
 
 if __name__ == '__main__':
     main()
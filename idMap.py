@@ -0,0 +1,323 @@
+import os, sys, csv, gzip, json, sqlite3, threading, time, tempfile, pycurl
+from urllib.parse import quote
+
+import config.config as CONFIG
+import metrics
+
+# path of the SQLite map; None disables it (every id is resolved with idconv)
+store_file = CONFIG.ID_MAP_FILE
+
+# one connection per thread, sqlite connections can not be shared
+local = threading.local()
+# serializes the writes of all threads
+write_lock = threading.Lock()
+# ids that idconv did not find during this run, normalized id -> time; also kept in the misses table
+missed = {}
+
+IDCONV_URL = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS ids (pmcid TEXT PRIMARY KEY, pmid TEXT, doi TEXT)',
+    'CREATE INDEX IF NOT EXISTS ids_pmid ON ids (pmid)',
+    'CREATE INDEX IF NOT EXISTS ids_doi ON ids (doi)',
+    'CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS misses (id TEXT PRIMARY KEY, date REAL)'
+]
+
+def getConnection():
+    """Open (once per thread) the connection to the map
+
+    Returns:
+        sqlite3.Connection: The connection. Returns None if the map is disabled.
+
+    """
+    if store_file is None:
+        return None
+    conn = getattr(local, 'conn', None)
+    if conn is None or getattr(local, 'file', None)!=store_file:
+        directory = os.path.dirname(store_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(store_file, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        local.conn = conn
+        local.file = store_file
+    return conn
+
+def idType(identifier):
+    """Return the kind of an identifier: 'pmcid', 'pmid' or 'doi'"""
+    identifier = str(identifier).strip()
+    if identifier.lower().startswith('pmc'):
+        return 'pmcid'
+    if identifier.isdigit():
+        return 'pmid'
+    return 'doi'
+
+def normalizeID(identifier):
+    """Normalize an identifier to the form stored in the map: 'PMC123', '123' or a lowercase DOI"""
+    identifier = str(identifier).strip()
+    kind = idType(identifier)
+    if kind=='pmcid':
+        return 'PMC'+identifier[3:]
+    if kind=='doi':
+        return identifier.lower()
+    return identifier
+
+def toRecord(row):
+    return {'pmcid': row[0], 'pmid': row[1], 'doi': row[2]}
+
+def lookup(identifier):
+    """Resolve one identifier with the local map only
+
+    Args:
+        identifier (str): A PMC ID (e.g. 'PMC4321001'), a PMID or a DOI
+
+    Returns:
+        dict: The {'pmcid': ..., 'pmid': ..., 'doi': ...} of the publication
+        (missing ids are None). Returns None if the identifier is not in the map.
+
+    """
+    conn = getConnection()
+    if conn is None:
+        return None
+    kind = idType(identifier)
+    row = conn.execute('SELECT pmcid, pmid, doi FROM ids WHERE '+kind+'=?', (normalizeID(identifier),)).fetchone()
+    return toRecord(row) if row else None
+
+def saveRecords(records):
+    """Add records (e.g. from idconv) to the map"""
+    conn = getConnection()
+    rows = [(record['pmcid'], record.get('pmid'), record['doi'].lower() if record.get('doi') else None)
+        for record in records if record.get('pmcid')]
+    if conn is None or not rows:
+        return
+    with write_lock:
+        conn.executemany('INSERT OR REPLACE INTO ids VALUES (?, ?, ?)', rows)
+        conn.commit()
+
+def isKnownMiss(identifier, max_age=CONFIG.ID_MISS_MAX_AGE):
+    """Check if idconv did not find an identifier less than max_age seconds ago"""
+    key = normalizeID(identifier)
+    date = missed.get(key)
+    if date is None:
+        conn = getConnection()
+        row = conn.execute('SELECT date FROM misses WHERE id=?', (key,)).fetchone() if conn is not None else None
+        date = row[0] if row else None
+    return date is not None and time.time()-date<max_age
+
+def saveMisses(identifiers):
+    """Remember the identifiers idconv did not find, so they are not requested again"""
+    now = time.time()
+    keys = [normalizeID(identifier) for identifier in identifiers]
+    if not keys:
+        return
+    conn = getConnection()
+    with write_lock:
+        for key in keys:
+            missed[key] = now
+        if conn is not None:
+            conn.executemany('INSERT OR REPLACE INTO misses VALUES (?, ?)', [(key, now) for key in keys])
+            conn.commit()
+
+def requestIDConv(identifiers, makeRequest):
+    """Resolve identifiers with the NCBI idconv service, CONFIG.IDCONV_BATCH_SIZE per request
+
+    Args:
+        identifiers ([str]): Identifiers of the same kind
+        makeRequest (function): Called with a link, returns the response (e.g. scrape.makeRequest)
+
+    Returns:
+        ([dict], set): The records of the identifiers that were found, and the
+        identifiers of the batches whose request failed (they are neither found nor missing)
+
+    """
+    records = []
+    failed = set()
+    for start in range(0, len(identifiers), CONFIG.IDCONV_BATCH_SIZE):
+        batch = identifiers[start:start+CONFIG.IDCONV_BATCH_SIZE]
+        link = IDCONV_URL+'?tool='+quote(CONFIG.NCBI_TOOL)
+        if CONFIG.NCBI_EMAIL:
+            link += '&email='+quote(CONFIG.NCBI_EMAIL)
+        link += '&format=json&ids='+','.join(quote(identifier, safe='/') for identifier in batch)
+        try:
+            json_body = json.loads(makeRequest(link))
+        except Exception as e:
+            # e.g. a network error or an html error page; the ids are left to the esearch fallback
+            metrics.increment('failures', stage='idconv')
+            print('Could not resolve', len(batch), 'ids with idconv', e)
+            failed.update(batch)
+            continue
+        for record in json_body.get('records', []):
+            if 'status' not in record or record['status']!='error':
+                records.append({'pmcid': record.get('pmcid'), 'pmid': record.get('pmid'), 'doi': record.get('doi')})
+    return (records, failed)
+
+def resolveIDs(identifiers, makeRequest):
+    """Resolve many identifiers: locally first, then with batched idconv requests for the misses
+
+    Identifiers that idconv did not find are remembered (see isKnownMiss) and
+    are not requested again. Resolving the identifiers of a whole batch at once,
+    before they are extracted one by one, fills the map with few requests.
+
+    Args:
+        identifiers ([str]): PMC IDs, PMIDs or DOIs (may be mixed)
+        makeRequest (function): Called with a link, returns the response (e.g. scrape.makeRequest)
+
+    Returns:
+        dict: The {'pmcid': ..., 'pmid': ..., 'doi': ...} record of every identifier that was resolved
+
+    """
+    results = {}
+    misses = {}
+    for identifier in identifiers:
+        record = lookup(identifier)
+        if record:
+            metrics.increment('cache_hit', cache='idmap')
+            results[identifier] = record
+        elif isKnownMiss(identifier):
+            metrics.increment('skipped_requests', cache='idmap')
+        else:
+            metrics.increment('cache_miss', cache='idmap')
+            misses.setdefault(idType(identifier), []).append(identifier)
+
+    for kind, kind_misses in misses.items():
+        found, failed = requestIDConv([normalizeID(identifier) for identifier in kind_misses], makeRequest)
+        saveRecords(found)
+        by_id = {}
+        for record in found:
+            if record.get(kind):
+                by_id[normalizeID(record[kind])] = record
+        for identifier in kind_misses:
+            if normalizeID(identifier) in by_id:
+                results[identifier] = by_id[normalizeID(identifier)]
+        saveMisses([identifier for identifier in kind_misses
+            if normalizeID(identifier) not in by_id and normalizeID(identifier) not in failed])
+    return results
+
+def resolveID(identifier, makeRequest):
+    """Resolve one identifier, see resolveIDs
+
+    Returns:
+        dict: The record of the identifier. Returns None if it could not be resolved.
+
+    """
+    return resolveIDs([identifier], makeRequest).get(identifier)
+
+def loadCSV(filename, batchSize=50000):
+    """Replace the map with the content of NCBI's PMC-ids.csv(.gz) dump
+
+    The rows are loaded into a new table that replaces the old one in a
+    single transaction, so lookups keep working during a refresh. A dump
+    without any row does not replace the map.
+
+    Args:
+        filename (str): The path of PMC-ids.csv or PMC-ids.csv.gz
+        batchSize (int, optional): The number of rows inserted at once. Default is 50000.
+
+    Returns:
+        int: The number of rows loaded.
+
+    """
+    conn = getConnection()
+    if conn is None:
+        return 0
+    opener = gzip.open if filename.endswith('.gz') else open
+    total = 0
+    with write_lock:
+        conn.execute('DROP TABLE IF EXISTS ids_new')
+        conn.execute('CREATE TABLE ids_new (pmcid TEXT PRIMARY KEY, pmid TEXT, doi TEXT)')
+        with opener(filename, 'rt', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            rows = []
+            for line in reader:
+                if not line.get('PMCID'):
+                    continue
+                rows.append((line['PMCID'], line.get('PMID') or None, line['DOI'].lower() if line.get('DOI') else None))
+                if len(rows)>=batchSize:
+                    conn.executemany('INSERT OR REPLACE INTO ids_new VALUES (?, ?, ?)', rows)
+                    total += len(rows)
+                    rows = []
+            conn.executemany('INSERT OR REPLACE INTO ids_new VALUES (?, ?, ?)', rows)
+            total += len(rows)
+
+        if total==0:
+            print('no ids in', filename+', the map is kept')
+            conn.execute('DROP TABLE ids_new')
+            conn.commit()
+            return 0
+
+        conn.execute('DROP TABLE ids')
+        conn.execute('ALTER TABLE ids_new RENAME TO ids')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.execute('INSERT OR REPLACE INTO info VALUES (?, ?)', ('loaded', str(time.time())))
+        # the ids idconv did not find may be in the new dump
+        conn.execute('DELETE FROM misses')
+        conn.commit()
+        missed.clear()
+    return total
+
+def loadedTime():
+    """Return the time the map was last loaded from the dump, 0 if never"""
+    conn = getConnection()
+    if conn is None:
+        return 0
+    row = conn.execute("SELECT value FROM info WHERE key='loaded'").fetchone()
+    return float(row[0]) if row else 0
+
+def refresh(max_age=CONFIG.ID_MAP_MAX_AGE, url=CONFIG.PMC_IDS_URL, force=False):
+    """Download and load the PMC-ids dump if the map is older than max_age
+
+    Args:
+        max_age (float, optional): The age in seconds after which the map is reloaded. Default is CONFIG.ID_MAP_MAX_AGE.
+        url (str, optional): The link of the dump. Default is CONFIG.PMC_IDS_URL.
+        force (bool, optional): Reload even if the map is recent. Default is False.
+
+    Returns:
+        int: The number of rows loaded, 0 if the map was recent enough or the download failed.
+
+    """
+    if store_file is None or (not force and time.time()-loadedTime()<max_age):
+        return 0
+    downloaded = tempfile.NamedTemporaryFile(suffix='.csv.gz', delete=False)
+    try:
+        c = pycurl.Curl()
+        c.setopt(c.URL, url)
+        c.setopt(c.WRITEDATA, downloaded)
+        c.setopt(c.FOLLOWLOCATION, True)
+        try:
+            c.perform()
+            status = c.getinfo(c.RESPONSE_CODE)
+        finally:
+            c.close()
+            downloaded.close()
+        # an error page is not a dump, the map is kept
+        if url.lower().startswith('http') and status!=200:
+            print('Could not download', url, 'status', status)
+            return 0
+        return loadCSV(downloaded.name)
+    finally:
+        os.remove(downloaded.name)
+
+def main():
+    """Usage:
+        python idMap.py --refresh           download the PMC-ids dump if the map is out of date
+        python idMap.py --load PMC-ids.csv  load a downloaded dump
+        python idMap.py ID [ID ...]         resolve ids with the local map
+    """
+    args = sys.argv[1:]
+    if '--refresh' in args:
+        print(refresh(force='--force' in args), 'ids loaded')
+    elif '--load' in args:
+        print(loadCSV(args[args.index('--load')+1]), 'ids loaded')
+    elif args:
+        for identifier in args:
+            print(identifier, json.dumps(lookup(identifier)))
+    else:
+        print(main.__doc__)
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,77 @@
-import threading, os, re, json
-from integrate import generateCompleteJSON, converToSolrFormat, pushToSolr, migrateOldEntries
-from scrape import makeRequest
+import threading, queue, os, re, json, sys
+from integrate import generateCompleteJSON, converToSolrFormat, pushToSolr, migrateOldEntries, iterSolrDocs, prefetchGithubData, prefetchCrossRefInfo, cleanDOI, flushBioCIndex, findSolrDoc, postSolrUpdates
+from scrape import makeRequest, requestPMCXML, getPubMedXML
+from documentSource import DocumentSource
+from repoIndex import mergeEntries, entryRepo, entryUpdate, RepoIndex
+import corpusStore
+import idMap
 import config.config as CONFIG
+import metrics
 
 
 all_entries = []
+# the Solr ids and publications of the repositories indexed during the run, see insertToSolr
+repo_index = RepoIndex()
 
 class pubThread(threading.Thread):
-    def __init__(self, threadID, pmcids):
+    def __init__(self, threadID, pmcids, docSource=None):
         threading.Thread.__init__(self)
         self.threadID = threadID
         self.pmcids = pmcids
+        self.docSource = docSource
 
     def run(self):
         print('Starting thread', self.threadID)
         for pmcid in self.pmcids:
-            entry = generateCompleteJSON(pmc=pmcid, source='PMC Extraction')
+            entry = generateCompleteJSON(pmc=pmcid, source='PMC Extraction', docSource=self.docSource)
             entry = converToSolrFormat(entry)
             all_entries.append(entry)
 
 class migrateThread(threading.Thread):
-    def __init__(self, threadID, entries):
+    def __init__(self, threadID, entry_queue):
         threading.Thread.__init__(self)
         self.threadID = threadID
-        self.entries = entries
+        self.entry_queue = entry_queue
 
     def run(self):
         print('Starting thread', self.threadID)
-        for entry in self.entries:
+        while True:
+            entry = self.entry_queue.get()
+            # None tells the worker that no more entries will arrive
+            if entry is None:
+                self.entry_queue.task_done()
+                break
             try:
-                new_entry = migrateOldEntries(entry)
+                try:
+                    new_entry = migrateOldEntries(entry)
+                except:
+                    print(entry['id'])
+                    metrics.increment('retries', stage='migrate')
+                    new_entry = migrateOldEntries(entry)
                 all_entries.append(new_entry)
             except:
-                print(entry['id'])
-                new_entry = migrateOldEntries(entry)
-                all_entries.append(new_entry)
+                metrics.increment('failures', stage='migrate')
+                print('Could not migrate', entry['id'])
+            finally:
+                self.entry_queue.task_done()
+
+class solrPageThread(threading.Thread):
+    def __init__(self, page_queue, rows, cursor):
+        threading.Thread.__init__(self)
+        self.page_queue = page_queue
+        self.rows = rows
+        self.cursor = cursor
+
+    def run(self):
+        try:
+            for page in iterOldEntries(rows=self.rows, cursor=self.cursor):
+                self.page_queue.put(page)
+        except Exception as e:
+            print('Could not read page from', CONFIG.OLD_SOLR_URL, e)
+        self.page_queue.put(None)
 
 
-def genEntryUsingThreads(pmcids, numThreads=16):
+def genEntryUsingThreads(pmcids, numThreads=16, docSource=None):
     print('total publications:', len(pmcids))
     threads = []
     numEntriesPerThread = int(len(pmcids)/numThreads)
@@ -49,7 +83,7 @@ def genEntryUsingThreads(pmcids, numThreads=16):
             endIdx+=1
         print(startIdx, endIdx, endIdx-startIdx)
         pmcid_arr = pmcids[startIdx:endIdx]
-        t = pubThread(i, pmcid_arr)
+        t = pubThread(i, pmcid_arr, docSource)
         threads.append(t)
         t.start()
 
@@ -62,67 +96,199 @@ def genEntryUsingThreads(pmcids, numThreads=16):
 
 def insertNewEntries():
 
-    using_dir = CONFIG.JOURNAL_DIRS
+    pmcids = corpusStore.getJournalIDs(CONFIG.JOURNAL_DIRS)
 
-    filesInDir = []
-    for directory in using_dir:
-        filesInDir += [s for s in os.listdir(directory)]
+    # the articles are read from the journal files, PMC is only asked for the others;
+    # the store is filled for lda and word2vec, the extraction reads the files directly
+    source = DocumentSource(fetchPMC=requestPMCXML, fetchPubMed=getPubMedXML, dirs=CONFIG.JOURNAL_DIRS)
+    corpusStore.fillStore(pmcids, source.fetchPMCXML)
+    # the ids of every article are resolved in batches, not one request per article
+    try:
+        idMap.resolveIDs(['PMC'+pmcid for pmcid in pmcids], makeRequest)
+    except Exception as e:
+        print('Could not resolve the ids of the articles', e)
+    genEntryUsingThreads(pmcids, docSource=source)
+    insertToSolr()
+    flushBioCIndex()
 
-    pmcids = []
-    for f in filesInDir:
-        pmc_regex = re.search('[\d]+', f)
-        if pmc_regex:
-            pmc = pmc_regex.group(0)
-            pmcids.append(pmc)
+def updateRepoDoc(repoIndex, repo_id, entry):
+    """Add the publications of an entry that are not in Solr yet to the document of its repository
 
-    genEntryUsingThreads(pmcids)
-    insertToSolr()
+    Returns:
+        int: 1 if the document was updated. Otherwise, 0.
+
+    """
+    update = entryUpdate(repoIndex.solrID(repo_id), entry, repoIndex.publications(repo_id))
+    if update is None or postSolrUpdates([update]):
+        return 0
+    for doi in entry.get('publicationDOI', []):
+        repoIndex.add(repo_id, doi)
+    return 1
 
-def insertToSolr():
+def insertToSolr(repoIndex=repo_index):
     totalAdded = 0
-    for entry in all_entries:
+    totalUpdated = 0
+    # a tool published in several papers is indexed once, with every publication
+    entries = mergeEntries(all_entries)
+    print(len(all_entries)-len(entries), 'entries merged with another publication of their repository')
+    for entry in entries:
         # converted_entry = converToSolrFormat(entry)
         # print(converted_entry)
-        status = pushToSolr(entry, checkCollisions=True, ignoreMissing=True)
-    	# if not status:
-    	# 	print(json.dumps(entry, indent=2))
-        totalAdded+=status
-    print(totalAdded, 'new entries added')
+        repo_id = entryRepo(entry)
+        if repo_id is None:
+            totalAdded += pushToSolr(entry, checkCollisions=True, ignoreMissing=True)
+            continue
+        if not repoIndex.isIndexed(repo_id):
+            status = pushToSolr(entry, checkCollisions=True, ignoreMissing=True)
+            if status:
+                repoIndex.setIndexed(repo_id, entry['id'], entry.get('publicationDOI', []))
+                totalAdded += status
+                continue
+            # a collision: the repository was indexed by a previous run, its document gets the new publications
+            doc = findSolrDoc(entry['publicationDOI'][0]) if entry.get('publicationDOI') else None
+            if doc is None:
+                continue
+            dois = doc.get('publicationDOI', [])
+            repoIndex.setIndexed(repo_id, doc['id'], dois if isinstance(dois, list) else [dois])
+        # the repository is already in Solr (an earlier page or run), its document gets the new publications
+        totalUpdated += updateRepoDoc(repoIndex, repo_id, entry)
+    print(totalAdded, 'new entries added,', totalUpdated, 'entries updated with another publication')
 
-def migrateUsingThreads(entries, numThreads=16):
-    print('total publications:', len(entries))
+def startMigrateThreads(entry_queue, numThreads=16):
     threads = []
-    numEntriesPerThread = int(len(entries)/numThreads)
-    remainder = len(entries)%numThreads
-    startIdx = 0
-    endIdx = numEntriesPerThread
     for i in range(numThreads):
-        if i < remainder:
-            endIdx+=1
-        print(startIdx, endIdx, endIdx-startIdx)
-        entry_arr = entries[startIdx:endIdx]
-        t = migrateThread(i, entry_arr)
+        t = migrateThread(i, entry_queue)
         threads.append(t)
         t.start()
+    return threads
 
-        startIdx = endIdx
-        endIdx+=numEntriesPerThread
-
+def stopMigrateThreads(entry_queue, threads):
+    for t in threads:
+        entry_queue.put(None)
     for t in threads:
         t.join()
 
-def migrate(rows=20000):
-    link = CONFIG.OLD_SOLR_URL+'select?q=*%3A*&start=0&rows='+str(rows)+'&wt=json&indent=true'
+def migrateUsingThreads(entries, numThreads=16):
+    print('total publications:', len(entries))
+    entry_queue = queue.Queue()
+    threads = startMigrateThreads(entry_queue, numThreads)
+    for entry in entries:
+        entry_queue.put(entry)
+    stopMigrateThreads(entry_queue, threads)
+
+def iterOldEntries(rows=CONFIG.MIGRATE_PAGE_SIZE, cursor='*'):
+    """Page through every document of the old Solr core
 
-    r_text = makeRequest(link)
-    json_body = json.loads(r_text)
-    print('migrating', json_body['response']['numFound'], 'entries')
-    migrateUsingThreads(json_body['response']['docs'])
+    Args:
+        rows (int, optional): The number of documents requested per page.
+        Default is CONFIG.MIGRATE_PAGE_SIZE.
+        cursor (str, optional): The cursorMark to start from. Default is '*',
+        the beginning of the core.
 
-    insertToSolr()
+    Returns:
+        generator: See iterSolrDocs
+
+    """
+    return iterSolrDocs(CONFIG.OLD_SOLR_URL, rows=rows, cursor=cursor, uniqueKey=CONFIG.MIGRATE_UNIQUE_KEY)
+
+def pageLinks(docs):
+    """List the source code and other links of a page of old Solr documents"""
+    links = []
+    for doc in docs:
+        for field in ['sourceCodeURL', 'linkUrls']:
+            value = doc.get(field, [])
+            links += value if isinstance(value, list) else [value]
+    return links
+
+def loadCursor(cursor_file=CONFIG.MIGRATE_CURSOR_FILE):
+    if os.path.isfile(cursor_file):
+        with open(cursor_file, 'r') as f:
+            return json.load(f)
+    return {'cursorMark': '*', 'migrated': 0}
+
+def saveCursor(state, cursor_file=CONFIG.MIGRATE_CURSOR_FILE):
+    with open(cursor_file+'.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(cursor_file+'.tmp', cursor_file)
+
+def migrate(rows=CONFIG.MIGRATE_PAGE_SIZE, resume=False, numThreads=16):
+    """Migrate every entry of the old Solr core to the new Solr core
+
+    Pages are streamed to the migration threads as they arrive, while the next
+    page is already being requested. Once a page is pushed to Solr, the cursor
+    is saved so that an interrupted migration can be resumed.
+
+    Args:
+        rows (int, optional): The number of documents requested per page.
+        Default is CONFIG.MIGRATE_PAGE_SIZE.
+        resume (bool, optional): If True, continue from the cursor saved in
+        CONFIG.MIGRATE_CURSOR_FILE. Default is False.
+        numThreads (int, optional): The number of migration threads. Default is 16.
+
+    Returns:
+        int: The number of entries migrated.
+
+    """
+    state = {'cursorMark': '*', 'migrated': 0}
+    if resume:
+        state = loadCursor()
+        print('resuming after', state['migrated'], 'entries')
+
+    # at most one page is waiting while another one is migrated
+    page_queue = queue.Queue(maxsize=1)
+    entry_queue = queue.Queue(maxsize=rows)
+    reader = solrPageThread(page_queue, rows, state['cursorMark'])
+    reader.start()
+    threads = startMigrateThreads(entry_queue, numThreads)
+
+    finished = False
+    while True:
+        page = page_queue.get()
+        if page is None:
+            break
+        docs, next_cursor, numFound = page
+        if state['cursorMark']=='*':
+            print('migrating', numFound, 'entries')
+
+        # resolve the github repositories and the dois of the page in a few batched queries
+        dois = [cleanDOI(doc['publicationDOI']) for doc in docs if doc.get('publicationDOI')]
+        prefetchGithubData(pageLinks(docs))
+        prefetchCrossRefInfo(dois)
+        try:
+            idMap.resolveIDs(dois, makeRequest)
+        except Exception as e:
+            # the entries are still migrated, their ids are resolved one by one
+            print('Could not resolve the dois of the page', e)
+        for doc in docs:
+            entry_queue.put(doc)
+        entry_queue.join()
+
+        insertToSolr()
+        del all_entries[:]
+        # the bioconductor packages parsed so far are kept with the cursor
+        flushBioCIndex()
+
+        finished = next_cursor==state['cursorMark']
+        state['cursorMark'] = next_cursor
+        state['migrated'] += len(docs)
+        saveCursor(state)
+        print(state['migrated'], 'of', numFound, 'entries migrated')
+
+    stopMigrateThreads(entry_queue, threads)
+    reader.join()
+
+    # a finished migration starts from the beginning next time
+    if finished and os.path.isfile(CONFIG.MIGRATE_CURSOR_FILE):
+        os.remove(CONFIG.MIGRATE_CURSOR_FILE)
+
+    return state['migrated']
 
 def main():
-    migrate()
+    metrics.reset()
+    migrate(resume='--resume' in sys.argv)
+    print(metrics.summary())
+    if CONFIG.METRICS_FILE:
+        metrics.export(CONFIG.METRICS_FILE)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,177 @@
+import json, math, re, threading
+from functools import lru_cache
+
+ALIAS_FILE = './utilities/inst_alias.json'
+# number of distinct affiliation strings whose resolution is remembered
+MEMO_SIZE = 100000
+# tokens in more aliases than this (e.g. 'university', 'of') do not generate candidates
+MAX_POSTINGS = 2000
+# share of the (idf weighted) words of an alias that must appear in the affiliation
+MIN_COVERAGE = 0.8
+# lowest similarity of a resolved affiliation
+MIN_SCORE = 0.5
+
+TOKEN_REGEX = re.compile(r'[^\w&]+')
+
+# the index is built once per process, see loadIndex
+index = None
+index_lock = threading.Lock()
+
+def normalize(text):
+    """Split a name, alias or affiliation into lowercase words, without punctuation
+
+    Args:
+        text (str): e.g. 'Univ. of California, San-Diego'
+
+    Returns:
+        (str, ...): The tuple of words, e.g. ('univ', 'of', 'california', 'san', 'diego')
+
+    """
+    return tuple(token for token in TOKEN_REGEX.split(text.lower().replace('_', ' ')) if token)
+
+def buildIndex(entries):
+    """Build the inverted index of the names and aliases of institutions
+
+    Args:
+        entries ([dict]): The {'name': 'phrase1', 'aliases': ['alias1', 'alias2']} entries
+
+    Returns:
+        dict: The index:
+        'names': the canonical name of every alias,
+        'tokens': the set of words of every alias,
+        'weights': the sum of the idf of the words of every alias,
+        'postings': the aliases of every word,
+        'idf': the inverse document frequency of every word,
+        'max_idf': the idf of the rarest word
+
+    """
+    names = []
+    tokens = []
+    seen = set()
+    for entry in entries:
+        for alias in [entry['name']]+list(entry.get('aliases', [])):
+            words = normalize(alias)
+            if words and (words, entry['name']) not in seen:
+                seen.add((words, entry['name']))
+                names.append(entry['name'])
+                tokens.append(frozenset(words))
+
+    postings = {}
+    for alias_id, words in enumerate(tokens):
+        for word in words:
+            postings.setdefault(word, []).append(alias_id)
+
+    num_aliases = len(tokens)
+    idf = {word: math.log(1+num_aliases/len(ids)) for word, ids in postings.items()}
+    weights = [sum(idf[word] for word in words) for words in tokens]
+    return {'names': names, 'tokens': tokens, 'weights': weights, 'postings': postings, 'idf': idf,
+        'max_idf': max(idf.values()) if idf else 0}
+
+def loadIndex(filename=ALIAS_FILE):
+    """Load the alias file and build its index, once
+
+    Returns:
+        dict: The index, see buildIndex
+
+    """
+    global index
+    with index_lock:
+        if index is None:
+            with open(filename, 'r') as f:
+                index = buildIndex(json.load(f))
+    return index
+
+def bestMatch(words, inst_index, required=()):
+    """Find the alias that is the most similar to a sequence of words
+
+    The candidates are the aliases that share a rare word with the sequence.
+    Their similarity is the idf weighted Dice coefficient of the two sets of
+    words, and aliases whose words are mostly missing are ignored.
+
+    Args:
+        words ((str)): The normalized words
+        inst_index (dict): The index, see buildIndex
+        required ((str), optional): Words that the alias must contain. Default is none.
+
+    Returns:
+        (float, float, str): The similarity, the idf weight of the matched words
+        and the canonical name. Returns (0, 0, None) if nothing matches.
+
+    """
+    postings = inst_index['postings']
+    idf = inst_index['idf']
+    query = set(word for word in words if word in idf)
+    if not query:
+        return (0, 0, None)
+    query_weight = sum(idf[word] for word in set(words) if word in idf)
+    # words missing from every alias still count, as a rare word
+    query_weight += len(set(words)-query)*inst_index['max_idf']
+
+    candidates = set()
+    for word in query:
+        if len(postings[word])<=MAX_POSTINGS:
+            candidates.update(postings[word])
+
+    required = frozenset(required) & query
+    best = (0, 0, None)
+    for alias_id in sorted(candidates):
+        if not required <= inst_index['tokens'][alias_id]:
+            continue
+        alias_weight = inst_index['weights'][alias_id]
+        matched = sum(idf[word] for word in inst_index['tokens'][alias_id] & query)
+        if matched<MIN_COVERAGE*alias_weight:
+            continue
+        score = 2*matched/(alias_weight+query_weight)
+        if (score, matched)>best[:2]:
+            best = (score, matched, inst_index['names'][alias_id])
+    return best
+
+@lru_cache(maxsize=MEMO_SIZE)
+def resolveAffiliation(affiliation):
+    """Find the canonical institution of an affiliation
+
+    The affiliation is split on commas and every part is compared with the
+    aliases. A part is also joined with the next one when the name continues
+    after a comma, e.g. 'University of California, San Diego, La Jolla, CA'.
+    The first part that resolves wins, since the institution comes before the
+    city and the country. Results are
+    memoized, since the same affiliations repeat across the papers of a lab.
+
+    Args:
+        affiliation (str): The affiliation
+
+    Returns:
+        str: The canonical name of the institution. Returns None if no alias is similar enough.
+
+    """
+    inst_index = loadIndex()
+    parts = [normalize(part) for part in affiliation.split(',')]
+    parts = [part for part in parts if part]
+    for i in range(len(parts)):
+        best = bestMatch(parts[i], inst_index)
+        if i+1<len(parts):
+            # the alias must contain the whole part to continue it
+            match = bestMatch(parts[i]+parts[i+1], inst_index, required=parts[i])
+            # on equal similarity, the longer match wins
+            if match[:2]>best[:2]:
+                best = match
+        if best[0]>=MIN_SCORE:
+            return best[2]
+    return None
+
+def resolveInstitutions(affiliations):
+    """Find the canonical institutions of many affiliations
+
+    Args:
+        affiliations ([str]): The affiliations, e.g. pub['institutions']
+
+    Returns:
+        [str]: The distinct canonical names, in the order of the affiliations.
+
+    """
+    institutions = []
+    for affiliation in affiliations:
+        name = resolveAffiliation(affiliation)
+        if name and name not in institutions:
+            institutions.append(name)
+    return institutions
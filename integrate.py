@@ -1,12 +1,19 @@
 from io import BytesIO
 from nltk.tokenize import sent_tokenize
 from nltk.corpus import stopwords
-import os, datetime, requests, json, re, bs4, pycurl, subprocess
+import os, datetime, requests, json, re, bs4, pycurl, subprocess, threading, time, copy, mmap, multiprocessing
 import xml.etree.ElementTree as ET
+from urllib.parse import quote
 import config.config as CONFIG
+import metrics
 
 from scrape import extractName, extractLinks, extractFromXML, extractFromPubmed, makeRequest, getTreeMap
 from treeMap import createTreeMap, checkDict, getLongestWord, createDict
+from institutionResolver import resolveInstitutions
+from interning import authorName, compactArray
+from repoIndex import parseRepoLink
+from resultCache import ResultCache
+from concurrent.futures import ThreadPoolExecutor
 
 
 stopwords = set(stopwords.words('english'))
@@ -14,6 +21,47 @@ stopwords = set(stopwords.words('english'))
 
 REPO_FILTER_WORDS = ['github', 'bitbucket', 'sourceforge', 'bioconductor']
 
+# local index of bioconductor packages, see getBioCIndex
+bioc_index = None
+bioc_lock = threading.Lock()
+# the time of the last failed download of the index and the number of packages parsed since the last save
+bioc_failed = 0
+bioc_unsaved = 0
+
+# matches any of the filter words in the raw bytes of a file
+FILTER_REGEX = re.compile(('|'.join(REPO_FILTER_WORDS)).encode('ascii'), re.IGNORECASE)
+
+def hasFilterWord(path):
+	"""Check the body of an XML file for one of the filter words
+
+	The raw bytes of the file are searched first (memory-mapped, case-insensitive),
+	so that only the files that contain a filter word somewhere are parsed.
+
+    Args:
+        path (str): The path of the XML file
+
+    Returns:
+        bool: True if the body of the article has one of the filter words.
+
+    """
+	with open(path, 'rb') as f:
+		if os.fstat(f.fileno()).st_size==0:
+			return False
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			if not FILTER_REGEX.search(data):
+				return False
+
+	root = ET.parse(path).getroot()
+	#found = root.find("./article/front/article-meta/abstract")
+	found = root.find("./article/body")
+	if found is None:
+		return False
+	body = ET.tostring(found, encoding='utf-8', method='text').decode('utf-8').lower()
+	for word in REPO_FILTER_WORDS:
+		if word in body:
+			return True
+	return False
+
 def filterXML(filename, cur_dir, move_dir):
 	"""Move files that have one of the filter words
 
@@ -28,100 +76,357 @@ def filterXML(filename, cur_dir, move_dir):
 
     """
 	if filename and os.path.isfile(cur_dir+filename):
-		tree = ET.parse(cur_dir+filename)
-		root = tree.getroot()
-		#found = root.find("./article/front/article-meta/abstract")
-		found = root.find("./article/body")
-		if found is not None:
-			abstract = ET.tostring(found, encoding='utf-8', method='text')
-			abstract = abstract.lower()
-			for word in REPO_FILTER_WORDS:
-				if word in abstract:
-					print(filename)
-					os.rename(cur_dir+filename, move_dir+filename)
-					return 1
+		if hasFilterWord(cur_dir+filename):
+			print(filename)
+			os.rename(cur_dir+filename, move_dir+filename)
+			return 1
 	return 0
 
+def classifyXML(path):
+	"""Worker of filterDirectories: returns (path, has filter word, size in bytes)"""
+	try:
+		return (path, hasFilterWord(path), os.path.getsize(path))
+	except (OSError, ET.ParseError) as e:
+		print('Could not read', path, e)
+		return (path, False, 0)
 
+def filterDirectories(dirs, move_dir, processes=None, batchSize=500, dryRun=False):
+	"""Move every XML file of whole directories that has one of the filter words
 
-def getGithubData(repo_link):
-	"""Extract github data given the github link
-
-	Makes an HTTP request to github using Github REST API
+	The files are classified by a pool of processes with hasFilterWord, and the
+	matching ones are moved in batches to move_dir.
 
     Args:
-        repo_link (str): The link/url for the github repository
+        dirs ([str]): The directories to scan, e.g. CONFIG.JOURNAL_DIRS
+        move_dir (str): The directory in which the matching files are moved to.
+        processes (int, optional): The number of processes. Default is the number of CPUs.
+        batchSize (int, optional): The number of matching files moved at once. Default is 500.
+        dryRun (bool, optional): If True, report the matching files without moving them. Default is False.
 
     Returns:
-        obj: The return value is an object with the data.
+        dict: The report of the scan, e.g.
+        {'scanned': 1000, 'matched': 120, 'moved': 120, 'bytes': 52428800, 'seconds': 2.1,
+         'files_per_second': 476.2, 'mb_per_second': 23.8, 'matches': ['../bioinformatics/123.xml',...]}
 
     """
-	reg_format = True
-	m = re.search('(www\.)?github.(com|org)\/[\S]+?\/[\w.-]+', repo_link)
-	if not m:
-		reg_format = False
-		m = re.search('[\w-]+\.github.(com|org|io)?(\/[\w-]+)*', repo_link)
+	start = time.perf_counter()
+	paths = []
+	for directory in dirs:
+		paths += [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.xml')]
 
-	if not m:
-		return {}
+	report = {'scanned': 0, 'matched': 0, 'moved': 0, 'bytes': 0, 'matches': []}
+	batch = []
 
-	filtered_repo_link = m.group(0)
+	def moveBatch(batch):
+		for path in batch:
+			if os.path.abspath(os.path.dirname(path))!=os.path.abspath(move_dir):
+				os.rename(path, os.path.join(move_dir, os.path.basename(path)))
+				report['moved'] += 1
 
+	pool = multiprocessing.Pool(processes)
+	try:
+		for path, matched, size in pool.imap_unordered(classifyXML, paths, chunksize=64):
+			report['scanned'] += 1
+			report['bytes'] += size
+			if matched:
+				report['matched'] += 1
+				report['matches'].append(path)
+				batch.append(path)
+			if len(batch)>=batchSize:
+				if not dryRun:
+					moveBatch(batch)
+				batch = []
+	finally:
+		pool.close()
+		pool.join()
+	if batch and not dryRun:
+		moveBatch(batch)
+
+	report['seconds'] = time.perf_counter()-start
+	report['files_per_second'] = report['scanned']/report['seconds'] if report['seconds'] else 0
+	report['mb_per_second'] = report['bytes']/1048576/report['seconds'] if report['seconds'] else 0
+	report['matches'].sort()
+
+	for path in report['matches']:
+		print(('would move ' if dryRun else 'moved ')+path)
+	print('%d files scanned, %d matched, %d moved in %.1f s (%.1f files/s, %.1f MB/s)' % (report['scanned'], report['matched'],
+		report['moved'], report['seconds'], report['files_per_second'], report['mb_per_second']))
+	return report
+
+
+
+# fields of a repository in a GitHub GraphQL query
+GITHUB_FIELDS = """name owner { login } description primaryLanguage { name } diskUsage forkCount stargazerCount
+	createdAt updatedAt issues(states: OPEN) { totalCount } pullRequests(states: OPEN) { totalCount }
+	homepageUrl licenseInfo { name }"""
+
+# metadata of the repositories by 'owner/repo' (lowercase), {} if the repository does not exist
+github_cache = ResultCache('github', ttl=CONFIG.GITHUB_CACHE_TTL)
+bitbucket_cache = ResultCache('bitbucket', ttl=CONFIG.REPO_CACHE_TTL)
+sourceforge_cache = ResultCache('sourceforge', ttl=CONFIG.REPO_CACHE_TTL)
+# github links of the sourceforge projects that moved, by project name (lowercase)
+sourceforge_moved = ResultCache('sourceforge_moved')
+# information of the publications by doi (lowercase), {} if Crossref does not know it
+crossref_cache = ResultCache('crossref')
+
+# runs the independent requests of one repository concurrently
+subrequest_pool = ThreadPoolExecutor(max_workers=CONFIG.SUBREQUEST_THREADS)
+
+def parseGithubLink(repo_link):
+	"""Find the repository of a github link
+
+    Args:
+        repo_link (str): The link/url for the github repository, e.g. github.com/owner/repo or owner.github.io/repo
+
+    Returns:
+        (str, str): The canonical link and the 'owner/repo' of the repository. Returns None if it is not a github link.
 
-	repo = ''
-	if reg_format:
-		repo = filtered_repo_link[filtered_repo_link.find('/')+1:]
+    """
+	repo_id = parseRepoLink(repo_link)
+	if repo_id is None or repo_id.host!='github' or repo_id.repo is None:
+		return None
+	return (repo_id.link, repo_id.key)
+
+def githubObject(node):
+	"""Convert a repository of a GraphQL response to the format of getGithubData (without repo_link)"""
+	obj = {}
+	obj['name'] = node['name']
+	obj['type'] = 'github'
+	obj['forks'] = node['forkCount']
+	obj['watchers'] = node['stargazerCount']
+	obj['owner'] = node['owner']['login']
+	obj['description'] = node['description']
+	obj['language'] = node['primaryLanguage']['name'] if node['primaryLanguage'] else None
+	obj['size'] = node['diskUsage']
+	if node['createdAt']:
+		obj['created_at'] = node['createdAt']
+	if node['updatedAt']:
+		obj['updated_at'] = node['updatedAt']
+
+	# like the REST API, open issues include the open pull requests
+	obj['open_issues'] = node['issues']['totalCount']+node['pullRequests']['totalCount']
+	obj['homepage'] = node['homepageUrl']
+	if node['licenseInfo']:
+		obj['license'] = node['licenseInfo']['name']
 	else:
-		repo = filtered_repo_link[:filtered_repo_link.find('.')]
-		slash_idx = filtered_repo_link.find('/')
-		if slash_idx>0:
-			repo+= filtered_repo_link[slash_idx:]
-		else:
-			repo = repo+'/'+repo
+		obj['license'] = 'No License'
+	return obj
+
+def githubRESTObject(github_obj):
+	"""Convert a repository of the REST API to the format of getGithubData (without repo_link)"""
+	obj = {}
+	obj['name'] = github_obj['name']
+	obj['type'] = 'github'
+	obj['forks'] = github_obj['forks_count']
+	obj['watchers'] = github_obj['watchers_count']
+	obj['owner'] = github_obj['owner']['login']
+	obj['description'] = github_obj['description']
+	obj['language'] = github_obj['language']
+	obj['size'] = github_obj['size']
+	if github_obj['created_at']:
+		obj['created_at'] = github_obj['created_at']
+	if github_obj['updated_at']:
+		obj['updated_at'] = github_obj['updated_at']
+
+	obj['open_issues'] = github_obj['open_issues']
+	obj['homepage'] = github_obj['homepage']
+	if github_obj.get('license'):
+		obj['license'] = github_obj['license']['name']
+	else:
+		obj['license'] = 'No License'
+	return obj
 
-	if repo.endswith('.git'):
-		repo = repo[:-4]
+def fetchGithubRepos(repos):
+	"""Retrieve the metadata of many repositories with GitHub GraphQL queries
 
-	link = 'https://api.github.com/repos/'+repo
-	link+='?client_id=046041908fb0240cb92e&client_secret=5d1cf3216d6af9aff470fbb6047b1644af7c0c7f'
+	Every query resolves CONFIG.GITHUB_BATCH_SIZE repositories, one alias per
+	repository. GraphQL follows renamed and transferred repositories.
+	Without CONFIG.GITHUB_TOKEN, the REST API is queried once per repository.
+
+    Args:
+        repos ([str]): The 'owner/repo' of the repositories
+
+    Returns:
+        dict: The metadata (see githubObject) of every 'owner/repo' (lowercase) that
+        was looked up; {} for the repositories that do not exist. A repository that
+        could not be looked up (e.g. an exhausted rate limit) is left out, so it is retried.
+
+    """
+	results = {}
+	if not CONFIG.GITHUB_TOKEN:
+		for repo in repos:
+			link = 'https://api.github.com/repos/'+repo
+			try:
+				github_obj = json.loads(makeRequest(link))
+				if 'message' in github_obj and github_obj['message']=='Moved Permanently' and 'url' in github_obj:
+					github_obj = json.loads(makeRequest(github_obj['url']))
+			except Exception as e:
+				metrics.increment('failures', stage='github')
+				print('Could not query', link, e)
+				continue
+			if 'name' in github_obj:
+				results[repo.lower()] = githubRESTObject(github_obj)
+			elif github_obj.get('message')=='Not Found':
+				results[repo.lower()] = {}
+			else:
+				# e.g. 'API rate limit exceeded', nothing is known about the repository
+				metrics.increment('failures', stage='github')
+				print('Could not query', link, github_obj.get('message'))
+		return results
+
+	headers = ['Authorization: bearer '+CONFIG.GITHUB_TOKEN, 'Content-Type: application/json']
+	for start in range(0, len(repos), CONFIG.GITHUB_BATCH_SIZE):
+		batch = repos[start:start+CONFIG.GITHUB_BATCH_SIZE]
+		queries = []
+		for i, repo in enumerate(batch):
+			owner, name = repo.split('/', 1)
+			queries.append('r%d: repository(owner: %s, name: %s) { %s }' % (i, json.dumps(owner), json.dumps(name), GITHUB_FIELDS))
+		query = 'query { '+' '.join(queries)+' }'
+		r_text = makeRequest(CONFIG.GITHUB_GRAPHQL_URL, data=json.dumps({'query': query}), headers=headers)
+		json_body = json.loads(r_text)
+		data = json_body.get('data')
+		if not data:
+			# e.g. a bad token or an exhausted rate limit, nothing is known about the batch
+			print('GitHub GraphQL query failed', r_text[:200])
+			continue
+		# only a NOT_FOUND error means that the repository does not exist;
+		# the other errors (FORBIDDEN, RATE_LIMITED, ...) leave it to be retried
+		not_found = set()
+		for error in json_body.get('errors') or []:
+			if error.get('type')=='NOT_FOUND' and error.get('path'):
+				not_found.add(error['path'][0])
+		for i, repo in enumerate(batch):
+			alias = 'r%d' % i
+			node = data.get(alias)
+			if node:
+				results[repo.lower()] = githubObject(node)
+			elif alias in not_found:
+				results[repo.lower()] = {}
+			else:
+				metrics.increment('failures', stage='github')
+	return results
+
+def prefetchGithubData(links):
+	"""Retrieve, in batches, the metadata of every github repository of a list of links
+
+	The results are cached, so that the following getGithubData calls do not
+	make any request.
+
+    Args:
+        links ([str]): Links/urls; the ones that are not github repositories are ignored
+
+    Returns:
+        int: The number of repositories retrieved.
+
+    """
+	repos = {}
+	for link in links:
+		parsed = parseGithubLink(link)
+		if parsed and '/' in parsed[1]:
+			repos.setdefault(parsed[1].lower(), parsed[1])
+	missing = [repos[key] for key in github_cache.missing(list(repos))]
+	if not missing:
+		return 0
 	try:
-		r_text = makeRequest(link)
-		github_obj = json.loads(r_text)
-		if 'message' in github_obj and github_obj['message']=='Moved Permanently' and 'url' in github_obj:
-			r_text = makeRequest(github_obj['url'])
-			github_obj = json.loads(r_text)
+		results = fetchGithubRepos(missing)
+	except Exception as e:
+		print('Could not prefetch github repositories', e)
+		return 0
+	for key, obj in results.items():
+		github_cache.set(key, obj)
+	return len(results)
+
+@metrics.timed
+def getGithubData(repo_link):
+	"""Extract github data given the github link
 
-		obj = {}
-		obj['name'] = github_obj['name']
-		obj['type'] = 'github'
-		obj['repo_link'] = filtered_repo_link
-		obj['forks'] = github_obj['forks_count']
-		obj['watchers'] = github_obj['watchers_count']
-		obj['owner'] = github_obj['owner']['login']
-		obj['description'] = github_obj['description']
-		obj['language'] = github_obj['language']
-		obj['size'] = github_obj['size']
-		if github_obj['created_at']:
-			obj['created_at'] = github_obj['created_at']
-		if github_obj['updated_at']:
-			obj['updated_at'] = github_obj['updated_at']
-
-		obj['open_issues'] = github_obj['open_issues']
-		obj['homepage'] = github_obj['homepage']
-		if 'license' in github_obj:
-			obj['license'] = github_obj['license']['name']
-		else:
-			obj['license'] = 'No License'
+	Reads the cache filled by prefetchGithubData, or makes a GitHub
+	GraphQL request (see fetchGithubRepos)
+
+    Args:
+        repo_link (str): The link/url for the github repository
+
+    Returns:
+        obj: The return value is an object with the data.
+
+    """
+	parsed = parseGithubLink(repo_link)
+	if not parsed or '/' not in parsed[1]:
+		return {}
+	filtered_repo_link, repo = parsed
+
+	try:
+		obj = github_cache.get(repo.lower())
+		if obj is None:
+			obj = fetchGithubRepos([repo]).get(repo.lower())
+			if obj is None:
+				return {}
+			github_cache.set(repo.lower(), obj)
+		if not obj:
+			return {}
 
+		obj = dict(obj)
+		obj['repo_link'] = filtered_repo_link
 		return obj
 	except:
 		return {}
 	return {}
 
+def parseBitbucketLink(repo_link):
+	"""Find the repository of a bitbucket link
+
+    Args:
+        repo_link (str): The link/url for the bitbucket repository
+
+    Returns:
+        (str, str): The canonical link and the 'owner/repo' of the repository. Returns None if it is not a bitbucket link.
+
+    """
+	repo_id = parseRepoLink(repo_link)
+	if repo_id is None or repo_id.host!='bitbucket' or repo_id.repo is None:
+		return None
+	return (repo_id.link, repo_id.key)
+
+def parseBitbucketRepo(bitbucket_obj, watchers_obj, forks_obj):
+	"""Convert the responses of the Bitbucket API to the format of getBitbucketData (without repo_link)
+
+    Args:
+        bitbucket_obj (dict): The repository
+        watchers_obj (dict): The watchers page, only its 'size' is read
+        forks_obj (dict): The forks page, only its 'size' is read
+
+    Returns:
+        obj: The data of the repository
+
+    """
+	obj = {}
+	obj['name'] = bitbucket_obj['name']
+	obj['type'] = 'bitbucket'
+	obj['owner'] = bitbucket_obj['owner']['username']
+	obj['description'] = bitbucket_obj['description']
+	obj['language'] = bitbucket_obj['language']
+	obj['size'] = bitbucket_obj['size']
+
+	if bitbucket_obj['created_on']:
+		obj['created_at'] = bitbucket_obj['created_on'].replace('+00:00', 'Z')
+	if bitbucket_obj['updated_on']:
+		obj['updated_at'] = bitbucket_obj['updated_on'].replace('+00:00', 'Z')
+		# obj['updated_at'] = datetime.datetime.strptime(bitbucket_obj['updated_on'].split('T')[0], '%Y-%m-%d')
+
+	obj['homepage'] = bitbucket_obj['website']
+	obj['license'] = 'No License'
+	obj['watchers'] = watchers_obj['size']
+	obj['forks'] = forks_obj['size']
+	return obj
+
+@metrics.timed
 def getBitbucketData(repo_link):
 	"""Extract bitbucket data given the bitbucket link
 
-	Makes an HTTP request to github using Bitbucket REST API
+	Makes HTTP requests to Bitbucket REST API: the repository, its watchers
+	and its forks are requested concurrently. Only the size of the watchers
+	and forks is downloaded (fields=size), not their pages. A repository that
+	moved is followed up to CONFIG.MAX_REDIRECTS times.
 
     Args:
         repo_link (str): The link/url for the bitbucket repository
@@ -130,164 +435,193 @@ def getBitbucketData(repo_link):
         obj: The return value is an object with the data.
 
     """
-	m = re.search('(www\.)?bitbucket.(com|org)\/[\S]+?\/[\w.-]+', repo_link)
-
-	repo = ''
-	if not m:
-		m = re.search('[\w-]+\.bitbucket.(com|org)?(\/[\w-]+)*', repo_link)
-		if not m:
+	for i in range(CONFIG.MAX_REDIRECTS+1):
+		parsed = parseBitbucketLink(repo_link)
+		if not parsed:
 			return {}
-		else:
-			filtered_repo_link = m.group(0)
-			repo = filtered_repo_link[:filtered_repo_link.find('.')]
-			repo = repo+'/'+repo
-	else:
-		filtered_repo_link = m.group(0)
-		repo = filtered_repo_link[filtered_repo_link.find('/')+1:]
-
-	if repo.endswith('.git'):
-		repo = repo[:-4]
+		filtered_repo_link, repo = parsed
 
-	link = 'https://api.bitbucket.org/2.0/repositories/'+repo
-	try:
-		r_text = makeRequest(link)
-		if r_text[0]=='{':
-			bitbucket_obj = json.loads(r_text)
-			obj = {}
-			obj['name'] = bitbucket_obj['name']
-			obj['type'] = 'bitbucket'
+		obj = bitbucket_cache.get(repo.lower())
+		if obj is not None:
+			if not obj:
+				return {}
+			obj = dict(obj)
 			obj['repo_link'] = filtered_repo_link
-			obj['owner'] = bitbucket_obj['owner']['username']
-			obj['description'] = bitbucket_obj['description']
-			obj['language'] = bitbucket_obj['language']
-			obj['size'] = bitbucket_obj['size']
-
-			if bitbucket_obj['created_on']:
-				obj['created_at'] = bitbucket_obj['created_on'].replace('+00:00', 'Z')
-			if bitbucket_obj['updated_on']:
-				obj['updated_at'] = bitbucket_obj['updated_on'].replace('+00:00', 'Z')
-				# obj['updated_at'] = datetime.datetime.strptime(bitbucket_obj['updated_on'].split('T')[0], '%Y-%m-%d')
-
-			obj['homepage'] = bitbucket_obj['website']
-			obj['license'] = 'No License'
-
-			r_text = makeRequest(link+'/watchers')
-			obj['watchers'] = json.loads(r_text)['size']
-
-			r_text = makeRequest(link+'/forks')
-			obj['forks'] = json.loads(r_text)['size']
 			return obj
-		elif 'github' in r_text:
-			return getGithubData(r_text[:-1])
-		elif 'bitbucket' in r_text:
-			return getBitbucketData(r_text[:-1])
-	except:
+
+		link = 'https://api.bitbucket.org/2.0/repositories/'+repo
+		try:
+			repo_request = subrequest_pool.submit(makeRequest, link)
+			watchers_request = subrequest_pool.submit(makeRequest, link+'/watchers?fields=size')
+			forks_request = subrequest_pool.submit(makeRequest, link+'/forks?fields=size')
+			r_text = repo_request.result()
+			if r_text[0]=='{':
+				bitbucket_obj = json.loads(r_text)
+				if bitbucket_obj.get('type')=='error':
+					# e.g. the repository does not exist
+					bitbucket_cache.set(repo.lower(), {})
+					return {}
+				obj = parseBitbucketRepo(bitbucket_obj, json.loads(watchers_request.result()), json.loads(forks_request.result()))
+				bitbucket_cache.set(repo.lower(), obj)
+				obj = dict(obj)
+				obj['repo_link'] = filtered_repo_link
+				return obj
+			elif 'github' in r_text:
+				return getGithubData(r_text[:-1])
+			elif 'bitbucket' in r_text:
+				# the repository moved, the response is its new link
+				repo_link = r_text[:-1]
+				continue
+		except:
+			return {}
 		return {}
 	return {}
 
 
-def getSourceforgeData(repo_link):
-	"""Extract sourceforge data given the sourceforge link
-
-	Makes an HTTP request to github using Sourceforge REST API
+def parseSourceforgeLink(repo_link):
+	"""Find the project of a sourceforge link
 
     Args:
         repo_link (str): The link/url for the sourceforge repository
 
     Returns:
-        obj: The return value is an object with the data.
+        (str, str): The canonical link and the name of the project. Returns None if it is not a sourceforge link.
 
-	"""
+    """
+	repo_id = parseRepoLink(repo_link)
+	if repo_id is None or repo_id.host!='sourceforge':
+		return None
+	return (repo_id.link, repo_id.key)
 
-	reg_format = True
-	m = re.search('(www\.)?sourceforge.(com|net)\/[\S]+?\/[\w.-]+', repo_link)
-	if not m:
-		reg_format = False
-		m = re.search('[\w-]+\.sourceforge.(com|net|io)?(\/[\w-]+)*', repo_link)
+def sourceforgeMovedLink(sf_obj):
+	"""Return the github link a sourceforge project moved to, or None"""
+	if sf_obj['external_homepage'] and 'github' in sf_obj['external_homepage']:
+		return sf_obj['external_homepage']
+	if sf_obj.get('moved_to_url') and 'github' in sf_obj['moved_to_url']:
+		return sf_obj['moved_to_url']
+	return None
 
-	if not m:
-		return {}
+def parseSourceforgeProject(sf_obj, activity_obj=None, stats_obj=None, github_obj=None):
+	"""Convert the responses of the Sourceforge API to the format of getSourceforgeData
 
-	filtered_repo_link = m.group(0)
+    Args:
+        sf_obj (dict): The project
+        activity_obj (dict, optional): The activity of the project. Default is None.
+        stats_obj (dict, optional): The download statistics of the project. Default is None.
+        github_obj (dict, optional): The data of the github repository the project moved to.
+        Default is None, the project did not move.
 
-	repo = ''
-	if reg_format:
-		repo = filtered_repo_link[filtered_repo_link.rfind('/')+1:]
-	else:
-		repo = filtered_repo_link[:filtered_repo_link.find('.')]
+    Returns:
+        obj: The data of the project (without repo_link if it did not move)
 
+    """
+	obj = {}
+	obj['homepage'] = sf_obj['external_homepage']
+	obj['type'] = 'sourceforge'
 
-	link = 'https://sourceforge.net/rest/p/'+repo
+	if github_obj is not None:
+		obj = dict(github_obj)
+	else:
+		obj['name'] = sf_obj['name']
 
-	try:
-		r_text = makeRequest(link)
-		sf_obj = json.loads(r_text)
-		obj = {}
+		if sf_obj['developers']:
+			obj['owner'] = sf_obj['developers'][0]['username']
 
-		obj['homepage'] = sf_obj['external_homepage']
-		obj['repo_link'] = filtered_repo_link
-		obj['type'] = 'sourceforge'
+		if sf_obj['categories']['language']:
+			obj['language'] = sf_obj['categories']['language'][0]['fullname']
+		else:
+			obj['language'] = None
 
-		movedToGH = False
-		if obj['homepage'] and 'github' in obj['homepage']:
-			obj = getGithubData(obj['homepage'])
-			movedToGH = True
-		elif 'github' in sf_obj['moved_to_url']:
-			obj = getGithubData(sf_obj['moved_to_url'])
-			movedToGH  =True
+		try:
+			update_obj = activity_obj['timeline'][0]
+			obj['updated_at'] = datetime.datetime.fromtimestamp(update_obj['published']/1000).strftime('%Y-%m-%dT%H:%M:%SZ')
+		except:
+			obj['updated_at'] = None
 
+	if 'description' not in obj or not obj['description']:
+		obj['description'] = sf_obj['short_description']
 
-		if not movedToGH:
-			obj['name'] = sf_obj['name']
+	if 'license' not in obj or obj['license']=='No License':
+		if sf_obj['categories']['license']:
+			obj['license'] = sf_obj['categories']['license'][0]['fullname']
+		else:
+			obj['license'] = 'No License'
 
-			if sf_obj['developers']:
-				obj['owner'] = sf_obj['developers'][0]['username']
+	obj['created_at'] = datetime.datetime.strptime(sf_obj['creation_date'], '%Y-%m-%d').strftime('%Y-%m-%dT%H:%M:%SZ')
 
-			if sf_obj['categories']['language']:
-				obj['language'] = sf_obj['categories']['language'][0]['fullname']
-			else:
-				obj['language'] = None
+	obj['labels'] = sf_obj['labels']
 
-			try:
-				update_link = link + '/activity'
-				r_text = makeRequest(update_link)
-				update_obj = json.loads(r_text)['timeline'][0]
-				obj['updated_at'] = datetime.datetime.fromtimestamp(update_obj['published']/1000).strftime('%Y-%m-%dT%H:%M:%SZ')
-			except:
-				obj['updated_at'] = None
+	try:
+		obj['downloads'] = stats_obj['total']
+	except:
+		obj['downloads'] = None
 
-		if 'description' not in obj or not obj['description']:
-			obj['description'] = sf_obj['short_description']
+	if 'forks' not in obj:
+		obj['forks'] = 0
 
+	return obj
 
+def requestJSON(link):
+	"""Request a json document, returns None if the request or the decoding fails"""
+	try:
+		return json.loads(makeRequest(link))
+	except:
+		return None
 
-		if 'license' not in obj or obj['license']=='No License':
-			if sf_obj['categories']['license']:
-				obj['license'] = sf_obj['categories']['license'][0]['fullname']
-			else:
-				obj['license'] = 'No License'
+@metrics.timed
+def getSourceforgeData(repo_link):
+	"""Extract sourceforge data given the sourceforge link
 
-		obj['created_at'] = datetime.datetime.strptime(sf_obj['creation_date'], '%Y-%m-%d').strftime('%Y-%m-%dT%H:%M:%SZ')
+	Makes HTTP requests to Sourceforge REST API: the project, its activity
+	and its download statistics are requested concurrently. A project that
+	moved to github is remembered, so later lookups request its github data
+	instead of its activity.
 
-		obj['labels'] = sf_obj['labels']
+    Args:
+        repo_link (str): The link/url for the sourceforge repository
 
+    Returns:
+        obj: The return value is an object with the data.
 
+	"""
+	parsed = parseSourceforgeLink(repo_link)
+	if not parsed:
+		return {}
+	filtered_repo_link, repo = parsed
+
+	obj = sourceforge_cache.get(repo.lower())
+	if obj is None:
+		link = 'https://sourceforge.net/rest/p/'+repo
+		stats_link = 'https://sourceforge.net/projects/'+repo+'/files/stats/json?start_date=2000-1-1&end_date='+datetime.datetime.now().strftime('%Y-%m-%d')
+		moved_link = sourceforge_moved.get(repo.lower())
 		try:
-			stats_link = 'https://sourceforge.net/projects/'+repo+'/files/stats/json?start_date=2000-1-1&end_date='+datetime.datetime.now().strftime('%Y-%m-%d')
-			r_text = makeRequest(stats_link)
-			stats_obj = json.loads(r.text)
-			obj['downloads'] = stats_obj['total']
+			project_request = subrequest_pool.submit(makeRequest, link)
+			stats_request = subrequest_pool.submit(requestJSON, stats_link)
+			if moved_link:
+				github_request = subrequest_pool.submit(getGithubData, moved_link)
+			else:
+				activity_request = subrequest_pool.submit(requestJSON, link+'/activity')
+
+			sf_obj = json.loads(project_request.result())
+			found_link = sourceforgeMovedLink(sf_obj)
+			if found_link:
+				if found_link!=moved_link:
+					sourceforge_moved.set(repo.lower(), found_link)
+					github_obj = getGithubData(found_link)
+				else:
+					github_obj = github_request.result()
+				obj = parseSourceforgeProject(sf_obj, stats_obj=stats_request.result(), github_obj=github_obj)
+			else:
+				activity_obj = activity_request.result() if not moved_link else requestJSON(link+'/activity')
+				obj = parseSourceforgeProject(sf_obj, activity_obj, stats_request.result())
+			sourceforge_cache.set(repo.lower(), obj)
 		except:
-			obj['downloads'] = None
-
-		if 'forks' not in obj:
-			obj['forks'] = 0
-
+			return {}
 
-		return obj
-	except:
-		return {}
-	return {}
+	obj = dict(obj)
+	if 'repo_link' not in obj:
+		obj['repo_link'] = filtered_repo_link
+	return obj
 
 def getBioCName(name, links=[], text=''):
 	"""Generates a list of names given a list of urls, text (usually abstract).
@@ -322,13 +656,9 @@ def getBioCName(name, links=[], text=''):
 
 	# extract the name from the link
 	for link in links:
-		m = re.search('(www\.)?bioconductor.(com|org)(\/[\S]+)+', link)
-		if m:
-			repo_link = m.group(0)
-			repo_name = repo_link[repo_link.rfind('/')+1:]
-			if repo_name.endswith('.html'):
-				repo_name = repo_name[:-5]
-			results.append(repo_name)
+		repo_id = parseRepoLink(link)
+		if repo_id is not None and repo_id.host=='bioconductor':
+			results.append(repo_id.repo)
 
 	# extract the name based on known patterns used to describe a bioconductor tool
 	if text:
@@ -377,91 +707,245 @@ def getBioCName(name, links=[], text=''):
 
 
 
-def getBioCData(repo_name):
-	"""Extract bioconductor data given the name of the tool
+def parseBioCPackageList(html):
+	"""Parse the names of all packages listed on the bioconductor release page
 
-	Makes an HTTP request to bioconductor; parses the html text for metadata
+    Args:
+        html (str): The html text of http://bioconductor.org/packages/release/bioc/
+
+    Returns:
+        [str]: The list of package names (case sensitive)
+
+	"""
+	return sorted(set(re.findall(r'href="html\/([\w.]+)\.html"', html)))
+
+def parseBioCStats(html):
+	"""Parse the download statistics table of bioconductor
 
     Args:
-        reponame (str): The name of the bioconductor tool
+        html (str): The html text of http://bioconductor.org/packages/stats/
 
     Returns:
-        obj: The return value is an object with the data.
+        dict: The number of downloads for each package name
 
 	"""
-	link = 'http://bioconductor.org/packages/release/bioc/html/'+repo_name+'.html'
-	try:
-		obj = {}
+	stats = {}
+	for name, downloads in re.findall(r'([\w.]+)(?:<\/a>)?&nbsp;\(([\d]+)\)', html, re.IGNORECASE):
+		stats[name] = int(downloads)
+	return stats
 
-		r_text = makeRequest(link)
+def parseBioCPage(html, link):
+	"""Parse the metadata from the html page of a bioconductor package
 
-		soup = bs4.BeautifulSoup(r_text, 'html.parser')
-		name = soup.find('h1')
-		if name.string=='Page Not Found':
-			return {}
+    Args:
+        html (str): The html text of the package page
+		link (str): The link/url of the package page
 
-		summary_element = soup.find('div' , class_='do_not_rebase')
-		if summary_element:
-			table_elements = summary_element.find_all('table')
-			detail_table = table_elements[1]
-			package_table = table_elements[2]
+    Returns:
+        obj: The return value is an object with the data. Returns an empty
+		object if the page does not exist. If the package has a git source,
+		its link is stored in 'git_link'.
 
+	"""
+	obj = {}
 
-			row_elements = package_table.find_all('tr')
+	soup = bs4.BeautifulSoup(html, 'html.parser')
+	name = soup.find('h1')
+	if name is None or name.string=='Page Not Found':
+		return {}
 
-			for row_element in row_elements:
-				col_elements = row_element.find_all('td')
-				col_name = col_elements[0].string
-				if col_name=='Git source':
-					tag_element = col_elements[1].find('a')
-					obj = getGithubData(tag_element.string)
-					obj['git_link'] = tag_element.string
+	summary_element = soup.find('div' , class_='do_not_rebase')
+	if summary_element:
+		table_elements = summary_element.find_all('table')
+		detail_table = table_elements[1]
+		package_table = table_elements[2]
+
+
+		row_elements = package_table.find_all('tr')
+
+		for row_element in row_elements:
+			col_elements = row_element.find_all('td')
+			col_name = col_elements[0].string
+			if col_name=='Git source':
+				tag_element = col_elements[1].find('a')
+				obj['git_link'] = tag_element.string
+
+		full_name = summary_element.find('h2')
+		obj['long_name'] = full_name.string
+
+		obj['tags'] = []
+
+		row_elements = detail_table.find_all('tr')
+
+		for row_element in row_elements:
+			col_elements = row_element.find_all('td')
+			col_name = col_elements[0].string
+			if col_name=='biocViews':
+				tag_elements = col_elements[1].find_all('a')
+				for tag_element in tag_elements:
+					if not tag_element.string=='Software':
+						obj['tags'].append(tag_element.string)
+			elif col_name=='License':
+				obj['license'] = col_elements[1].string
+
+		p_elements = summary_element.find_all('p')
+		obj['description'] = p_elements[1].string
+		obj['authors'] = []
+		author_text = p_elements[3].string
+		author_text = author_text[author_text.find(':')+1:]
+		authors = author_text.split(',')
+		for author in authors:
+			author_name = author.split()
+			obj['authors'].append({'first_name':author_name[0], 'last_name': author_name[1]})
+
+	obj['name'] = name.string
+	obj['repo_link'] = link
+	obj['language'] = 'R'
+	obj['type'] = 'bioconductor'
+
+	return obj
+
+@metrics.timed
+def getBioCIndex(cache_file=CONFIG.BIOC_INDEX_FILE, max_age=CONFIG.BIOC_INDEX_MAX_AGE):
+	"""Load the local index of bioconductor packages
+
+	The index holds the package list (with a case-insensitive lookup), the
+	download statistics and the metadata of every package parsed so far.
+	It is built once and cached in cache_file; it is rebuilt when the cached
+	file is older than max_age seconds. If the package list cannot be
+	downloaded, the stale index (kept in bioc_index, or an empty one) is used
+	and the download is tried again after CONFIG.BIOC_INDEX_RETRY seconds.
 
-			full_name = summary_element.find('h2')
-			obj['long_name'] = full_name.string
+    Args:
+        cache_file (str, optional): The path of the cached index. Default is CONFIG.BIOC_INDEX_FILE
+		max_age (int, optional): The maximum age (in seconds) of the cached index. Default is CONFIG.BIOC_INDEX_MAX_AGE
 
-			obj['tags'] = []
+    Returns:
+        dict: The index:
+		{
+			'date': 1497571200.0,
+			'packages': {'deseq2': 'DESeq2',...},
+			'downloads': {'DESeq2': 123456,...},
+			'metadata': {'DESeq2': {...},...}
+		}
 
-			row_elements = detail_table.find_all('tr')
+	"""
+	global bioc_index, bioc_failed
+	with bioc_lock:
+		if bioc_index and time.time()-bioc_index['date'] < max_age:
+			return bioc_index
+
+		# the cached file is read once, a stale one is kept until the download succeeds
+		if bioc_index is None and os.path.isfile(cache_file):
+			with open(cache_file, 'r') as f:
+				bioc_index = json.load(f)
+			if time.time()-bioc_index['date'] < max_age:
+				return bioc_index
+
+		empty_index = {'date': time.time(), 'packages': {}, 'downloads': {}, 'metadata': {}}
+		if time.time()-bioc_failed < CONFIG.BIOC_INDEX_RETRY:
+			return bioc_index or empty_index
+
+		index = {'date': time.time(), 'packages': {}, 'metadata': {}}
+		try:
+			package_names = parseBioCPackageList(makeRequest('http://bioconductor.org/packages/release/bioc/'))
+			for package_name in package_names:
+				index['packages'].setdefault(package_name.lower(), package_name)
+			index['downloads'] = parseBioCStats(makeRequest('http://bioconductor.org/packages/stats/'))
+		except Exception as e:
+			print('Could not download the bioconductor index', e)
+			index['packages'] = {}
+
+		# a failed download of the package list is neither kept nor cached
+		if not index['packages']:
+			metrics.increment('failures', stage='bioc_index')
+			bioc_failed = time.time()
+			return bioc_index or empty_index
+		saveBioCIndex(index, cache_file)
+		bioc_index = index
+		return bioc_index
+
+def saveBioCIndex(index, cache_file=CONFIG.BIOC_INDEX_FILE):
+	with open(cache_file+'.tmp', 'w') as f:
+		json.dump(index, f)
+	os.replace(cache_file+'.tmp', cache_file)
+
+def flushBioCIndex():
+	"""Save the metadata of the packages parsed since the last save, e.g. at the end of a run"""
+	global bioc_unsaved
+	with bioc_lock:
+		if bioc_unsaved and bioc_index and bioc_index['packages']:
+			saveBioCIndex(bioc_index)
+		bioc_unsaved = 0
+
+def findBioCPackage(name, index=None):
+	"""Resolve a candidate name to the name of a bioconductor package
 
-			for row_element in row_elements:
-				col_elements = row_element.find_all('td')
-				col_name = col_elements[0].string
-				if col_name=='biocViews':
-					tag_elements = col_elements[1].find_all('a')
-					for tag_element in tag_elements:
-						if not tag_element.string=='Software':
-							obj['tags'].append(tag_element.string)
-				elif col_name=='License':
-					obj['license'] = col_elements[1].string
+    Args:
+        name (str): A candidate name (usually generated by getBioCName)
+		index (dict, optional): The index returned by getBioCIndex. Default is None, the index is loaded.
 
-			p_elements = summary_element.find_all('p')
-			obj['description'] = p_elements[1].string
-			obj['authors'] = []
-			author_text = p_elements[3].string
-			author_text = author_text[author_text.find(':')+1:]
-			authors = author_text.split(',')
-			for author in authors:
-				author_name = author.split()
-				obj['authors'].append({'first_name':author_name[0], 'last_name': author_name[1]})
+    Returns:
+        str: The case sensitive name of the package. Returns None if no package has this name.
 
+	"""
+	if not name:
+		return None
+	if index is None:
+		index = getBioCIndex()
+	return index['packages'].get(name.strip().lower())
 
-			stats_text = makeRequest('http://bioconductor.org/packages/stats/')
-			m = re.search(name.string+'&nbsp;\([\d]+\)', stats_text)
+@metrics.timed
+def getBioCData(repo_name):
+	"""Extract bioconductor data given the name of the tool
 
-			if m:
-				tool_stat_text = m.group(0)
-				obj['downloads'] = int(tool_stat_text[tool_stat_text.find('(')+1:tool_stat_text.find(')')])
+	The name is resolved against the local bioconductor index, so an HTTP request
+	to bioconductor is only made for existing packages whose metadata has not
+	been parsed yet.
 
-		obj['name'] = name.string
-		obj['repo_link'] = link
-		obj['language'] = 'R'
-		obj['type'] = 'bioconductor'
+    Args:
+        reponame (str): The name of the bioconductor tool
 
-		if 'forks' not in obj:
-			obj['forks'] = 0
+    Returns:
+        obj: The return value is an object with the data.
 
+	"""
+	global bioc_unsaved
+	try:
+		index = getBioCIndex()
+		package_name = findBioCPackage(repo_name, index)
+		if not package_name:
+			metrics.increment('skipped_requests', cache='bioconductor')
+			return {}
 
+		obj = index['metadata'].get(package_name)
+		if obj is not None:
+			metrics.increment('cache_hit', cache='bioconductor')
+		else:
+			metrics.increment('cache_miss', cache='bioconductor')
+			link = 'http://bioconductor.org/packages/release/bioc/html/'+package_name+'.html'
+			obj = parseBioCPage(makeRequest(link), link)
+			if obj and obj['name'] in index['downloads']:
+				obj['downloads'] = index['downloads'][obj['name']]
+			# the index is saved every CONFIG.BIOC_SAVE_EVERY packages, not after each one
+			with bioc_lock:
+				index['metadata'][package_name] = obj
+				bioc_unsaved += 1
+				save = bioc_unsaved>=CONFIG.BIOC_SAVE_EVERY and index is bioc_index
+			if save:
+				flushBioCIndex()
+
+		if not obj:
+			return {}
+		obj = copy.deepcopy(obj)
+
+		if 'git_link' in obj:
+			github_obj = getGithubData(obj['git_link'])
+			github_obj.update(obj)
+			obj = github_obj
+
+		if 'forks' not in obj:
+			obj['forks'] = 0
 
 		return obj
 	except:
@@ -469,10 +953,90 @@ def getBioCData(repo_name):
 	return {}
 
 
+def crossRefHeaders():
+	"""Headers of the Crossref requests; with CONFIG.CROSSREF_MAILTO they are served by the polite pool"""
+	agent = CONFIG.USER_AGENT
+	if CONFIG.CROSSREF_MAILTO:
+		agent += ' (mailto:'+CONFIG.CROSSREF_MAILTO+')'
+	return ['User-Agent: '+agent]
+
+def parseCrossRefWork(content):
+	"""Convert a Crossref work to the format of getCrossRefInfo"""
+	result = {}
+	result['citations'] = content['is-referenced-by-count']
+	result['references'] = content['references-count']
+	result['domain'] = content.get('subject', [])
+	return result
+
+def iterCrossRefInfo(dois):
+	"""Get information from Crossref regarding many publications
+
+	Makes one HTTP request per CONFIG.CROSSREF_BATCH_SIZE DOIs, with a
+	filter=doi:a,doi:b,... query that only selects the fields used. Results
+	are cached by DOI and yielded as soon as their batch arrives.
+
+    Args:
+        dois ([str]): The dois of the publications
+
+    Returns:
+        generator: Yields (doi, obj) pairs, in no particular order, where obj
+        is the information of the publication ({} if Crossref does not know it).
+
+    """
+	pending = []
+	for doi in dict.fromkeys(doi.strip() for doi in dois if doi):
+		result = crossref_cache.get(doi.lower())
+		if result is None:
+			pending.append(doi)
+		else:
+			yield (doi, result)
+
+	for start in range(0, len(pending), CONFIG.CROSSREF_BATCH_SIZE):
+		batch = pending[start:start+CONFIG.CROSSREF_BATCH_SIZE]
+		# a comma would split the filter, such DOIs are looked up alone
+		batch_dois = [doi for doi in batch if ',' not in doi]
+		found = {}
+		if batch_dois:
+			link = CONFIG.CROSSREF_URL+'?filter='+','.join('doi:'+quote(doi, safe='/') for doi in batch_dois)
+			link += '&select=DOI,is-referenced-by-count,references-count,subject&rows='+str(len(batch_dois))
+			if CONFIG.CROSSREF_MAILTO:
+				link += '&mailto='+quote(CONFIG.CROSSREF_MAILTO)
+			try:
+				json_body = json.loads(makeRequest(link, headers=crossRefHeaders()))
+				for content in json_body['message']['items']:
+					found[content['DOI'].lower()] = parseCrossRefWork(content)
+			except Exception as e:
+				print('Crossref query failed', e)
+				continue
+		for doi in batch:
+			if ',' in doi:
+				try:
+					json_body = json.loads(makeRequest(CONFIG.CROSSREF_URL+'/'+quote(doi, safe='/'), headers=crossRefHeaders()))
+					found[doi.lower()] = parseCrossRefWork(json_body['message'])
+				except:
+					pass
+			result = found.get(doi.lower(), {})
+			crossref_cache.set(doi.lower(), result)
+			yield (doi, result)
+
+def prefetchCrossRefInfo(dois):
+	"""Fill the Crossref cache with the information of many publications, see iterCrossRefInfo
+
+    Returns:
+        int: The number of publications.
+
+	"""
+	count = 0
+	for doi, result in iterCrossRefInfo(dois):
+		count += 1
+	return count
+
+@metrics.timed
 def getCrossRefInfo(doi):
 	"""Get information from Crossref regarding a publication
 
-	Makes an HTTP request using Crossref API
+	Reads the cache filled by prefetchCrossRefInfo, or makes an HTTP request
+	using Crossref API
 
     Args:
         doi (str): The doi for the specific publication
@@ -481,21 +1045,9 @@ def getCrossRefInfo(doi):
         obj: The return value is an object with the data.
 
 	"""
-	link = 'https://api.crossref.org/works/'
-	r_text = makeRequest(link+doi)
-
-	result = {}
-	try:
-		json_body = json.loads(r_text)
-		content = json_body['message']
-
-		result['citations'] = content['is-referenced-by-count']
-		result['references'] = content['references-count']
-		result['domain'] = content['subject']
-	except:
-		return {}
-
-	return result
+	for found_doi, result in iterCrossRefInfo([doi]):
+		return result
+	return {}
 
 
 
@@ -523,8 +1075,8 @@ def loadInstitutions(filename):
 	results = {}
 	with open(filename) as f:
 		data = json.load(f)
-		results[entry['name'].lower()] = entry['name']
 		for entry in data:
+			results[entry['name'].lower()] = entry['name']
 			for a in entry['aliases']:
 				results[a.lower()] = entry['name']
 
@@ -533,7 +1085,8 @@ def loadInstitutions(filename):
 
 
 
-def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction'):
+@metrics.timed
+def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction', docSource=None):
 	"""Aggregates all information about a publication, including
 	Publication information from Pubmed, CrossRef info, and code
 	repo info from Github, Bitbucket, Sourceforge, and Bioconductor.
@@ -545,6 +1098,7 @@ def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction'):
 		pmc (str, optional): The PMC ID (if any) for the specific publication
 		doi (str, optional): The DOI for the specific publication
 		source (str, optional): The name of the source or method used to extract the data.
+		docSource (DocumentSource, optional): Where the PubMed and PMC XML are read from, see extractFromPubmed.
 
     Returns:
         obj: The return value is an object with the data.
@@ -554,11 +1108,11 @@ def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction'):
 
 	# extract metadata from Pubmed
 	if pmc:
-		pub = extractFromPubmed('', pmc=pmc)
+		pub = extractFromPubmed('', pmc=pmc, docSource=docSource)
 	elif pmid:
-		pub = extractFromPubmed(pmid)
+		pub = extractFromPubmed(pmid, docSource=docSource)
 	elif doi:
-		pub = extractFromPubmed('', doi=doi)
+		pub = extractFromPubmed('', doi=doi, docSource=docSource)
 	else:
 		return {}
 
@@ -569,29 +1123,18 @@ def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction'):
 	name = extractName(pub['title'], pub['abstract'], repo=pub['repo'],
 		links=[link['link'] for link in pub['links']])
 
-	# check if institution is in tree map data structure
-	institutions = []
-
-	for instit in pub['institutions']:
-		tokens = instit.split(',')
-		temp_map = getTreeMap()
-		if len(tokens)>4:
-			tokens = tokens[:-3]
-		for token in tokens:
-			token = token.strip().lower()
-			filter_token = re.sub('[-–]', ' ', token)
-			temp_map = checkDict(filter_token.split(), temp_map)
-			if type(temp_map)==type({}):
-				continue
-			elif temp_map:
-				institutions.append(temp_map)
-				break
-			else:
-				temp_map = getTreeMap()
+	# map the affiliations to the canonical names of their institutions
+	institutions = resolveInstitutions(pub['institutions'])
 
-	# get code repo info
+	# get code repo info, once per repository
 	obj = {}
+	seen = set()
 	for link in pub['links']:
+		repo_id = parseRepoLink(link['link'])
+		if repo_id is not None:
+			if repo_id in seen:
+				continue
+			seen.add(repo_id)
 		if pub['repo']=='github':
 			obj = getGithubData(link['link'])
 		elif pub['repo']=='bitbucket':
@@ -631,7 +1174,7 @@ def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction'):
 	entry['publication']['pmid'] = pub['pmid']
 	entry['publication']['doi'] = pub['doi']
 	entry['publication']['date'] = pub['date']
-	entry['institutions'] = list(set(institutions))
+	entry['institutions'] = compactArray(institutions)
 	entry['links'] = pub['links']
 	entry['emails'] = pub['emails']
 	entry['tags'] = pub['tags']
@@ -653,6 +1196,61 @@ def generateCompleteJSON(pmid='', pmc='', doi='', source='PMC Extraction'):
 
 
 
+def iterSolrDocs(solr_url, rows=1000, cursor='*', uniqueKey='id', fields=None):
+	"""Page through every document of a Solr core
+
+	Uses Solr deep paging (cursorMark) sorted on the unique key, so the
+	result is complete and stable no matter how large the core is.
+
+    Args:
+        solr_url (str): The url of the Solr core, e.g. CONFIG.NEW_SOLR_URL
+		rows (int, optional): The number of documents requested per page. Default is 1000.
+		cursor (str, optional): The cursorMark to start from. Default is '*', the beginning of the core.
+		uniqueKey (str, optional): The unique key field of the core. Default is 'id'.
+		fields ([str], optional): The fields to return. Default is None (all fields).
+
+    Returns:
+        generator: Yields ([dict], str, int) triples: the documents of a page,
+		the cursorMark that follows the page and the total number of documents.
+
+	"""
+	while True:
+		link = solr_url+'select?q=*%3A*&sort='+uniqueKey+'+asc&rows='+str(rows)+'&cursorMark='+quote(cursor)+'&wt=json'
+		if fields:
+			link += '&fl='+quote(','.join(fields))
+		r_text = makeRequest(link)
+		json_body = json.loads(r_text)
+		next_cursor = json_body['nextCursorMark']
+		yield (json_body['response']['docs'], next_cursor, json_body['response']['numFound'])
+
+		# Solr returns the same cursorMark once every document was read
+		if next_cursor==cursor:
+			break
+		cursor = next_cursor
+
+def postSolrUpdates(docs, commit=True):
+	"""Post a batch of update commands (e.g. atomic updates) to the Solr hosted locally
+
+	Uses curl to POST the documents to the update handler of CONFIG.NEW_SOLR_URL
+
+    Args:
+        docs ([dict]): The documents or atomic updates, e.g. [{'id': 1, 'topics': {'set': [3, 12]}}]
+		commit (bool, optional): If True, commit after the update. Default is True.
+
+    Returns:
+        int: The exit status of curl (0 on success)
+
+	"""
+	link = CONFIG.NEW_SOLR_URL+'update'+('?commit=true' if commit else '')
+	with metrics.timer('solr_post'):
+		status = subprocess.run(
+			["curl", "-s", "-X", "POST", "-H", "Content-Type: application/json", link, "--data-binary", "@-"],
+			input=json.dumps(docs).encode('utf-8')).returncode
+	if status:
+		metrics.increment('failures', stage='solr_post')
+	return status
+
+@metrics.timed
 def pushToSolr(entry, checkCollisions=False, update=False, ignoreMissing=False):
 	"""Adds new entry to the Solr hosted locally; allows options to check if the
 	entry has a collision in Solr; update an entry rather than create a new entry;
@@ -717,18 +1315,21 @@ def pushToSolr(entry, checkCollisions=False, update=False, ignoreMissing=False):
 
 	input = json.dumps(entry)
 	# Call curl to post entry
-	subprocess.call(
-        [
-            "curl",
-            "-X",
-            "-POST",
-            "-H",
-            "Content-Type: application/json",
-            CONFIG.NEW_SOLR_URL +
-            "update/json/docs/?commit=true",
-            "--data-binary",
-            input
-        ])
+	with metrics.timer('solr_post'):
+		status = subprocess.call(
+	        [
+	            "curl",
+	            "-X",
+	            "-POST",
+	            "-H",
+	            "Content-Type: application/json",
+	            CONFIG.NEW_SOLR_URL +
+	            "update/json/docs/?commit=true",
+	            "--data-binary",
+	            input
+	        ])
+	if status:
+		metrics.increment('failures', stage='solr_post')
 	return 1
 
 def convertToSolr_Repo(obj):
@@ -808,7 +1409,7 @@ def converToSolrFormat(entry):
 		if not link['broken']:
 			solr_entry['linkUrls'].append(link['link'])
 
-	solr_entry['linkUrls'] = list(set(solr_entry['linkUrls']))
+	solr_entry['linkUrls'] = compactArray(solr_entry['linkUrls'])
 
 	solr_entry['publicationDOI'] = [entry['publication']['doi']]
 	solr_entry['publicationTitle'] = [entry['publication']['title']]
@@ -819,9 +1420,8 @@ def converToSolrFormat(entry):
 
 
 
-	solr_entry['authors'] = []
-	for author in entry['authors']:
-		solr_entry['authors'].append(author['first_name']+' '+ author['last_name'])
+	# the names are interned and repeated authors are dropped
+	solr_entry['authors'] = compactArray(authorName(author['first_name'], author['last_name']) for author in entry['authors'])
 
 	solr_entry['funding'] = []
 	solr_entry['fundingAgencies'] = []
@@ -831,7 +1431,7 @@ def converToSolrFormat(entry):
 		solr_entry['fundingAgencies'].append(fund[0])
 		solr_entry['funding'].append(fund[0]+': '+fund[1])
 
-	solr_entry['fundingAgencies'] = list(set(solr_entry['fundingAgencies']))
+	solr_entry['fundingAgencies'] = compactArray(solr_entry['fundingAgencies'])
 
 	return solr_entry
 
@@ -854,6 +1454,35 @@ def getHighestSolrID():
 
 	return 0
 
+def findSolrDoc(doi):
+	"""Query Solr (hosted on localhost) for the document of a publication
+
+    Args:
+        doi (str): The DOI of the publication
+
+    Returns:
+        dict: The id and the publicationDOI of the document. Returns None if no document has this DOI.
+
+	"""
+	link = CONFIG.NEW_SOLR_URL+'select?q=publicationDOI%3A'+'"'+doi+'"'+'&fl=publicationDOI%2Cid&wt=json'
+	try:
+		json_body = json.loads(makeRequest(link))
+	except:
+		print('Could not query', link)
+		return None
+	docs = json_body['response']['docs']
+	return docs[0] if docs else None
+
+def cleanDOI(doi):
+	"""Clean up the publicationDOI of an old entry, e.g. 'DOI: 10.1093/X extra' -> '10.1093/x'"""
+	doi = doi.lower()
+	if doi.startswith('doi:'):
+		doi = doi[4:]
+	doi = doi.strip()
+	if ' ' in doi:
+		doi = doi.split()[0]
+	return doi
+
 def migrateOldEntries(old_entry):
 	"""Converts the old entry to the new Solr format entry
 
@@ -873,13 +1502,7 @@ def migrateOldEntries(old_entry):
 	new_entry['publicationDOI'] = []
 	# if a DOI is provided, query PubMed for metadata
 	if 'publicationDOI' in old_entry and old_entry['publicationDOI']:
-		# clean up the publicationDOI
-		doi = old_entry['publicationDOI'].lower()
-		if doi.startswith('doi:'):
-			doi = doi[4:]
-		doi = doi.strip()
-		if ' ' in doi:
-			doi = doi.split()[0]
+		doi = cleanDOI(old_entry['publicationDOI'])
 
 		new_entry = converToSolrFormat(generateCompleteJSON('', doi=doi))
 		new_entry['publicationDOI'] = [doi]
@@ -0,0 +1,127 @@
+import re, sys, unicodedata
+from functools import lru_cache
+
+# number of distinct names and affiliations whose normalized form is remembered
+MEMO_SIZE = 200000
+
+WHITESPACE_REGEX = re.compile(r'\s+')
+KEY_REGEX = re.compile(r'[^\w]+')
+
+@lru_cache(maxsize=MEMO_SIZE)
+def normalizeText(text):
+    """Normalize a name or an affiliation and intern it
+
+    The same authors and affiliations recur across thousands of papers, so
+    the normalized strings are interned: every record shares one copy.
+
+    Args:
+        text (str): e.g. ' Univ.  of X,\\nCity '
+
+    Returns:
+        str: The text in NFC form with collapsed whitespace, e.g. 'Univ. of X, City'
+
+    """
+    if not text:
+        return ''
+    return sys.intern(WHITESPACE_REGEX.sub(' ', unicodedata.normalize('NFC', text)).strip())
+
+@lru_cache(maxsize=MEMO_SIZE)
+def foldText(text):
+    """Lowercase a text and strip its accents and punctuation, e.g. 'Müller-Lüdenscheidt' -> 'muller ludenscheidt'"""
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return KEY_REGEX.sub(' ', stripped.lower()).strip()
+
+@lru_cache(maxsize=MEMO_SIZE)
+def authorID(first_name, last_name):
+    """Return the canonical ID of an author, the same for every spelling of the name
+
+    Args:
+        first_name (str): e.g. 'José A'
+        last_name (str): e.g. 'García-López'
+
+    Returns:
+        str: The interned ID, e.g. 'garcia lopez|jose a'
+
+    """
+    return sys.intern(foldText(last_name or '')+'|'+foldText(first_name or ''))
+
+@lru_cache(maxsize=MEMO_SIZE)
+def authorName(first_name, last_name):
+    """Return the interned full name of an author, as stored in Solr, e.g. 'John A Smith'"""
+    return sys.intern(normalizeText((first_name or '')+' '+(last_name or '')))
+
+def makeAuthor(first_name, last_name):
+    """Build the {'first_name': ..., 'last_name': ...} record of an author with interned names"""
+    return {'first_name': normalizeText(first_name), 'last_name': normalizeText(last_name)}
+
+def compactArray(values):
+    """Drop the repeated values of an array, keeping the order of their first occurrence"""
+    seen = set()
+    result = []
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            result.append(value)
+    return result
+
+class AuthorAffiliations(object):
+    """The distinct authors and affiliations of a paper and the pairs that link them
+
+    Consortium papers list hundreds of authors that share a few affiliations,
+    so every author and every affiliation is kept once, by canonical ID, and
+    a repeated (author, affiliation) pair is only recorded once.
+
+    Example:
+        table = AuthorAffiliations()
+        table.add('John', 'Smith', ['University of X', 'Broad Institute'])
+        table.authors        # [{'first_name': 'John', 'last_name': 'Smith'}]
+        table.affiliations   # ['University of X', 'Broad Institute']
+        table.pairs          # [(0, 0), (0, 1)]
+
+    """
+
+    def __init__(self):
+        self.authors = []
+        self.affiliations = []
+        self.pairs = []
+        self.author_index = {}
+        self.affiliation_index = {}
+        self.pair_set = set()
+
+    def addAuthor(self, first_name, last_name):
+        """Add an author, returns its position in self.authors"""
+        key = authorID(first_name, last_name)
+        idx = self.author_index.get(key)
+        if idx is None:
+            idx = self.author_index[key] = len(self.authors)
+            self.authors.append(makeAuthor(first_name, last_name))
+        return idx
+
+    def addAffiliation(self, affiliation):
+        """Add an affiliation, returns its position in self.affiliations (None if it is empty)"""
+        affiliation = normalizeText(affiliation)
+        if not affiliation:
+            return None
+        idx = self.affiliation_index.get(affiliation)
+        if idx is None:
+            idx = self.affiliation_index[affiliation] = len(self.affiliations)
+            self.affiliations.append(affiliation)
+        return idx
+
+    def add(self, first_name, last_name, affiliations=[]):
+        """Add an author and its affiliations
+
+        Args:
+            first_name (str): The first name of the author, None if the author has none
+            last_name (str): The last name of the author, None to only add the affiliations
+            affiliations ([str], optional): The affiliations of the author. Default is none.
+
+        """
+        author_idx = self.addAuthor(first_name, last_name) if last_name else None
+        for affiliation in affiliations:
+            aff_idx = self.addAffiliation(affiliation)
+            if author_idx is None or aff_idx is None or (author_idx, aff_idx) in self.pair_set:
+                continue
+            self.pair_set.add((author_idx, aff_idx))
+            self.pairs.append((author_idx, aff_idx))
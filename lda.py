@@ -1,120 +1,431 @@
 from nltk.corpus import stopwords
 from nltk.stem.wordnet import WordNetLemmatizer
-import string, os, re, json, threading, gensim
-import xml.etree.ElementTree as ET
+import string, os, re, json, threading, gzip, multiprocessing, time, sys, gensim
+from functools import lru_cache
 from gensim import corpora
-from scrape import getPMCXML
+from scrape import requestPMCXML
+from documentSource import DocumentSource
+import corpusStore
 import config.config as CONFIG
 
 
 stop = set(stopwords.words('english'))
-exclude = set(string.punctuation)
+# removes every punctuation character in a single pass
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
 lemma = WordNetLemmatizer()
+LEMMA_CACHE_SIZE = 200000
 
-docs = []
 dictionary = {}
 
+# local store of the abstracts, one json object per line
+ABSTRACT_STORE = './lda/abstracts.jsonl.gz'
+DICTIONARY_FILE = './lda/abstract.dict'
+# bag-of-words corpus serialized in the Matrix Market format
+CORPUS_FILE = './lda/abstracts.mm'
+# version of the dictionary the corpus was serialized with
+CORPUS_VERSION_FILE = './lda/abstracts.mm.version'
+# cleaned tokens of every abstract, keyed by PMC ID
+CLEAN_STORE = './lda/clean.jsonl.gz'
+MODEL_FILE = './lda/lda.model'
+# PMC IDs of the abstracts the saved model was trained on
+TRAINED_FILE = './lda/trained_ids.json'
+store_lock = threading.Lock()
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(word):
+    return lemma.lemmatize(word)
+
 def clean(doc):
     stop_free = " ".join([i for i in doc.lower().split() if i not in stop])
-    punc_free = ''.join(ch for ch in stop_free if ch not in exclude)
-    normalized = " ".join(lemma.lemmatize(word) for word in punc_free.split())
+    punc_free = stop_free.translate(PUNCTUATION_TABLE)
+    normalized = " ".join(lemmatize(word) for word in punc_free.split())
     return normalized
 
+def cleanRecord(doc):
+    return {'pmcid': doc['pmcid'], 'tokens': clean(doc['abstract']).split()}
 
-class pubThread(threading.Thread):
-    def __init__(self, threadID, pmcids):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.pmcids = pmcids
+def fileVersion(filename):
+    """Version stamp of a file: its modification time and size, without reading it"""
+    stat = os.stat(filename)
+    return '%d-%d' % (stat.st_mtime_ns, stat.st_size)
 
-    def run(self):
-        print('Starting thread', self.threadID)
-        global docs
 
-        for pmcid in self.pmcids:
-            raw_text = getPMCXML(pmcid)
+def writeAbstracts(records, filename=ABSTRACT_STORE):
+    """Append abstracts to the local store
 
-            root = ET.fromstring(raw_text)
-            if root:
-                abstract_node = root.find("./article/front/article-meta/abstract")
+    Args:
+        records ([dict]): A list of {'pmcid': '123', 'abstract': '...'} objects
+        filename (str, optional): The path of the store. Default is ABSTRACT_STORE.
 
-                if abstract_node:
-                    abstract_text = ET.tostring(abstract_node, encoding='utf-8', method='text').decode('utf-8')
-                    docs.append({'abstract': abstract_text})
+    """
+    if not records:
+        return
+    lines = ''.join(json.dumps(record)+'\n' for record in records)
+    with store_lock:
+        with gzip.open(filename, 'at', encoding='utf-8') as f:
+            f.write(lines)
 
-def getAbstracts():
-    if os.path.exists('./lda/abstracts.json'):
-        global docs
-        with open('./lda/abstracts.json', 'r') as f:
-            docs = json.load(f)
-    else:
-        using_dir = CONFIG.JOURNAL_DIRS
-
-        filesInDir = []
-        for directory in using_dir:
-            filesInDir += [s for s in os.listdir(directory)]
-
-        pmcids = []
-        for f in filesInDir:
-            pmc_regex = re.search('[\d]+', f)
-            if pmc_regex:
-                pmc = pmc_regex.group(0)
-                pmcids.append(pmc)
-
-        threads = []
-        numThreads = 16
-        numEntriesPerThread = int(len(pmcids)/numThreads)
-        remainder = len(pmcids)%numThreads
-        startIdx = 0
-        endIdx = numEntriesPerThread
-        for i in range(numThreads):
-            if i < remainder:
-                endIdx+=1
-            print(startIdx, endIdx, endIdx-startIdx)
-            pmcid_arr = pmcids[startIdx:endIdx]
-            t = pubThread(i, pmcid_arr)
-            threads.append(t)
-            t.start()
-
-            startIdx = endIdx
-            endIdx+=numEntriesPerThread
-
-        for t in threads:
-            t.join()
-        with open('./abstracts.json', 'w') as f:
-            json.dump(docs, f)
+def iterAbstracts(filename=ABSTRACT_STORE):
+    """Iterate over the abstracts of the local store, one at a time
+
+    Args:
+        filename (str, optional): The path of the store. Default is ABSTRACT_STORE.
+
+    Returns:
+        generator: Yields {'pmcid': '123', 'abstract': '...'} objects
+
+    """
+    if not os.path.exists(filename):
+        return
+    with gzip.open(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iterCleaned(filename=CLEAN_STORE):
+    """Iterate over the cleaned abstracts, one at a time
+
+    Args:
+        filename (str, optional): The path of the store. Default is CLEAN_STORE.
+
+    Returns:
+        generator: Yields {'pmcid': '123', 'tokens': ['word',...]} objects
+
+    """
+    return iterAbstracts(filename)
+
+def updateCleanStore(processes=None, chunksize=64):
+    """Normalize the abstracts that were added since the last run
+
+    Abstracts are cleaned by a pool of processes. Every process keeps its own
+    bounded cache of lemmas. The cleaned tokens are appended to CLEAN_STORE,
+    so abstracts are never normalized twice.
+
+    Args:
+        processes (int, optional): The number of processes. Default is the number of CPUs.
+        chunksize (int, optional): The number of abstracts sent to a process at once. Default is 64.
+
+    Returns:
+        int: The number of abstracts that were normalized.
+
+    """
+    known = set(record['pmcid'] for record in iterCleaned())
+
+    pending = (doc for doc in iterAbstracts() if doc['pmcid'] not in known)
+    total = 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        records = []
+        for record in pool.imap(cleanRecord, pending, chunksize):
+            records.append(record)
+            if len(records)>=1000:
+                writeAbstracts(records, CLEAN_STORE)
+                total += len(records)
+                records = []
+        writeAbstracts(records, CLEAN_STORE)
+        total += len(records)
+    finally:
+        pool.close()
+        pool.join()
+
+    print(total, 'abstracts normalized')
+    return total
+
+class AbstractCorpus(object):
+    """Iterable over the cleaned tokens of every abstract in the store.
+    It can be iterated several times and never holds more than one abstract."""
+    def __init__(self, filename=CLEAN_STORE):
+        self.filename = filename
+
+    def __iter__(self):
+        for record in iterCleaned(self.filename):
+            yield record['tokens']
+
+class BowCorpus(object):
+    """Iterable over the bag-of-words vectors of every abstract in the store"""
+    def __init__(self, dictionary, filename=CLEAN_STORE):
+        self.dictionary = dictionary
+        self.filename = filename
+
+    def __iter__(self):
+        for tokens in AbstractCorpus(self.filename):
+            yield self.dictionary.doc2bow(tokens)
+
+def getAbstracts(batchSize=1000):
+    """Fill the local abstract store with the abstracts of every publication
+    in CONFIG.JOURNAL_DIRS that is not stored yet
+
+    The articles are copied once into the shared corpus store, from the
+    journal files when they exist and from PMC otherwise, and their
+    abstracts are read from there, without parsing the XML again.
+
+    Args:
+        batchSize (int, optional): The number of abstracts written at once. Default is 1000.
+
+    """
+    stored = set(doc['pmcid'] for doc in iterAbstracts())
+    pmcids = [pmcid for pmcid in corpusStore.getJournalIDs(CONFIG.JOURNAL_DIRS) if pmcid not in stored]
+    if not pmcids:
+        return
+
+    corpusStore.fillStore(pmcids, DocumentSource(fetchPMC=requestPMCXML).fetchPMCXML)
+
+    records = []
+    for article in corpusStore.iterArticles(fields=['abstract'], pmcids=pmcids):
+        if article['abstract']:
+            records.append({'pmcid': article['pmcid'], 'abstract': article['abstract']})
+        # write in batches so that memory stays bounded
+        if len(records)>=batchSize:
+            writeAbstracts(records)
+            records = []
+    writeAbstracts(records)
 
 def getDictionary(getMatrix=False):
+    """Load (or build) the dictionary of the abstracts
+
+    Args:
+        getMatrix (bool, optional): If True, the abstract store is updated, new
+        abstracts are normalized and the bag-of-words corpus is serialized to
+        CORPUS_FILE. Default is False.
+
+    Returns:
+        gensim.corpora.MmCorpus: The disk-backed bag-of-words corpus if getMatrix
+        is True. Otherwise, an empty list.
+
+    """
     global dictionary
-    doc_clean = []
 
     if getMatrix:
         getAbstracts()
-        doc_clean = [clean(doc['abstract']).split() for doc in docs]
 
-    if os.path.exists('./lda/abstract.dict'):
-        # with open('./abstract.dict', 'r') as f:
-        dictionary = corpora.Dictionary.load('./lda/abstract.dict')
+    if os.path.exists(DICTIONARY_FILE):
+        dictionary = corpora.Dictionary.load(DICTIONARY_FILE)
+    else:
+        updateCleanStore()
+        dictionary = corpora.Dictionary(AbstractCorpus())
+        dictionary.save(DICTIONARY_FILE)
+
+    if not getMatrix:
+        return []
+
+    updateCleanStore()
+    if not os.path.exists(CLEAN_STORE):
+        return []
+
+    # serialize again only if abstracts were normalized or the dictionary changed since the last time
+    version = fileVersion(DICTIONARY_FILE)
+    corpus_version = None
+    if os.path.exists(CORPUS_VERSION_FILE):
+        with open(CORPUS_VERSION_FILE, 'r') as f:
+            corpus_version = f.read().strip()
+    if not os.path.exists(CORPUS_FILE) or os.path.getmtime(CORPUS_FILE) < os.path.getmtime(CLEAN_STORE) or corpus_version!=version:
+        corpora.MmCorpus.serialize(CORPUS_FILE, BowCorpus(dictionary))
+        with open(CORPUS_VERSION_FILE, 'w') as f:
+            f.write(version)
+    return corpora.MmCorpus(CORPUS_FILE)
+
+class TrainingCorpus(object):
+    """Iterable over the documents of a corpus that are not held out, see splitCorpus"""
+    def __init__(self, corpus, held_out):
+        self.corpus = corpus
+        self.held_out = held_out
+
+    def __iter__(self):
+        for i, doc in enumerate(self.corpus):
+            if i not in self.held_out:
+                yield doc
+
+    def __len__(self):
+        return len(self.corpus)-len(self.held_out)
+
+def splitCorpus(corpus, size=1000, step=20):
+    """Hold out every step-th document of a corpus, at most size documents,
+    to estimate the perplexity of a model on documents it was not trained on
+
+    Returns:
+        (TrainingCorpus, list): The documents to train on and the held-out sample
+
+    """
+    held_out = set()
+    sample = []
+    for i, doc in enumerate(corpus):
+        if i%step==0:
+            held_out.add(i)
+            sample.append(doc)
+            if len(sample)>=size:
+                break
+    return (TrainingCorpus(corpus, held_out), sample)
+
+def perplexity(ldamodel, sample):
+    return 2**(-ldamodel.log_perplexity(sample))
+
+def trainLDAModel(corpus, workers=None, chunksize=2000, passes=50, tolerance=None, num_topics=20, sample=None):
+    """Train an LDA model on a corpus
+
+    Args:
+        corpus (iterable): The bag-of-words corpus, usually the MmCorpus of getDictionary
+        workers (int, optional): If given, LdaMulticore is trained with this many
+        worker processes. Otherwise, a single-threaded LdaModel is trained. Default is None.
+        chunksize (int, optional): The number of documents per training chunk. Default is 2000.
+        passes (int, optional): The (maximum) number of passes over the corpus. Default is 50.
+        tolerance (float, optional): If given, a sample of the corpus is held out of
+        training and training stops early once a pass improves its perplexity by
+        less than this fraction, i.e. once the model stops generalizing better. Default is None.
+        num_topics (int, optional): The number of topics. Default is 20.
+        sample (list, optional): The held-out sample used with a tolerance, if corpus
+        was already split with splitCorpus. Default is None (split the corpus here).
+
+    Returns:
+        gensim.models.ldamodel.LdaModel: The trained model
+
+    """
+    if workers:
+        # LdaMulticore does not support learning an asymmetric alpha
+        Lda = gensim.models.ldamulticore.LdaMulticore
+        options = {'workers': workers, 'alpha': 'symmetric'}
     else:
-        dictionary = corpora.Dictionary(doc_clean)
-        dictionary.save('./lda/abstract.dict')
+        Lda = gensim.models.ldamodel.LdaModel
+        options = {'alpha': 'auto'}
+
+    if not tolerance:
+        return Lda(corpus, num_topics=num_topics, id2word=dictionary, chunksize=chunksize, passes=passes, **options)
+
+    # the sample is not trained on, its perplexity measures how well the model generalizes
+    if sample is None:
+        corpus, sample = splitCorpus(corpus)
+    ldamodel = Lda(corpus, num_topics=num_topics, id2word=dictionary, chunksize=chunksize, passes=1, eval_every=None, **options)
+    last_perplexity = perplexity(ldamodel, sample)
+    for i in range(1, passes):
+        ldamodel.update(corpus)
+        new_perplexity = perplexity(ldamodel, sample)
+        print('pass', i+1, 'perplexity', new_perplexity)
+        if (last_perplexity-new_perplexity)/last_perplexity < tolerance:
+            break
+        last_perplexity = new_perplexity
+
+    return ldamodel
 
-    return [dictionary.doc2bow(doc) for doc in doc_clean]
+def getTrainedIDs():
+    if os.path.exists(TRAINED_FILE):
+        with open(TRAINED_FILE, 'r') as f:
+            return set(json.load(f))
+    return set()
 
-def generateLDAModel():
+def saveTrainedIDs(pmcids):
+    with open(TRAINED_FILE, 'w') as f:
+        json.dump(sorted(pmcids), f)
 
+def generateLDAModel(workers=None, chunksize=2000, passes=50, tolerance=None):
+    """Train the LDA model on every abstract of the store and save it to MODEL_FILE
+
+    Args:
+        workers (int, optional): The number of LdaMulticore workers. Default is None (single-threaded).
+        chunksize (int, optional): The number of documents per training chunk. Default is 2000.
+        passes (int, optional): The (maximum) number of passes. Default is 50.
+        tolerance (float, optional): Stop early once a pass improves the perplexity
+        by less than this fraction. Default is None (always run every pass).
+        The held-out sample is not recorded as trained, so updateLDAModel trains on it later.
+
+    Returns:
+        gensim.models.ldamodel.LdaModel: The trained model
+
+    """
     doc_term_matrix = getDictionary(getMatrix=True)
 
-    Lda = gensim.models.ldamodel.LdaModel
-    ldamodel = Lda(doc_term_matrix, num_topics=20, id2word=dictionary, alpha='auto', passes=50)
-    ldamodel.save('./lda/lda.model')
+    held_out = set()
+    sample = None
+    if tolerance:
+        doc_term_matrix, sample = splitCorpus(doc_term_matrix)
+        held_out = doc_term_matrix.held_out
+
+    ldamodel = trainLDAModel(doc_term_matrix, workers=workers, chunksize=chunksize, passes=passes, tolerance=tolerance, sample=sample)
+    ldamodel.save(MODEL_FILE)
+    # the corpus follows the order of CLEAN_STORE
+    saveTrainedIDs(record['pmcid'] for i, record in enumerate(iterCleaned()) if i not in held_out)
 
     return ldamodel
 
+def updateLDAModel(chunksize=2000):
+    """Update the saved LDA model with the abstracts it was not trained on yet
+
+    Uses online LDA: only the new documents are streamed through the model.
+    The vocabulary of the model cannot grow, so words that are not in the
+    dictionary are ignored.
+
+    Args:
+        chunksize (int, optional): The number of documents per update chunk. Default is 2000.
+
+    Returns:
+        gensim.models.ldamodel.LdaModel: The updated model
+
+    """
+    if not os.path.exists(MODEL_FILE):
+        return generateLDAModel(chunksize=chunksize)
+
+    ldamodel = gensim.models.ldamodel.LdaModel.load(MODEL_FILE)
+    getDictionary()
+    getAbstracts()
+    updateCleanStore()
+
+    trained = getTrainedIDs()
+    new_ids = [record['pmcid'] for record in iterCleaned() if record['pmcid'] not in trained]
+    if not new_ids:
+        print('no new abstracts')
+        return ldamodel
+
+    new_set = set(new_ids)
+    new_docs = (dictionary.doc2bow(record['tokens']) for record in iterCleaned() if record['pmcid'] in new_set)
+    # update() needs to know the number of documents, so it gets a list of chunks
+    chunk = []
+    for bow in new_docs:
+        chunk.append(bow)
+        if len(chunk)>=chunksize:
+            ldamodel.update(chunk)
+            chunk = []
+    if chunk:
+        ldamodel.update(chunk)
+
+    ldamodel.save(MODEL_FILE)
+    saveTrainedIDs(trained | new_set)
+    print('model updated with', len(new_ids), 'abstracts')
+    return ldamodel
+
+def benchmarkLDA(workers=3, chunksize=2000, passes=5):
+    """Compare the current training configuration (single-threaded LdaModel)
+    with LdaMulticore on the corpus of the store
+
+    Args:
+        workers (int, optional): The number of LdaMulticore workers. Default is 3.
+        chunksize (int, optional): The number of documents per training chunk. Default is 2000.
+        passes (int, optional): The number of passes of both runs. Default is 5.
+
+    Returns:
+        dict: The documents per second and the perplexity of a held-out sample for both runs.
+        Both runs are trained without the held-out sample.
+
+    """
+    corpus, sample = splitCorpus(getDictionary(getMatrix=True))
+    num_docs = len(corpus)
+
+    results = {}
+    for name, num_workers in [('LdaModel', None), ('LdaMulticore', workers)]:
+        start = time.perf_counter()
+        ldamodel = trainLDAModel(corpus, workers=num_workers, chunksize=chunksize, passes=passes)
+        seconds = time.perf_counter()-start
+        results[name] = {'docs_per_second': num_docs*passes/seconds, 'perplexity': perplexity(ldamodel, sample)}
+        print(name, '%.1f docs/s' % results[name]['docs_per_second'], 'perplexity %.1f' % results[name]['perplexity'])
+    return results
+
 def main():
+    if '--benchmark' in sys.argv:
+        benchmarkLDA()
+        return
+
     ldamodel = None
-    if os.path.exists('./lda/lda.model'):
-        ldamodel = gensim.models.ldamodel.LdaModel.load('./lda/lda.model')
+    if '--update' in sys.argv:
+        ldamodel = updateLDAModel()
+    elif os.path.exists(MODEL_FILE):
+        ldamodel = gensim.models.ldamodel.LdaModel.load(MODEL_FILE)
     else:
         ldamodel = generateLDAModel()
 
@@ -0,0 +1,115 @@
+import re
+import utilities.urlRegex as regex
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+# sections of an article, from the most to the least likely to hold the links of its tool
+SECTION_RANKS = {'availability': 0, 'abstract': 1, 'methods': 2, 'body': 3, 'references': 4}
+# a sec, or a paragraph that starts with a bold heading, is classified by the words of its title
+SECTION_WORDS = [
+    ('availability', re.compile(r'\b(availab|software|source code|implementation|download)', re.IGNORECASE)),
+    ('methods', re.compile(r'\b(method|material|algorithm|approach)', re.IGNORECASE))
+]
+# link elements of the JATS format
+LINK_TAGS = ('ext-link', 'uri')
+# ext-links to other publications, not to resources
+CITATION_LINK_TYPES = ('doi', 'pmid', 'pmcid', 'pubmed', 'pmc')
+# elements that start a new block of text, joined with a space
+BLOCK_TAGS = ('p', 'title', 'sec', 'list-item', 'td', 'th', 'caption', 'label')
+# inline elements that start a paragraph with its heading, e.g. <bold>Availability:</bold>
+HEADING_TAGS = ('bold', 'italic', 'title')
+
+URL_REGEX = re.compile(regex.URL_REGEX)
+EMAIL_REGEX = re.compile(regex.EMAIL_REGEX)
+
+def classifyTitle(title, default):
+    """Return the section named by a title, or default if it names none"""
+    for section, words_regex in SECTION_WORDS:
+        if words_regex.search(title):
+            return section
+    return default
+
+def sectionOf(node, section):
+    """Return the section of a sec or p element, given the section of its parent"""
+    # availability and methods are refinements of the abstract and the body, references are final
+    if section=='references':
+        return section
+    if node.tag=='ref-list':
+        return 'references'
+    if node.tag=='sec':
+        sec_type = node.get('sec-type') or ''
+        title = node.find('title')
+        title = ''.join(title.itertext()) if title is not None else ''
+        return classifyTitle(sec_type+' '+title, section)
+    if node.tag=='p' and len(node) and node[0].tag in HEADING_TAGS and not (node.text or '').strip():
+        return classifyTitle(''.join(node[0].itertext()), section)
+    return section
+
+class MarkupIndex(object):
+    """The links, emails and unmarked text of a PMC article, by section
+
+    The article is walked once. Every ext-link, uri and email element is
+    collected at any depth (nested sections, tables, lists, ...) with the
+    section it is in, and the text outside of these elements is kept so that
+    the regular expressions only run where there is no markup.
+
+    Example:
+        index = MarkupIndex(root)
+        index.links    # [('https://github.com/owner/repo', 'availability'), ...]
+        index.emails   # [('user@host.edu', 'abstract')]
+        index.sectionText('abstract')
+
+    """
+
+    def __init__(self, root, searchFull=True):
+        """
+        Args:
+            root (xml.etree.ElementTree.Element): The PMC XML, rooted at pmc-articleset or article
+            searchFull (bool, optional): Walk the body and back of the article, not just the abstract. Default is True.
+
+        """
+        self.links = []
+        self.emails = []
+        self.text = {}
+        article = root if root.tag=='article' else root.find('./article')
+        if article is None:
+            return
+        for abstract in article.findall('./front/article-meta/abstract'):
+            self.walk(abstract, 'abstract')
+        if not searchFull:
+            return
+        body = article.find('./body')
+        if body is not None:
+            self.walk(body, 'body')
+        back = article.find('./back')
+        if back is not None:
+            self.walk(back, 'body')
+
+    def addText(self, text, section):
+        if text:
+            self.text.setdefault(section, []).append(text)
+
+    def walk(self, node, section):
+        if node.tag in LINK_TAGS:
+            if node.get('ext-link-type') not in CITATION_LINK_TYPES:
+                link = node.get(XLINK_HREF) or ''.join(node.itertext())
+                self.links.append((link.strip(), section))
+            return
+        if node.tag=='email':
+            self.emails.append((''.join(node.itertext()).strip(), section))
+            return
+        section = sectionOf(node, section)
+        if node.tag in BLOCK_TAGS:
+            self.addText(' ', section)
+        self.addText(node.text, section)
+        for child in node:
+            self.walk(child, section)
+            self.addText(child.tail, section)
+
+    def sectionText(self, section):
+        """Return the unmarked text of a section"""
+        return ''.join(self.text.get(section, []))
+
+def rankBySection(items):
+    """Sort (value, section) pairs by the rank of their section, keeping their order within a section"""
+    return sorted(items, key=lambda item: SECTION_RANKS[item[1]])
@@ -0,0 +1,177 @@
+import threading, time, json, functools
+from contextlib import contextmanager
+
+# timings[(stage, tags)] = [count, total seconds, max seconds]
+timings = {}
+# counters[(name, tags)] = value
+counters = {}
+lock = threading.Lock()
+start_time = time.time()
+
+def tagKey(tags):
+    return tuple(sorted((str(k), str(v)) for k, v in tags.items()))
+
+def record(stage, seconds, **tags):
+    """Record the duration of one execution of a stage
+
+    Args:
+        stage (str): The name of the stage, e.g. 'request' or 'extractFromXML'
+        seconds (float): The duration of the execution
+        **tags: Labels of the execution, e.g. host='api.github.com'
+
+    """
+    key = (stage, tagKey(tags))
+    with lock:
+        timing = timings.get(key)
+        if timing is None:
+            timings[key] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+def increment(name, value=1, **tags):
+    """Increment a counter, e.g. cache hits, retries or failures
+
+    Args:
+        name (str): The name of the counter
+        value (int, optional): The amount to add. Default is 1.
+        **tags: Labels of the counter, e.g. cache='bioconductor'
+
+    """
+    key = (name, tagKey(tags))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+@contextmanager
+def timer(stage, **tags):
+    """Time the enclosed block as one execution of a stage
+
+    An exception raised in the block is counted as a failure of the stage
+    and raised again.
+
+    Example:
+        with metrics.timer('request', host='eutils.ncbi.nlm.nih.gov'):
+            ...
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        increment('failures', stage=stage, **tags)
+        raise
+    finally:
+        record(stage, time.perf_counter()-start, **tags)
+
+def timed(func):
+    """Decorator that times every call of a function as a stage named after it"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timer(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def reset():
+    """Forget all timings and counters, e.g. at the start of a run"""
+    global start_time
+    with lock:
+        timings.clear()
+        counters.clear()
+        start_time = time.time()
+
+def formatTags(tags):
+    return ','.join(k+'='+v for k, v in tags)
+
+def summary():
+    """Generate a readable report of the run
+
+    Returns:
+        str: One line per stage (sorted by total time) and per counter.
+
+    """
+    with lock:
+        timing_items = sorted(timings.items(), key=lambda item: -item[1][1])
+        counter_items = sorted(counters.items())
+
+    lines = ['run time: %.1f s' % (time.time()-start_time)]
+    lines.append('%-44s %8s %10s %10s %10s' % ('stage', 'calls', 'total s', 'mean ms', 'max ms'))
+    for (stage, tags), (count, total, maximum) in timing_items:
+        name = stage+('{'+formatTags(tags)+'}' if tags else '')
+        lines.append('%-44s %8d %10.2f %10.2f %10.2f' % (name, count, total, 1000*total/count, 1000*maximum))
+    if counter_items:
+        lines.append('%-44s %8s' % ('counter', 'value'))
+        for (name, tags), value in counter_items:
+            name = name+('{'+formatTags(tags)+'}' if tags else '')
+            lines.append('%-44s %8d' % (name, value))
+    return '\n'.join(lines)
+
+def escapeLabel(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheusLabels(tags):
+    if not tags:
+        return ''
+    return '{'+','.join(k+'="'+escapeLabel(v)+'"' for k, v in tags)+'}'
+
+def exportPrometheus():
+    """Export the timings and counters in the Prometheus text format
+
+    Returns:
+        str: The metrics, e.g.
+        pipeline_stage_seconds_count{host="api.github.com",stage="request"} 12
+        pipeline_stage_seconds_sum{host="api.github.com",stage="request"} 3.2
+        pipeline_events_total{cache="bioconductor",name="cache_hit"} 7
+
+    """
+    with lock:
+        timing_items = sorted(timings.items())
+        counter_items = sorted(counters.items())
+
+    lines = [
+        '# HELP pipeline_stage_seconds Time spent in each stage of the pipeline',
+        '# TYPE pipeline_stage_seconds summary'
+    ]
+    for (stage, tags), (count, total, maximum) in timing_items:
+        labels = prometheusLabels(tuple(sorted(tags+(('stage', stage),))))
+        lines.append('pipeline_stage_seconds_count'+labels+' '+str(count))
+        lines.append('pipeline_stage_seconds_sum'+labels+' '+repr(total))
+    lines.append('# HELP pipeline_stage_seconds_max Longest execution of each stage')
+    lines.append('# TYPE pipeline_stage_seconds_max gauge')
+    for (stage, tags), (count, total, maximum) in timing_items:
+        labels = prometheusLabels(tuple(sorted(tags+(('stage', stage),))))
+        lines.append('pipeline_stage_seconds_max'+labels+' '+repr(maximum))
+    lines.append('# HELP pipeline_events_total Cache hits, retries, failures and other events')
+    lines.append('# TYPE pipeline_events_total counter')
+    for (name, tags), value in counter_items:
+        labels = prometheusLabels(tuple(sorted(tags+(('name', name),))))
+        lines.append('pipeline_events_total'+labels+' '+str(value))
+    return '\n'.join(lines)+'\n'
+
+def exportJSONLines(filename):
+    """Append one json line per stage and per counter to a file
+
+    Args:
+        filename (str): The path of the file
+
+    """
+    now = time.time()
+    with lock:
+        timing_items = sorted(timings.items())
+        counter_items = sorted(counters.items())
+
+    with open(filename, 'a') as f:
+        for (stage, tags), (count, total, maximum) in timing_items:
+            f.write(json.dumps({'time': now, 'stage': stage, 'tags': dict(tags), 'count': count, 'total': total, 'max': maximum})+'\n')
+        for (name, tags), value in counter_items:
+            f.write(json.dumps({'time': now, 'counter': name, 'tags': dict(tags), 'value': value})+'\n')
+
+def export(filename):
+    """Write the metrics to a file: Prometheus text if the filename ends
+    with .prom, json lines otherwise"""
+    if filename.endswith('.prom'):
+        with open(filename, 'w') as f:
+            f.write(exportPrometheus())
+    else:
+        exportJSONLines(filename)
@@ -0,0 +1,362 @@
+import json, re, sys, time
+import numpy as np
+
+from scrape import extractName, extractLinks, extractGithub, extractBitbucket, extractSourceforge, english_words, LAST_WITH_REGEX
+
+# kinds of candidates, in the order extractFromTitle tries them
+CANDIDATE_KINDS = ['short_title', 'colon', 'dash', 'paren', 'with', 'comma', 'using', 'first_word', 'mixed_case', 'repo', 'link']
+KIND_INDEX = {kind: i for i, kind in enumerate(CANDIDATE_KINDS)}
+
+# features computed for every candidate, after the one-hot encoded kind
+FEATURES = ['english_ratio', 'upper_ratio', 'num_words', 'case_changes', 'all_upper', 'in_title', 'repo_in_title']
+
+# one weight per kind, then one weight per feature
+# The weights were set by hand, not fitted: the kinds are weighted in the order
+# extractFromTitle tries them (an earlier heuristic gets a larger weight), a
+# repo name is ranked above the title heuristics when it also appears in the
+# title, and the features only reorder candidates of close kinds. They were
+# checked against extractName with compareWithExtractName on the text cases of
+# the benchmark, fixtures/text_cases.json (python nameScoring.py --check), which
+# cover every kind of candidate; run it again after changing them.
+WEIGHTS = np.array([
+    3.0, 2.6, 2.2, 2.0, 1.2, 1.0, 0.8, 0.6, 0.9, 1.5, 0.2,
+    -1.5, 0.4, -0.15, 0.1, 0.3, 0.2, 1.5,
+])
+
+# longest token used for the case features
+MAX_TOKEN_LEN = 32
+
+# the text cases used by --check
+TEXT_CASES_FILE = './fixtures/text_cases.json'
+
+REPO_WORDS = ['github', 'bitbucket', 'sourceforge']
+REPO_EXTRACTORS = [('github', extractGithub), ('bitbucket', extractBitbucket), ('sourceforge', extractSourceforge)]
+
+def isNameWord(word):
+    """Check if a word looks like a name, as the first word is checked by extractFromTitle
+
+    Args:
+        word (str): e.g. 'DESeq2'
+
+    Returns:
+        bool: True if the word is all upper case or changes case more than once
+
+    """
+    if not word:
+        return False
+    if word.isupper():
+        return True
+    changes = 0
+    for i in range(1, len(word)):
+        if word[i].isupper()!=word[i-1].isupper():
+            changes+=1
+    return changes > 1
+
+def generateCandidates(title, abstract='', links=[]):
+    """Generate every candidate name for a publication
+
+    Unlike extractFromTitle, which returns the first heuristic that matches,
+    all heuristics are applied so that the candidates can be ranked.
+
+    Args:
+        title (str): The title of the publication
+        abstract (str, optional): The abstract of the publication. Default is ''.
+        links ([str], optional): A list of links/urls. Default is an empty list.
+
+    Returns:
+        [(str, str)]: A list of pairs. The first value is the candidate name,
+        the second value is the kind of heuristic that generated it.
+
+    """
+    candidates = []
+
+    # remove trailing period
+    period_idx = title.rfind('.')
+    if period_idx>0 and period_idx>len(title)-5:
+        title = title[:period_idx]
+    words = title.split()
+
+    if not words:
+        return candidates
+
+    if len(words) < 5:
+        candidates.append((title, 'short_title'))
+
+    colon_idx = title.rfind(':')
+    if colon_idx>0:
+        candidates.append((title[:colon_idx], 'colon'))
+
+    noUniTitle = re.sub(r'[^\x00-\x7F]+',' ', title)
+    oneDash_idx = noUniTitle.find(' - ')
+    if oneDash_idx>0:
+        candidates.append((noUniTitle[:oneDash_idx], 'dash'))
+    for dash in ['–', '—', '--']:
+        dash_idx = title.find(dash)
+        if dash_idx>0:
+            candidates.append((title[:dash_idx], 'dash'))
+
+    paren_idx = title.find('(')
+    if paren_idx > 0:
+        end_paren_idx = title.find(')', paren_idx)
+        if end_paren_idx > paren_idx+1:
+            candidates.append((title[paren_idx+1:end_paren_idx], 'paren'))
+
+    with_match = LAST_WITH_REGEX.match(title)
+    if with_match and with_match.start(1) > 0:
+        with_name = title[with_match.end(1):].strip()
+        if with_name and len(with_name.split()) < 3:
+            candidates.append((with_name, 'with'))
+
+    comma_idx = title.find(',')
+    if comma_idx > 0 and title.count(',')==1:
+        candidates.append((title[:comma_idx], 'comma'))
+
+    using_idx = title.find('using')
+    if using_idx>0:
+        using_name = title[using_idx+len('using'):].strip()
+        if using_name and len(using_name.split()) < 2:
+            candidates.append((using_name, 'using'))
+
+    # like extractFromTitle, the first word is only a name if its case says so;
+    # an english first word, e.g. 'Statistical', would always be a candidate
+    first = words[0]
+    if (first=='The' or first=='A') and len(words)>1:
+        first = words[1]
+    first = first.strip(',;:')
+    if isNameWord(first):
+        candidates.append((first, 'first_word'))
+
+    # tokens such as DESeq2 or mzMINE anywhere in the title
+    for word in words[1:]:
+        word = word.strip(',;:()')
+        if len(word)>1 and not word.islower() and not word.istitle():
+            candidates.append((word, 'mixed_case'))
+
+    # names of code repositories found in the links
+    repo_links = list(links)
+    abstract_lower = abstract.lower()
+    if any(word in abstract_lower for word in REPO_WORDS):
+        repo_links += [link[0] for link in extractLinks(abstract)[0]]
+    repo_names = []
+    for word, extract in REPO_EXTRACTORS:
+        word_links = [link for link in repo_links if word in link.lower()]
+        if word_links:
+            repo_names += extract(word_links)
+    for repo_link, repo_name in repo_names:
+        if repo_name:
+            candidates.append((repo_name, 'repo'))
+    for link in links:
+        link_name = link[link.rfind('/')+1:]
+        if link_name and not any(word in link.lower() for word in REPO_WORDS):
+            candidates.append((link_name, 'link'))
+
+    return candidates
+
+def caseFeatures(tokens):
+    """Compute the letter case features of many tokens at once
+
+    Args:
+        tokens ([str]): The first word of every candidate
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): The number of changes between upper and
+        lower case letters, and whether the token is all upper case (0 or 1).
+
+    """
+    codes = np.zeros((len(tokens), MAX_TOKEN_LEN), dtype=np.uint8)
+    for i, token in enumerate(tokens):
+        encoded = token[:MAX_TOKEN_LEN].encode('ascii', 'replace')
+        codes[i, :len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+
+    upper = (codes>=65) & (codes<=90)
+    lower = (codes>=97) & (codes<=122)
+    letter = upper | lower
+
+    # a change is counted between two consecutive letters of different case
+    both_letters = letter[:, 1:] & letter[:, :-1]
+    changes = ((upper[:, 1:]!=upper[:, :-1]) & both_letters).sum(axis=1)
+    all_upper = (upper.sum(axis=1)>1) & (lower.sum(axis=1)==0)
+
+    return (changes.astype(np.float64), all_upper.astype(np.float64))
+
+def candidateFeatures(records, candidates):
+    """Build the feature matrix of all candidates
+
+    Args:
+        records ([(str, str, [str])]): The (title, abstract, links) of every publication
+        candidates ([(int, str, str)]): (record index, candidate name, kind) triples
+
+    Returns:
+        numpy.ndarray: A matrix with one row per candidate and one column per
+        kind and feature, in the order of WEIGHTS.
+
+    """
+    num_kinds = len(CANDIDATE_KINDS)
+    matrix = np.zeros((len(candidates), num_kinds+len(FEATURES)))
+    if not candidates:
+        return matrix
+
+    kind_idx = np.array([KIND_INDEX[c[2]] for c in candidates])
+    matrix[np.arange(len(candidates)), kind_idx] = 1
+
+    # flatten the words of all candidates, so that the word features are
+    # computed once per word and summed per candidate with reduceat
+    lower_titles = [record[0].lower() for record in records]
+    candidate_words = [c[1].split() for c in candidates]
+    num_words = np.array([len(words) for words in candidate_words], dtype=np.float64)
+    flat_words = [word for words in candidate_words for word in words]
+    is_english = np.array([word.lower() in english_words for word in flat_words], dtype=np.float64)
+    is_upper = np.array([word[0].isupper() for word in flat_words], dtype=np.float64)
+    offsets = np.concatenate(([0], np.cumsum(num_words)[:-1])).astype(np.int64)
+    num_english = np.add.reduceat(is_english, offsets) if flat_words else np.zeros(len(candidates))
+    num_upper = np.add.reduceat(is_upper, offsets) if flat_words else np.zeros(len(candidates))
+    in_title = np.array([c[1].lower() in lower_titles[c[0]] for c in candidates], dtype=np.float64)
+    first_tokens = [words[0] for words in candidate_words]
+
+    safe_words = np.maximum(num_words, 1)
+    changes, all_upper = caseFeatures(first_tokens)
+
+    # a repo name that also appears in the title is very likely the name
+    is_repo = kind_idx==KIND_INDEX['repo']
+
+    matrix[:, num_kinds+0] = num_english/safe_words
+    matrix[:, num_kinds+1] = num_upper/safe_words
+    matrix[:, num_kinds+2] = num_words
+    matrix[:, num_kinds+3] = np.minimum(changes, 4)
+    matrix[:, num_kinds+4] = all_upper
+    matrix[:, num_kinds+5] = in_title
+    matrix[:, num_kinds+6] = is_repo & (in_title>0)
+
+    return matrix
+
+def extractNames(records, weights=WEIGHTS):
+    """Extract the names of many tools at once
+
+    Every heuristic candidate is generated for each publication, scored with a
+    single matrix product and ranked per publication. Ties keep the order in
+    which the candidates were generated, so the results are reproducible.
+
+    Args:
+        records ([(str, str, [str])]): The (title, abstract, links) of every publication
+        weights (numpy.ndarray, optional): The weight of every kind and feature. Default is WEIGHTS.
+
+    Returns:
+        [[str]]: For every publication, the list of extracted names.
+        Names that are most likely appear first.
+
+    """
+    candidates = []
+    for idx, (title, abstract, links) in enumerate(records):
+        for name, kind in generateCandidates(title, abstract or '', links or []):
+            name = name.strip()
+            if name:
+                candidates.append((idx, name, kind))
+
+    results = [[] for record in records]
+    if not candidates:
+        return results
+
+    scores = candidateFeatures(records, candidates).dot(weights)
+    record_idx = np.array([c[0] for c in candidates])
+    order = np.arange(len(candidates))
+
+    # sort by publication, then by descending score, then by generation order
+    ranking = np.lexsort((order, -scores, record_idx))
+    for i in ranking:
+        idx, name = candidates[i][0], candidates[i][1]
+        if name not in results[idx]:
+            results[idx].append(name)
+
+    return results
+
+def compareWithExtractName(records):
+    """Compare the names of extractNames with the names of extractName
+
+    The two agree on a publication if their most likely names are the same,
+    ignoring the case. extractNames may find a name where extractName finds
+    none, e.g. a mixed_case candidate, which has no counterpart in extractName.
+
+    Args:
+        records ([(str, str, [str])]): The (title, abstract, links) of every publication
+
+    Returns:
+        [(int, [str], [str])]: The publications they disagree on: the index of
+        the publication, the names of extractName and the names of extractNames.
+
+    """
+    disagreements = []
+    for idx, names in enumerate(extractNames(records)):
+        title, abstract, links = records[idx]
+        expected = extractName(title, abstract, links=list(links))
+        top = names[0].lower() if names else None
+        expected_top = expected[0].lower() if expected else None
+        if expected_top and top!=expected_top:
+            disagreements.append((idx, expected, names))
+    return disagreements
+
+def loadTextCases(filename=TEXT_CASES_FILE):
+    """Load the (title, abstract, links) records of the benchmark text cases"""
+    with open(filename, 'r') as f:
+        return [(case['title'], case.get('abstract', ''), case.get('links', [])) for case in json.load(f)]
+
+def benchmark(records, repeat=3):
+    """Compare the throughput of extractName and extractNames
+
+    Args:
+        records ([(str, str, [str])]): The (title, abstract, links) of every publication
+        repeat (int, optional): The number of runs; the fastest one is reported. Default is 3.
+
+    Returns:
+        dict: The number of publications per second for both paths.
+
+    """
+    item_times = []
+    batch_times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for title, abstract, links in records:
+            extractName(title, abstract, links=list(links))
+        item_times.append(time.perf_counter()-start)
+
+        start = time.perf_counter()
+        extractNames(records)
+        batch_times.append(time.perf_counter()-start)
+
+    result = {
+        'records': len(records),
+        'extractName': len(records)/min(item_times),
+        'extractNames': len(records)/min(batch_times)
+    }
+    print(len(records), 'publications')
+    print('extractName:  %.1f publications/s' % result['extractName'])
+    print('extractNames: %.1f publications/s' % result['extractNames'])
+    return result
+
+def main():
+    """Benchmark the name extraction on a json file with this format:
+        [
+            {'title': 'title1', 'abstract': 'abstract1', 'links': ['link1',...]},...
+        ]
+
+    With --check, compare extractNames with extractName on the records (the
+    text cases of the benchmark by default) and exit with status 1 if they disagree.
+    """
+    if '--check' in sys.argv:
+        args = [arg for arg in sys.argv[1:] if arg!='--check']
+        records = loadTextCases(args[0]) if args else loadTextCases()
+        disagreements = compareWithExtractName(records)
+        for idx, expected, names in disagreements:
+            print('names differ for', records[idx][0], expected, names)
+        if disagreements:
+            sys.exit(1)
+        print('extractNames agrees with extractName on', len(records), 'publications')
+        return
+    if len(sys.argv)<2:
+        print('usage: python nameScoring.py [--check] records.json')
+        return
+    with open(sys.argv[1], 'r') as f:
+        records = [(r['title'], r.get('abstract', ''), r.get('links', [])) for r in json.load(f)]
+    benchmark(records)
+
+if __name__ == '__main__':
+    main()
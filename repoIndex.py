@@ -0,0 +1,293 @@
+import re, threading
+from collections import namedtuple
+from functools import lru_cache
+
+from interning import compactArray
+
+# number of distinct links whose repository is remembered
+MEMO_SIZE = 100000
+
+# one parser for every form of code repo link, e.g. github.com/owner/repo,
+# owner.github.io/repo, sourceforge.net/projects/name, name.sourceforge.net
+# and bioconductor.org/packages/release/bioc/html/name.html
+REPO_REGEX = re.compile(r'''
+    (?:(?P<sub>[\w-]+)\.)?
+    (?P<host>github|bitbucket|sourceforge|bioconductor)\.(?:com|org|net|io)\b
+    (?P<path>(?:/[\w.%~+-]*)*)
+''', re.IGNORECASE | re.VERBOSE)
+
+# subdomains that are not the owner of a repository
+WWW_SUBDOMAINS = ('www',)
+# subdomains of services that do not host repositories, e.g. gist.github.com
+SERVICE_SUBDOMAINS = ('gist', 'api', 'raw', 'help', 'docs', 'status', 'blog')
+# sourceforge subdomains that are not projects, e.g. lists.sourceforge.net
+SOURCEFORGE_SERVICES = ('lists', 'sf', 'downloads', 'prdownloads', 'svn', 'git', 'hg', 'cvs', 'web', 'apps',
+    'sourceforge', 'fossies', 'static', 'a', 'c')
+# first segments of github and bitbucket paths that are pages of the site, not owners, e.g. github.com/orgs/x
+RESERVED_OWNERS = {
+    'github': ('orgs', 'users', 'features', 'topics', 'marketplace', 'settings', 'about', 'pricing', 'search',
+        'explore', 'login', 'join', 'sponsors', 'collections', 'trending', 'enterprise', 'apps', 'site', 'contact',
+        'notifications', 'new', 'organizations'),
+    'bitbucket': ('account', 'dashboard', 'repo', 'site', 'product', 'blog', 'support')
+}
+# the first segment of the path of a sourceforge project
+SOURCEFORGE_PREFIXES = ('projects', 'p')
+# segments of bioconductor links that are not the name of a package, e.g. bioconductor.org/packages/release/bioc/
+BIOC_PATH_WORDS = ('packages', 'release', 'devel', 'bioc', 'html', 'data', 'experiment', 'annotation', 'workflows')
+# segments of bioconductor links that are followed by the files of a package, e.g. .../bioc/vignettes/name/inst/doc/x.pdf
+BIOC_FILE_WORDS = ('vignettes', 'manuals', 'src', 'news')
+# extensions of the files linked in bioconductor pages, a file is not the name of a package
+FILE_EXTENSIONS = ('.pdf', '.r', '.rmd', '.rnw', '.tar.gz', '.tgz', '.zip', '.txt', '.png', '.jpg', '.svg', '.md')
+# pages of a github.io or bitbucket.io site, e.g. owner.github.io/index.html, after cleanName
+PAGE_NAMES = ('index',)
+
+HOST_LINKS = {
+    'github': 'github.com/',
+    'bitbucket': 'bitbucket.org/',
+    'sourceforge': 'sourceforge.net/projects/',
+    'bioconductor': 'bioconductor.org/packages/'
+}
+
+class RepoID(namedtuple('RepoID', ['host', 'owner', 'repo'])):
+    """The canonical identifier of a code repository
+
+    host is 'github', 'bitbucket', 'sourceforge' or 'bioconductor'. owner is
+    '' for sourceforge projects and bioconductor packages. repo is None for
+    a link to an owner (e.g. github.com/owner) rather than a repository.
+    Every part is lowercase, except the case sensitive bioconductor names.
+
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """The 'owner/repo' of a repository, or its name if it has no owner"""
+        return self.owner+'/'+self.repo if self.owner else self.repo
+
+    @property
+    def link(self):
+        """The canonical link of the repository, e.g. 'github.com/owner/repo'"""
+        return HOST_LINKS[self.host]+self.key
+
+def isFileName(name):
+    """Return True if a path segment is the name of a file, e.g. 'vignette.pdf'"""
+    return name.lower().endswith(FILE_EXTENSIONS)
+
+def cleanName(name):
+    """Remove the trailing .git, .html or punctuation of a repository name"""
+    name = name.rstrip('.')
+    for suffix in ('.git', '.html'):
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+@lru_cache(maxsize=MEMO_SIZE)
+def parseRepoLink(link):
+    """Find the code repository of a link
+
+    Args:
+        link (str): The link/url, e.g. 'https://www.github.com/Owner/Repo.git/tree/master'
+
+    Returns:
+        RepoID: The canonical identifier, e.g. RepoID('github', 'owner', 'repo').
+        Returns None if the link is not a code repo link.
+
+    """
+    m = REPO_REGEX.search(link)
+    if not m:
+        return None
+    host = m.group('host').lower()
+    sub = (m.group('sub') or '').lower()
+    if sub in WWW_SUBDOMAINS:
+        sub = ''
+    if sub in SERVICE_SUBDOMAINS:
+        return None
+    segments = [cleanName(segment) for segment in m.group('path').split('/')[1:]]
+    segments = [segment for segment in segments if segment]
+
+    if host=='bioconductor':
+        # the package is the segment after the files directory, e.g. .../vignettes/name/inst/doc/x.pdf,
+        # or else the last segment, e.g. .../bioc/html/name.html
+        words = [segment.lower() for segment in segments]
+        for word in BIOC_FILE_WORDS:
+            if word in words and words.index(word)+1<len(segments):
+                segments = segments[:words.index(word)+2]
+                break
+        if not segments or segments[-1].lower() in BIOC_PATH_WORDS+BIOC_FILE_WORDS or isFileName(segments[-1]):
+            return None
+        return RepoID(host, '', segments[-1])
+
+    if host=='sourceforge':
+        if sub in SOURCEFORGE_SERVICES:
+            return None
+        if sub:
+            return RepoID(host, '', sub)
+        if len(segments)>=2 and segments[0].lower() in SOURCEFORGE_PREFIXES and not isFileName(segments[1]):
+            return RepoID(host, '', segments[1].lower())
+        return None
+
+    # github and bitbucket: owner.github.io/repo or github.com/owner/repo
+    if sub:
+        if segments and (isFileName(segments[0]) or segments[0].lower() in PAGE_NAMES):
+            return RepoID(host, sub, sub)
+        return RepoID(host, sub, segments[0].lower() if segments else sub)
+    if not segments or segments[0].lower() in RESERVED_OWNERS[host]:
+        return None
+    return RepoID(host, segments[0].lower(), segments[1].lower() if len(segments)>1 else None)
+
+class RepoIndex(object):
+    """The publications of every code repository seen during a run
+
+    One index is kept for the whole run. It only holds the Solr id and the
+    publication DOIs of every repository that is indexed, not its entry, so
+    that a paper found on a later page is added to the Solr document of its
+    repository (see entryUpdate) while the memory of the run stays flat.
+
+    Example:
+        index = RepoIndex()
+        index.add('https://github.com/Owner/Repo', '10.1093/bioinformatics/btu001')
+        index.add('owner.github.io/repo', '10.1093/bioinformatics/btu002')
+        index.publications(parseRepoLink('github.com/owner/repo'))  # both DOIs
+
+    """
+
+    def __init__(self):
+        self.repos = {}
+        self.solr_ids = {}
+        self.lock = threading.Lock()
+
+    def add(self, link, publication):
+        """Join a publication to the repository of a link
+
+        Args:
+            link (str/RepoID): The link of the repository, or its RepoID
+            publication (str): The identifier of the publication, e.g. its DOI
+
+        Returns:
+            RepoID: The repository. Returns None if the link is not a repository.
+
+        """
+        repo_id = link if isinstance(link, RepoID) else parseRepoLink(link)
+        if repo_id is None or repo_id.repo is None:
+            return None
+        with self.lock:
+            publications = self.repos.setdefault(repo_id, [])
+            if publication not in publications:
+                publications.append(publication)
+        return repo_id
+
+    def publications(self, repo_id):
+        with self.lock:
+            return list(self.repos.get(repo_id, []))
+
+    def isIndexed(self, repo_id):
+        """Return True if the repository has a document in Solr"""
+        with self.lock:
+            return repo_id in self.solr_ids
+
+    def solrID(self, repo_id):
+        with self.lock:
+            return self.solr_ids.get(repo_id)
+
+    def setIndexed(self, repo_id, solr_id, publications):
+        """Record the Solr document of a repository and the DOIs of the publications it lists"""
+        with self.lock:
+            self.solr_ids[repo_id] = solr_id
+        for publication in publications:
+            self.add(repo_id, publication)
+
+    def __len__(self):
+        return len(self.repos)
+
+# fields of a Solr entry that hold one value per publication, in the same order
+PUBLICATION_FIELDS = ['publicationDOI', 'publicationTitle', 'publicationDate', 'publicationJournal',
+    'publicationPMID', 'publicationReferences']
+# fields of a Solr entry that are merged as sets
+LIST_FIELDS = ['authors', 'institutions', 'tags', 'emails', 'linkUrls', 'funding', 'fundingAgencies',
+    'domains', 'language']
+
+def entryRepo(entry):
+    """Find the repository of a Solr entry from its codeRepoURL
+
+    The other links are not used: they are often the dependencies the paper cites.
+
+    """
+    link = entry.get('codeRepoURL')
+    repo_id = parseRepoLink(link) if link else None
+    if repo_id is None or repo_id.repo is None:
+        return None
+    return repo_id
+
+def mergeEntry(merged, entry):
+    """Add the publications, authors, links, ... of a Solr entry to the entry of the same repository"""
+    for i, doi in enumerate(entry.get('publicationDOI', [])):
+        if doi in merged.get('publicationDOI', []):
+            continue
+        count = len(merged.get('publicationDOI', []))
+        for field in PUBLICATION_FIELDS:
+            values = entry.get(field, [])
+            merged_values = merged.setdefault(field, [])
+            # keep the fields of the publications aligned
+            merged_values += [None]*(count-len(merged_values))
+            merged_values.append(values[i] if i<len(values) else None)
+    for field in LIST_FIELDS:
+        if field in entry:
+            merged[field] = compactArray(list(merged.get(field, []))+list(entry[field]))
+
+def mergeEntries(entries):
+    """Merge the Solr entries of the same code repository, before they are indexed
+
+    The same tool is often published in several papers; its entries become
+    one entry that lists every publication. Entries without a repository are
+    kept as they are. An entry whose repository is already in Solr, e.g. from
+    a previous page of a migration, is added to its document with entryUpdate.
+
+    Args:
+        entries ([dict]): The entries in the Solr format, see converToSolrFormat
+
+    Returns:
+        [dict]: The merged entries, in the order of their first occurrence
+
+    """
+    result = []
+    by_repo = {}
+    for entry in entries:
+        repo_id = entryRepo(entry)
+        if repo_id is None:
+            result.append(entry)
+            continue
+        if repo_id in by_repo:
+            mergeEntry(by_repo[repo_id], entry)
+        else:
+            # the lists are copied, the merge must not change the original entry
+            by_repo[repo_id] = {field: list(value) if isinstance(value, list) else value for field, value in entry.items()}
+            result.append(by_repo[repo_id])
+    return result
+
+def entryUpdate(solr_id, entry, known):
+    """Build the atomic update that adds the new publications of an entry to the Solr document of its repository
+
+    Args:
+        solr_id (int): The id of the Solr document of the repository
+        entry (dict): The entry in the Solr format
+        known ([str]): The DOIs the document already lists
+
+    Returns:
+        dict: The atomic update, e.g. {'id': 12, 'publicationDOI': {'add': [...]}, 'authors': {'add-distinct': [...]},...}.
+        Returns None if the entry has no new publication.
+
+    """
+    known = set(known)
+    dois = entry.get('publicationDOI', [])
+    new = [i for i, doi in enumerate(dois) if doi not in known]
+    if not new:
+        return None
+    update = {'id': solr_id}
+    # the publication fields stay aligned: every new publication adds one value to each
+    for field in PUBLICATION_FIELDS:
+        values = entry.get(field, [])
+        update[field] = {'add': [values[i] if i<len(values) else None for i in new]}
+    for field in LIST_FIELDS:
+        if entry.get(field):
+            update[field] = {'add-distinct': list(entry[field])}
+    return update
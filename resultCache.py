@@ -0,0 +1,60 @@
+import threading, time
+import metrics
+
+class ResultCache(object):
+    """Thread-safe in-memory cache of the results of remote lookups
+
+    Hits and misses are counted in metrics as cache_hit and cache_miss,
+    tagged with the name of the cache.
+
+    Example:
+        github_cache = ResultCache('github', ttl=6*60*60)
+        obj = github_cache.get('owner/repo')
+        if obj is None:
+            obj = ...
+            github_cache.set('owner/repo', obj)
+
+    """
+
+    def __init__(self, name, ttl=None):
+        """
+        Args:
+            name (str): The name of the cache, used to tag the metrics
+            ttl (float, optional): The number of seconds a result stays valid. Default is None, forever.
+
+        """
+        self.name = name
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached result of a key, or default if it is missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.time()-entry[1]>self.ttl:
+                del self.entries[key]
+                entry = None
+        if entry is None:
+            metrics.increment('cache_miss', cache=self.name)
+            return default
+        metrics.increment('cache_hit', cache=self.name)
+        return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time())
+
+    def missing(self, keys):
+        """Return the keys that are not cached (or expired), without counting misses"""
+        now = time.time()
+        with self.lock:
+            return [key for key in keys if key not in self.entries or
+                (self.ttl is not None and now-self.entries[key][1]>self.ttl)]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,5 +1,6 @@
 import json, os, re, nltk, datetime, pycurl, random
 from io import BytesIO
+from urllib.parse import urlparse
 
 
 #url regex
@@ -14,11 +15,53 @@ import xml.etree.ElementTree as ET
 
 from treeMap import createTreeMap, checkDict, getLongestWord
 import config.config as CONFIG
+import metrics
+import corpusStore
+import idMap
+from affiliations import extractAffiliations, filterAffiliations
+from interning import AuthorAffiliations, compactArray
+from linkIndex import MarkupIndex, rankBySection, URL_REGEX, EMAIL_REGEX
+from repoIndex import parseRepoLink, HOST_LINKS
 
 REPO_FILTER_WORDS = ['github', 'bitbucket', 'sourceforge', 'bioconductor']
+# sections of a PMC article searched for links, by rank
+SEARCHED_SECTIONS = ['availability', 'abstract', 'methods', 'body']
+# matches a title up to its last whole word 'with', not the one of 'without' or 'within'
+LAST_WITH_REGEX = re.compile(r'.*\b(with)\b')
 
 my_tree_map = createTreeMap('./utilities/inst_alias.json')
 
+def cleanLink(link):
+    """Remove the trailing slash of a link"""
+    if link and link[-1]=='/':
+        return link[:-1]
+    return link
+
+def findLinks(text):
+    """Find the urls and emails of a text with regular expressions
+
+    Args:
+        text (str): The text
+
+    Returns:
+        ([str], [str]): The links, without the ones that are part of an email, and the emails
+
+    """
+    if not text.strip():
+        return ([], [])
+    emails = EMAIL_REGEX.findall(text)
+    links = []
+    for link in URL_REGEX.findall(text):
+        # if the link that is found is part of an email, ignore it
+        isPartOfEmail = False
+        for email in emails:
+            if cleanLink(link) in email:
+                isPartOfEmail = True
+        if not isPartOfEmail:
+            links.append(link)
+    return (links, emails)
+
+@metrics.timed
 def extractLinks(text, fileXML=None, searchFull=False):
     """Extract links (URLs) from text
 
@@ -26,6 +69,12 @@ def extractLinks(text, fileXML=None, searchFull=False):
     string of text. An option is provided to pass in an xml file (PMC article)
     to extract links.
 
+    With an xml file, the ext-link, uri and email elements are collected in
+    one pass over the article, at any depth, and the links are ranked by the
+    section they are in (availability, abstract, methods, body). The regular
+    expressions then only run on the text outside of these elements, and only
+    if no code repo link was found in the markup.
+
     Args:
         text (str): A body of text, usually the abstract. Can also be full paper.
         fileXML (xml.etree.ElementTree, optional): An xml object of the
@@ -40,70 +89,37 @@ def extractLinks(text, fileXML=None, searchFull=False):
 
 
     """
-    # return values
-    links = []
-    emails = []
-
-    # keep track of code repo links
-    foundRepo = False
     # if an xml is provided, extract all links and emails
-    if fileXML:
-        link_node = fileXML.findall("./article/front/article-meta/abstract/p/ext-link")
-
-        # if no link is found in abstract, search in full text of paper
-        if not link_node:
-            link_node = fileXML.findall("./article/front/article-meta/abstract/sec/p/ext-link")
-
-        # look in full text if searchFull is true
-        if searchFull:
-            if link_node:
-                link_node += fileXML.findall("./article/body/sec/p/ext-link")
-            else:
-                link_node = fileXML.findall("./article/body/sec/p/ext-link")
-
-        # extract values from link nodes
-        for link in link_node:
-            link_text = link.attrib['{http://www.w3.org/1999/xlink}href']
-            if link_text:
-                if link_text[-1]=='/':
-                    link_text = link_text[:-1]
-                for word in REPO_FILTER_WORDS:
-                    if word in link_text:
-                        foundRepo = True
-                if not link_text.lower()=='supplementary data':
-                    links.append((link_text, link_text[link_text.rfind('/')+1:]))
-
-        # look for email tags in xml
-        email_node = fileXML.findall("./article/front/article-meta/abstract/p/email")
-        if searchFull:
-            if email_node:
-                email_node += fileXML.findall("./article/body/sec/p/email")
-            else:
-                email_node = fileXML.findall("./article/body/sec/p/email")
-
-        for email in email_node:
-            emails.append(email.text)
-
-    if not fileXML or not foundRepo:
-        # use regular expressions to find urls and emails in text
-        regex_url = re.compile(regex.URL_REGEX)
-        emails = re.compile(regex.EMAIL_REGEX).findall(text)
-        for link in regex_url.findall(text):
-            # remove trailing slash
-            if link[-1]=='/':
-                link = link[:-1]
-            # if the link that is found is part of an email, ignore it
-            isPartOfEmail = False
-            for email in emails:
-                if link in email:
-                    isPartOfEmail = True
-            if not isPartOfEmail:
-                links.append((link, link[link.rfind('/')+1:]))
+    if fileXML is not None:
+        index = MarkupIndex(fileXML, searchFull=searchFull)
+        # links in the references belong to other publications
+        link_pairs = [(link, section) for link, section in index.links if link and section in SEARCHED_SECTIONS]
+        email_pairs = [(email, section) for email, section in index.emails if email and section in SEARCHED_SECTIONS]
+
+        # keep track of code repo links
+        foundRepo = any(word in link for link, section in link_pairs for word in REPO_FILTER_WORDS)
+
+        # the regular expressions only run on the text without markup
+        if not foundRepo:
+            for section in SEARCHED_SECTIONS:
+                section_links, section_emails = findLinks(index.sectionText(section))
+                link_pairs += [(link, section) for link in section_links]
+                email_pairs += [(email, section) for email in section_emails]
+
+        links = [link for link, section in rankBySection(link_pairs)]
+        emails = [email for email, section in rankBySection(email_pairs)]
+    else:
+        links, emails = findLinks(text)
 
+    # drop the repeated links and emails, keeping the best ranked
+    links = compactArray(cleanLink(link) for link in links if link.lower()!='supplementary data')
+    links = [(link, link[link.rfind('/')+1:]) for link in links if link]
+    emails = compactArray(emails)
 
     return (links, emails)
 
 
+@metrics.timed
 def extractRepoLinks(repo, abstract=None, links=[]):
     """Extract code repository links (URLs) from text
 
@@ -125,9 +141,10 @@ def extractRepoLinks(repo, abstract=None, links=[]):
 
     """
     # if an abstract is provided, extract links from the abstract
+    pairs = []
     if abstract:
         pairs = extractLinks(abstract)[0]
-        links += [link[0] for link in pairs]
+        links = links + [link[0] for link in pairs]
 
     results = []
 
@@ -147,12 +164,33 @@ def extractRepoLinks(repo, abstract=None, links=[]):
 
     return (results, nonRepo)
 
+def extractRepos(links, host):
+    """Find the repositories of a host in a list of links
+
+    Args:
+        links ([str]): A list of strings that are formatted as links/urls.
+        host (str): 'github', 'bitbucket' or 'sourceforge'
+
+    Returns:
+        [(str, str)]: The return value as list of pairs. In each pair: first value
+        is the canonical link (see repoIndex.RepoID), and the second value is the name of the repo.
+
+    """
+    results = []
+    for link in links:
+        repo_id = parseRepoLink(link)
+        if repo_id is not None and repo_id.host==host:
+            if repo_id.repo is None:
+                # for links that look like github.com/user
+                results.append((HOST_LINKS[host]+repo_id.owner, repo_id.owner))
+            else:
+                results.append((repo_id.link, repo_id.repo))
+    return results
+
+@metrics.timed
 def extractGithub(links):
     """Check if links are valid github links
 
-    This function will use regular expressions to extract github links and extract
-    the name of the repo.
-
     Args:
         links ([str]): A list of strings that are formatted as links/urls.
 
@@ -162,46 +200,12 @@ def extractGithub(links):
         first value is the github link, and the second value is the name of the repo.
 
     """
-    results = []
-    for link in links:
-        # for links that look like github.com/user/project
-        m = re.search('(www\.)?github.(com|org)\/[\S]+?\/[\w.-]+', link)
-        github_name = ''
-        github_link=''
-        if m:
-            github_link = m.group(0)
-            github_name = github_link[github_link.rfind('/')+1:]
-        else:
-            # for links that look like github.com/user
-            m = re.search('(www\.)?github.(com|org)\/[\w\d-]+', link)
-            if m:
-                github_link = m.group(0)
-                github_name = github_link[github_link.rfind('/')+1:]
-        if not m:
-            # for links that look like project.github.com/subproject
-            m = re.search('[\w-]+\.github.(com|org|io)?(\/[\w-]+)*', link)
-            if m:
-                github_link = m.group(0)
-                github_name = github_link[:github_link.find('.')]
-                if github_link.find('github.com')+12<len(github_link):
-                    start = github_link.rfind('/')+1
-                    github_name = github_link[start:]
-
-        # remove trailing .git
-        if github_name.endswith('.git'):
-            github_name = github_name[:-4]
-
-        if not github_link == "":
-            results.append((github_link, github_name))
-
-    return results
+    return extractRepos(links, 'github')
 
+@metrics.timed
 def extractBitbucket(links):
     """Check if links are valid bitbucket links
 
-    This function will use regular expressions to extract bitbucket links and extract
-    the name of the repo.
-
     Args:
         links ([str]): A list of strings that are formatted as links/urls.
 
@@ -211,73 +215,24 @@ def extractBitbucket(links):
         first value is the bitbucket link, and the second value is the name of the repo.
 
     """
+    return extractRepos(links, 'bitbucket')
 
-    results = []
-    for link in links:
-        # for links that look like bitbucket.org/user/project
-        m = re.search('(www\.)?bitbucket.(com|org)\/[\S]+?\/[\w.-]+', link)
-        bb_name = ''
-        bb_link=''
-        if m:
-            bb_link = m.group(0)
-            bb_name = bb_link[bb_link.rfind('/')+1:]
-        else:
-            # for links that look like project.bitbucket.com/subproject
-            m = re.search('[\w-]+\.bitbucket.(com|org)?(\/[\w-]+)*', link)
-            if m:
-                bb_link = m.group(0)
-                bb_name = bb_link[:bb_link.find('.')]
-                if bb_link.find('bitbucket.org')+15<len(bb_link):
-                    start = bb_link.rfind('/')+1
-                    bb_name = bb_link[start:]
-
-        # remove trailing .git
-        if bb_name.endswith('.git'):
-            bb_name = bb_name[:-4]
-        if not bb_link == "":
-            results.append((bb_link, bb_name))
-    return results
-
+@metrics.timed
 def extractSourceforge(links):
     """Check if links are valid sourceforge links
 
-    This function will use regular expressions to extract ): links and extract
-    the name of the repo.
-
     Args:
         links ([str]): A list of strings that are formatted as links/urls.
 
 
     Returns:
         [(str, str)]: The return value as list of pairs. In each pair:
-        first value is the ): link, and the second value is the name of the repo.
+        first value is the sourceforge link, and the second value is the name of the project.
 
     """
-    results = []
-    for link in links:
-        # for links that look like sourceforge.net/project
-        m = re.search('(www\.)?sourceforge.(com|net)\/[\S]+?\/[\w.-]+', link)
-        sf_name = ''
-        sf_link=''
-        if m:
-            sf_link = m.group(0)
-            sf_name = sf_link[sf_link.rfind('/')+1:]
-        else:
-            # for links that look like project.sourceforge.net/subproject
-            m = re.search('[\w-]+\.sourceforge.(com|net)?(\/[\w-]+)*', link)
-            if m:
-                sf_link = m.group(0)
-                sf_name = sf_link[:sf_link.find('.')]
-                start = 0
-
-                if sf_link.find('sourceforge.net')+17<len(sf_link):
-                    start = sf_link.rfind('/')+1
-                    sf_name = sf_link[start:]
-
-        if not sf_link == "":
-            results.append((sf_link, sf_name))
-    return results
+    return extractRepos(links, 'sourceforge')
 
+@metrics.timed
 def extractFromTitle(title):
     """Extract the name of the tool from the title
 
@@ -339,10 +294,10 @@ def extractFromTitle(title):
         return title[paren_idx+1:end_paren_idx]
 
     # the word(s) following the word 'with' is the name
-    with_idx = title.rfind('with')
+    with_match = LAST_WITH_REGEX.match(title)
     comma_idx = title.find(',')
-    if with_idx > 0 and comma_idx < 0:
-        with_name = title[with_idx+len('with '):].strip()
+    if with_match and with_match.start(1) > 0 and comma_idx < 0:
+        with_name = title[with_match.end(1):].strip()
         if len(with_name.split()) < 3:
             return with_name
 
@@ -382,6 +337,7 @@ def extractFromTitle(title):
 
     return name
 
+@metrics.timed
 def extractName(title, abstract, repo='', links=[]):
     """Extract the name of the tool from the title and abstract
 
@@ -584,7 +540,7 @@ def getGrants(text):
         if agency not in result_agencies:
             result.append((agency, grant))
 
-    return list(set(result))
+    return compactArray(result)
 
 def getTreeMap():
     return my_tree_map
@@ -610,7 +566,8 @@ def isWorkingLink(link):
     	return False
     return False
 
-def extractFromXML(filename, getAbstractOnly=True, xmlString='', incompletePub={}):
+@metrics.timed
+def extractFromXML(filename, getAbstractOnly=True, xmlString='', incompletePub=None):
     """Extract all metadata from publication in the PMC XML format
 
     Using xml.ETree to parse the xml and extract relevant metadata
@@ -623,7 +580,7 @@ def extractFromXML(filename, getAbstractOnly=True, xmlString='', incompletePub={
 
 
     """
-    pub = incompletePub
+    pub = incompletePub if incompletePub is not None else {}
 
     # check if file exists and is xml file
     root = None
@@ -656,60 +613,15 @@ def extractFromXML(filename, getAbstractOnly=True, xmlString='', incompletePub={
     	# extract authors
         if 'authors' not in pub or not pub['authors']:
             authors_node = root.find("./article/front/article-meta/contrib-group")
-            pub['authors'] = []
+            table = AuthorAffiliations()
             for author in authors_node.iter('name'):
-            	pub['authors'].append({'first_name': author.find('given-names').text, 'last_name':author.find('surname').text})
+            	table.addAuthor(author.find('given-names').text, author.find('surname').text)
+            pub['authors'] = table.authors
 
-        # extract institutions:
-        # TODO: needs improvement
+        # extract institutions
         if 'institutions' not in pub or len(pub['institutions'])<2:
-            affiliations = []
-            aff_node = root.findall("./article/front/article-meta/aff")
-            if not aff_node:
-            	aff_node = root.findall("./article/front/article-meta/contrib-group/aff")
-            for aff in aff_node:
-                aff_xml = ET.tostring(aff, encoding='utf-8', method='xml').decode('utf-8')
-                aff_xml = aff_xml[aff_xml.find('>')+1:aff_xml.rfind('<')]
-                label_tag = ''
-                if aff_xml.find('<sup>')>=0:
-                	label_tag = 'sup'
-                elif aff_xml.find('<label>')>=0:
-                	label_tag = 'label'
-
-            # remove superscript labels
-            if label_tag:
-            	for i in range(1, 20):
-            		superscript_num = '<'+label_tag+'>'+str(i)+'</'+label_tag+'>'
-            		find_aff = aff_xml.find(superscript_num)
-            		if find_aff >= 0:
-            			start_idx = find_aff+len(superscript_num)
-            			end_idx = aff_xml.find('<'+label_tag+'>', start_idx)
-            			institution = aff_xml[start_idx:end_idx].strip()
-            			if institution.endswith(' and'):
-            				institution = institution[:-4]
-            			affiliations.append(institution)
-            		else:
-            			break
-            else:
-            	affiliations.append(aff_xml)
-            # filter out institutions, only save ones that have certain keywords
-            filtered_aff = []
-            for aff in affiliations:
-            	tokens = aff.split(',')
-            	token_idx = 0
-            	found_idx = 0
-            	for token in tokens:
-            		token_lower = token.lower()
-            		if 'department' not in token_lower:
-            			if 'univ' in token_lower or\
-            			 'insti' in token_lower or\
-            			  'school' in token_lower or \
-            			  'college' in token_lower or \
-            			  'lab' in token_lower or\
-            			  'center' in token_lower:
-            				found_idx = token_idx
-            		token_idx+=1
-            	filtered_aff.append(', '.join(tokens[found_idx:]))
+            affiliations = extractAffiliations(root.find("./article/front/article-meta"))
+            filtered_aff = filterAffiliations(affiliations)
 
             pub['institutions'] = filtered_aff
             pub['no_filter_inst'] = affiliations
@@ -777,7 +689,7 @@ def extractFromXML(filename, getAbstractOnly=True, xmlString='', incompletePub={
             			pub['links'][i]['broken'] = True and not isWorkingLink('https://'+link)
 
         # extract the code repoLinks
-        if not pub['repo']:
+        if not pub.get('repo'):
             lower_abstract = pub['abstract'].lower()
             repo = ''
             for word in REPO_FILTER_WORDS:
@@ -791,13 +703,15 @@ def extractFromXML(filename, getAbstractOnly=True, xmlString='', incompletePub={
 
     return pub
 
-def makeRequest(link):
+def makeRequest(link, data=None, headers=None):
     """Makes an HTTP request to the given link and retrieves content
 
     Uses pycurl to perform request
 
     Args:
         link (str): The link/url of the website
+        data (str, optional): The body of a POST request. Default is None, a GET request.
+        headers ([str], optional): Extra headers, e.g. ['Authorization: bearer TOKEN']. Default is None.
 
     Returns:
         str: The content that is returned from the website
@@ -805,11 +719,18 @@ def makeRequest(link):
 
     """
     buffer = BytesIO()
-    c = pycurl.Curl()
-    c.setopt(c.URL, link)
-    c.setopt(c.WRITEDATA, buffer)
-    c.perform()
-    c.close()
+    with metrics.timer('request', host=urlparse(link).netloc):
+        c = pycurl.Curl()
+        c.setopt(c.URL, link)
+        c.setopt(c.WRITEDATA, buffer)
+        if data is not None:
+            c.setopt(c.POSTFIELDS, data)
+        if headers:
+            c.setopt(c.HTTPHEADER, headers)
+        try:
+            c.perform()
+        finally:
+            c.close()
 
     body = buffer.getvalue()
     # Body is a byte string.
@@ -832,7 +753,7 @@ def getPubMedXML(pmid):
     r_text = makeRequest(link)
     return r_text
 
-def getPMCXML(pmcid):
+def requestPMCXML(pmcid):
     """Makes an HTTP request to retrieve the XML for the given PMC (Pubmed Central) ID
 
     Args:
@@ -843,11 +764,32 @@ def getPMCXML(pmcid):
 
 
     """
-    link = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&format=xml&id='+str(pmcid)
+    link = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&format=xml&id='+corpusStore.normalizeID(pmcid)
     r_text = makeRequest(link)
     return r_text
 
-def extractFromPubmed(pmid, doi=None, pmc=None):
+def getPMCXML(pmcid):
+    """Retrieve the XML for the given PMC (Pubmed Central) ID
+
+    The local corpus store is read first; an article that is not stored is
+    requested from PMC and added to the store.
+
+    Args:
+        pmcid (str/int): The PMC ID for the article
+
+    Returns:
+        str: The XML of the article
+
+
+    """
+    r_text = corpusStore.getXML(pmcid)
+    if r_text is None:
+        r_text = requestPMCXML(pmcid)
+        corpusStore.putArticle(pmcid, r_text)
+    return r_text
+
+@metrics.timed
+def extractFromPubmed(pmid, doi=None, pmc=None, docSource=None):
     """Extract all metadata from publication in the Pubmed XML format
 
     Using xml.ETree to parse the xml and extract relevant metadata
@@ -856,6 +798,8 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
         pmid (str): The pubmed id of the publication
         doi (str, optional): The DOI of the publication. Default is None.
         pmc (str, optional): The PMC id of the publication. Default is None.
+        docSource (DocumentSource, optional): Where the PubMed and PMC XML are read from,
+        see documentSource.py. Default is None, PubMed and the corpus store.
 
     Returns:
         obj: The return value is an object containing all metadata
@@ -864,23 +808,20 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
     """
     pub = {}
 
-    random_int = int(random.random()*10000)
     if doi:
-        link = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?tool=my_tool&email=my_email'+str(random_int)+'@example.com&format=json&ids='+str(doi)
+        doi = str(doi)
     elif pmc:
         if not pmc.lower().startswith('pmc'):
             pmc = 'pmc'+pmc
-        link = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?tool=my_tool&email=my_email'+str(random_int)+'@example.com&format=json&ids='+str(pmc)
-
-    r_text = makeRequest(link)
-    json_body = json.loads(r_text)
 
+    # local PMC-ids map first, idconv for the ids it does not know
+    ids = idMap.resolveID(doi or pmc, makeRequest) if (doi or pmc) else None
 
-    if 'records' in json_body and 'pmc' in json_body['records'][0]:
-        pmc = json_body['records'][0]['pmcid']
-    if 'records' in json_body and 'pmid' in json_body['records'][0]:
-        pmid = json_body['records'][0]['pmid']
-    else:
+    if ids and ids.get('pmcid'):
+        pmc = ids['pmcid']
+    if ids and ids.get('pmid'):
+        pmid = ids['pmid']
+    elif doi or pmc:
         link = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&format=json&term='+(doi or pmc)
         r_text = makeRequest(link)
         json_body = json.loads(r_text)
@@ -889,8 +830,10 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
         else:
             return pub
 
-    link = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&format=xml&id='+str(pmid)
-    r_text = makeRequest(link)
+    if docSource is not None:
+        r_text = docSource.getPubMedXML(pmid)
+    else:
+        r_text = getPubMedXML(pmid)
     root = ET.fromstring(r_text)
 
     # get abstract
@@ -903,10 +846,11 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
         journal = journal_node.text
     	# extract authors
         authors_node = root.findall("./PubmedArticle/MedlineCitation/Article/AuthorList/Author")
-        authors = []
-        affiliations = []
+        # repeated authors, affiliations and pairs are kept once
+        table = AuthorAffiliations()
         for author_node in authors_node:
         	if author_node.get('ValidYN')=='Y':
+        		firstname = None
         		lastname = author_node.find('LastName')
         		if lastname is not None:
         			lastname = lastname.text
@@ -916,34 +860,16 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
         				initial = author_node.find('Initials')
         				if initial is not None:
         					firstname+=' '+initial.text
-        				authors.append({'first_name': firstname, 'last_name':lastname})
 
         		# extract institutions
-        		affilation_node = author_node.find('AffiliationInfo/Affiliation')
-        		if affilation_node is not None:
-        			affiliations.append(affilation_node.text)
-
-
-
+        		affiliation_nodes = author_node.findall('AffiliationInfo/Affiliation')
+        		table.add(firstname, lastname if firstname else None,
+        			[affiliation_node.text for affiliation_node in affiliation_nodes if affiliation_node.text])
+        authors = table.authors
+        affiliations = table.affiliations
 
         # filter out institutions, only save ones that have certain keywords
-        filtered_aff = []
-        for aff in affiliations:
-        	tokens = aff.split(',')
-        	token_idx = 0
-        	found_idx = 0
-        	for token in tokens:
-        		token_lower = token.lower()
-        		if 'department' not in token_lower:
-        			if 'univ' in token_lower or\
-        			 'insti' in token_lower or\
-        			  'school' in token_lower or \
-        			  'college' in token_lower or \
-        			  'lab' in token_lower or\
-        			  'center' in token_lower:
-        				found_idx = token_idx
-        		token_idx+=1
-        	filtered_aff.append(', '.join(tokens[found_idx:]))
+        filtered_aff = filterAffiliations(affiliations)
 
         # extract tags
         tags = []
@@ -986,14 +912,14 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
         funding_node = root.findall("./PubmedArticle/MedlineCitation/Article/GrantList/Grant")
         if funding_node:
             for fund in funding_node:
-                agencies = set()
+                agencies = []
                 agency = fund.find('Agency').text
                 agencies_tokens = agency.split()
                 i = 0
                 num_agencies = len(agencies_tokens)
                 while i < num_agencies:
                     potential_agency = getLongestWord(agencies_tokens[i:], my_tree_map)
-                    agencies.add(" ".join(agencies_tokens[i:i+potential_agency[0]+1]))
+                    agencies.append(" ".join(agencies_tokens[i:i+potential_agency[0]+1]))
                     i+=potential_agency[0]
                     i+=1
                 grant = fund.find('GrantID')
@@ -1002,7 +928,7 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
                 else:
                     grant = 'Grant not found'
 
-                for agency in agencies:
+                for agency in compactArray(agencies):
                     if agency:
                         funding.append((agency, grant))
 
@@ -1059,9 +985,12 @@ def extractFromPubmed(pmid, doi=None, pmc=None):
         pub['dateCreated'] = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
         pub['dateUpdated'] = pub['dateCreated']
 
+        pmc = pmc or pub.get('pmc')
         if pmc and (not pub['links'] or not pub['tags'] or not pub['funding'] or len(pub['institutions'])<2):
-            pmc_link = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&format=xml&id='+pmc
-            r_text = makeRequest(pmc_link)
+            if docSource is not None:
+                r_text = docSource.getPMCXML(pmc)
+            else:
+                r_text = getPMCXML(pmc)
             print('retrieving full paper')
             pub = extractFromXML('', xmlString=r_text, incompletePub=pub)
 
@@ -0,0 +1,146 @@
+import sys, json
+import numpy as np
+import gensim
+from gensim import corpora
+
+import lda
+import corpusStore
+from integrate import iterSolrDocs, postSolrUpdates
+import config.config as CONFIG
+
+# the model and dictionary are loaded once per process
+ldamodel = None
+dictionary = None
+
+def loadModel():
+    """Load the saved LDA model and its dictionary, once
+
+    Returns:
+        (gensim.models.ldamodel.LdaModel, gensim.corpora.Dictionary): The model and the dictionary
+
+    """
+    global ldamodel, dictionary
+    if ldamodel is None:
+        ldamodel = gensim.models.ldamodel.LdaModel.load(lda.MODEL_FILE)
+        dictionary = corpora.Dictionary.load(lda.DICTIONARY_FILE)
+    return (ldamodel, dictionary)
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk)>=size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def inferTokens(token_lists, chunksize=2000, topn=3):
+    """Infer the topics of many documents that are already cleaned
+
+    Args:
+        token_lists (iterable): The cleaned tokens of every document
+        chunksize (int, optional): The number of documents inferred at once. Default is 2000.
+        topn (int, optional): The number of topics returned per document. Default is 3.
+
+    Returns:
+        generator: Yields, for every document, the list of its top (topic id, probability) pairs,
+        most likely first. Documents without known words yield an empty list.
+
+    """
+    model, word_dict = loadModel()
+    for chunk in chunks(token_lists, chunksize):
+        bows = [word_dict.doc2bow(tokens) for tokens in chunk]
+        gamma = model.inference(bows)[0]
+        distributions = gamma/gamma.sum(axis=1, keepdims=True)
+        top_topics = np.argsort(-distributions, axis=1)[:, :topn]
+        for i, bow in enumerate(bows):
+            if not bow:
+                yield []
+                continue
+            yield [(int(topic), float(distributions[i, topic])) for topic in top_topics[i]]
+
+def inferTopics(texts, chunksize=2000, topn=3):
+    """Infer the topics of many texts (e.g. abstracts or queries)
+
+    Args:
+        texts (iterable): The texts
+        chunksize (int, optional): The number of texts inferred at once. Default is 2000.
+        topn (int, optional): The number of topics returned per text. Default is 3.
+
+    Returns:
+        [[(int, float)]]: For every text, the list of its top (topic id, probability) pairs.
+
+    """
+    return list(inferTokens((lda.clean(text).split() for text in texts), chunksize, topn))
+
+def inferPMCIDs(pmcids, chunksize=2000, topn=3):
+    """Infer the topics of publications from the cleaned abstracts of the local store
+
+    Args:
+        pmcids ([str]): The PMC IDs of the publications, e.g. 'PMC4321001' or 4321001
+        chunksize (int, optional): The number of abstracts inferred at once. Default is 2000.
+        topn (int, optional): The number of topics returned per publication. Default is 3.
+
+    Returns:
+        dict: The top (topic id, probability) pairs of every PMC ID found in the store,
+        keyed by the PMC IDs as they were given.
+
+    """
+    # the IDs are compared by their digits, whichever form the caller and the store use
+    wanted = {corpusStore.normalizeID(pmcid): pmcid for pmcid in pmcids}
+    records = [record for record in lda.iterCleaned() if corpusStore.normalizeID(record['pmcid']) in wanted]
+    topics = inferTokens((record['tokens'] for record in records), chunksize, topn)
+    return {wanted[corpusStore.normalizeID(record['pmcid'])]: topic for record, topic in zip(records, topics)}
+
+def updateSolrTopics(rows=1000, chunksize=2000, topn=3):
+    """Infer the topics of every document in Solr and write them back
+
+    Documents are read page by page from CONFIG.NEW_SOLR_URL and the top topic
+    ids are set in CONFIG.TOPIC_FIELD with atomic updates, one batch per page.
+
+    Args:
+        rows (int, optional): The number of documents per page. Default is 1000.
+        chunksize (int, optional): The number of documents inferred at once. Default is 2000.
+        topn (int, optional): The number of topics stored per document. Default is 3.
+
+    Returns:
+        int: The number of documents updated.
+
+    """
+    total = 0
+    for docs, next_cursor, numFound in iterSolrDocs(CONFIG.NEW_SOLR_URL, rows=rows, fields=['id', 'name', 'description']):
+        texts = [(doc.get('name') or '')+' '+(doc.get('description') or '') for doc in docs]
+        updates = []
+        for doc, topics in zip(docs, inferTopics(texts, chunksize, topn)):
+            updates.append({'id': doc['id'], CONFIG.TOPIC_FIELD: {'set': [topic for topic, probability in topics]}})
+        if updates:
+            postSolrUpdates(updates)
+            total += len(updates)
+            print(total, 'of', numFound, 'documents updated')
+    return total
+
+def main():
+    """Usage:
+        python topicInference.py --solr              infer and store the topics of every Solr document
+        python topicInference.py --pmc pmcids.txt    print the topics of the PMC IDs (one per line)
+        python topicInference.py --text texts.txt    print the topics of the texts (one per line)
+    """
+    args = sys.argv[1:]
+    if '--solr' in args:
+        updateSolrTopics()
+    elif '--pmc' in args:
+        with open(args[args.index('--pmc')+1], 'r') as f:
+            pmcids = [line.strip() for line in f if line.strip()]
+        for pmcid, topics in inferPMCIDs(pmcids).items():
+            print(json.dumps({'pmcid': pmcid, 'topics': topics}))
+    elif '--text' in args:
+        with open(args[args.index('--text')+1], 'r') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        for text, topics in zip(texts, inferTopics(texts)):
+            print(json.dumps({'text': text, 'topics': topics}))
+    else:
+        print(main.__doc__)
+
+if __name__ == '__main__':
+    main()
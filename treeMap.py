@@ -35,43 +35,70 @@ def createTreeMap(filename, cached_file='./utilities/cached_tree_map.json'):
 							},...
 						]
         cached_file (str, optional): The path to the file of the cached file.
-		Default is './utilities/cached_tree_map.json'.
+		Default is './utilities/cached_tree_map.json'. The cache is rebuilt when
+		the version (modification time and size) of filename differs from the one stored with it.
 
     Returns:
         dict: The return value is a dictionary of nested dictionaries.
 
 
     """
-	my_tree_map = {}
-	# load cached tree map
+	version = fileVersion(filename)
+	# load cached tree map, unless it was built from another version of the file
 	if os.path.isfile(cached_file):
 		with open(cached_file, 'r') as f:
-			my_tree_map = json.load(f)
-	else:
-		# process entries in input file
-		with open(filename) as f:
-			data = json.load(f)
-			for entry in data:
-
-				inst_lower = entry['name'].lower()
-				filter_name = inst_lower.replace(',', '')
-				word_tokens = filter_name.split()
-				my_tree_map = createDict(my_tree_map, word_tokens, entry['name'])
+			cached = json.load(f)
+		if isinstance(cached, dict) and cached.get('version')==version and 'tree_map' in cached:
+			return cached['tree_map']
+
+	# process entries in input file
+	with open(filename) as f:
+		data = json.load(f)
+	my_tree_map = buildTreeMap(data)
+	# write to file, save tree map
+	saveTreeMap(my_tree_map, version, cached_file)
 
-				for alias in entry['aliases']:
-					# filter, make all lowercase, get rid of commas, dashes
-					alias_lower = alias.lower()
-					filter_name = re.sub('[-–]', ' ', alias_lower)
-					filter_name = filter_name.replace(',', '')
-					word_tokens = filter_name.split()
+	return my_tree_map
+
+def fileVersion(filename):
+	"""Version stamp of a file: its modification time and size, without reading it"""
+	stat = os.stat(filename)
+	return '%d-%d' % (stat.st_mtime_ns, stat.st_size)
 
-					my_tree_map = createDict(my_tree_map, word_tokens, entry['name'])
-			# write to file, save tree map
-			with open(cached_file, 'w') as map_file:
-				json.dump(my_tree_map, map_file)
+def aliasTokens(alias):
+	"""Split a name or alias into the lowercase words used as keys of the tree map"""
+	# filter, make all lowercase, get rid of commas, dashes
+	filter_name = re.sub('[-–]', ' ', alias.lower())
+	filter_name = filter_name.replace(',', '')
+	return filter_name.split()
 
+def buildTreeMap(entries):
+	"""Generate the tree map of a list of entries (see createTreeMap for the format)
+
+    Args:
+        entries ([dict]): The {'name': 'phrase1', 'aliases': ['alias1', 'alias2']} entries
+
+    Returns:
+        dict: The tree map
+
+    """
+	my_tree_map = {}
+	for entry in entries:
+		name_tokens = entry['name'].lower().replace(',', '').split()
+		if name_tokens:
+			my_tree_map = createDict(my_tree_map, name_tokens, entry['name'])
+		for alias in entry['aliases']:
+			word_tokens = aliasTokens(alias)
+			# an empty alias would map the root of the tree to the name
+			if word_tokens:
+				my_tree_map = createDict(my_tree_map, word_tokens, entry['name'])
 	return my_tree_map
 
+def saveTreeMap(tree_map, version, cached_file='./utilities/cached_tree_map.json'):
+	"""Save a tree map with the version of the file it was built from"""
+	with open(cached_file, 'w') as map_file:
+		json.dump({'version': version, 'tree_map': tree_map}, map_file)
+
 
 def createDict(given_dict, words, value):
 	"""Generate a nested dictionary given a list of words. It will add your words to
@@ -123,7 +150,8 @@ def createDict(given_dict, words, value):
 	# base case: if list is empty, add the value to the dict
 	if not words:
 		if '$value' in result_dict:
-			result_dict['$value'].append(value)
+			if value not in result_dict['$value']:
+				result_dict['$value'].append(value)
 		else:
 			result_dict['$value'] = [value]
 	else:
@@ -1,82 +1,291 @@
-import threading, os, re, json
+import os, re, sys, json, shutil, multiprocessing
+import numpy as np
+from multiprocessing.pool import ThreadPool
 from nltk.tokenize import sent_tokenize, word_tokenize
-from scrape import getPMCXML
-import xml.etree.ElementTree as ET
-from gensim.models import Word2Vec
+from scrape import requestPMCXML
+from documentSource import DocumentSource
+import corpusStore
+from gensim.models import Word2Vec, KeyedVectors
 import config.config as CONFIG
 
-sentences = []
-
-class pubThread(threading.Thread):
-    def __init__(self, threadID, pmcids):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.pmcids = pmcids
-
-    def run(self):
-        print('Starting thread', self.threadID)
-        for pmcid in self.pmcids:
-            raw_text = getPMCXML(pmcid)
-
-            root = ET.fromstring(raw_text)
-            if root:
-                abstract_node = root.find("./article/front/article-meta/abstract")
-                fulltext_node = root.find("./article/body")
-
-                if abstract_node:
-                    abstract_text = ET.tostring(abstract_node, encoding='utf-8', method='text').decode('utf-8')
-                    sentence = sent_tokenize(abstract_text.lower())
-                    for s in sentence:
-                        sentences.append(word_tokenize(s))
-
-                if fulltext_node:
-                    fulltext_text = ET.tostring(fulltext_node, encoding='utf-8', method='text').decode('utf-8')
-                    sentence = sent_tokenize(fulltext_text.lower())
-                    for s in sentence:
-                        sentences.append(word_tokenize(s))
+# tokenized sentences, one per line (gensim LineSentence format)
+SENTENCE_FILE = './word2vec/sentences.txt'
+# PMC IDs whose sentences are in SENTENCE_FILE, one per line
+DONE_FILE = './word2vec/sentences.done'
+# sentences of the publications that are not in the model yet
+UPDATE_FILE = './word2vec/sentences.new.txt'
+# PMC IDs whose sentences are in UPDATE_FILE, moved to DONE_FILE once they are in SENTENCE_FILE
+UPDATE_DONE_FILE = './word2vec/sentences.new.done'
+MODEL_FILE = './word2vec/paper.model'
+# L2-normalized vectors of MODEL_FILE, memory-mapped by the queries
+VECTORS_FILE = './word2vec/paper.kv'
+
+# the normalized vectors are loaded once per process
+vectors = None
+# articles are read from the journal files or the corpus store before PMC
+doc_source = DocumentSource(fetchPMC=requestPMCXML)
+
+def fetchText(pmcid):
+    """Retrieve the abstract and full text of a publication from the corpus store
+
+    Args:
+        pmcid (str): The PMC ID of the publication
+
+    Returns:
+        (str, [str]): The PMC ID and the texts of the abstract and the body (if any).
+        The texts are None if the publication could not be fetched.
+
+    """
+    try:
+        article = corpusStore.getArticle(pmcid, fetch=doc_source.getPMCXML)
+    except:
+        article = None
+    if article is None:
+        return (pmcid, None)
+    return (pmcid, [text for text in [article['abstract'], article['body']] if text])
+
+def tokenizeDocument(document):
+    """Split the texts of a publication into tokenized sentences
+
+    Args:
+        document ((str, [str])): The PMC ID and the texts, as returned by fetchText
+
+    Returns:
+        (str, [str]): The PMC ID and the sentences, each one a line of space separated tokens.
+        The sentences are None if the publication could not be fetched.
+
+    """
+    pmcid, texts = document
+    if texts is None:
+        return (pmcid, None)
+    lines = []
+    for text in texts:
+        for s in sent_tokenize(text.lower()):
+            tokens = word_tokenize(s)
+            if tokens:
+                lines.append(' '.join(tokens))
+    return (pmcid, lines)
+
+def getDoneIDs(done_filename=DONE_FILE):
+    if not os.path.exists(done_filename):
+        return set()
+    with open(done_filename, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+def buildSentenceFile(pmcids, numThreads=16, processes=None, batchSize=256, filename=SENTENCE_FILE, done_filename=DONE_FILE):
+    """Append the tokenized sentences of publications to a sentence file
+
+    Publications are fetched by a pool of threads and tokenized by a pool of
+    processes, one batch at a time, so memory stays bounded. Publications
+    already listed in DONE_FILE are skipped, so an interrupted run can be
+    restarted. Publications that could not be fetched are not listed, so
+    they are retried by the next run.
+
+    Args:
+        pmcids ([str]): The PMC IDs of the publications
+        numThreads (int, optional): The number of fetching threads. Default is 16.
+        processes (int, optional): The number of tokenizing processes. Default is the number of CPUs.
+        batchSize (int, optional): The number of publications per batch. Default is 256.
+        filename (str, optional): The sentence file. Default is SENTENCE_FILE.
+        done_filename (str, optional): Where the PMC IDs of the written publications are listed. Default is DONE_FILE.
+
+    Returns:
+        int: The number of sentences written.
+
+    """
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    done = getDoneIDs() | getDoneIDs(done_filename)
+    pending = [pmcid for pmcid in pmcids if pmcid not in done]
+    print('tokenizing', len(pending), 'publications')
+
+    total = 0
+    failed = 0
+    fetch_pool = ThreadPool(numThreads)
+    token_pool = multiprocessing.Pool(processes)
+    try:
+        with open(filename, 'a', encoding='utf-8') as sentence_file, open(done_filename, 'a') as done_file:
+            for start in range(0, len(pending), batchSize):
+                documents = fetch_pool.map(fetchText, pending[start:start+batchSize])
+                for pmcid, lines in token_pool.imap_unordered(tokenizeDocument, documents):
+                    if lines is None:
+                        failed += 1
+                        continue
+                    for line in lines:
+                        sentence_file.write(line+'\n')
+                    total += len(lines)
+                    done_file.write(pmcid+'\n')
+                sentence_file.flush()
+                done_file.flush()
+    finally:
+        fetch_pool.close()
+        token_pool.close()
+        fetch_pool.join()
+        token_pool.join()
+
+    if failed:
+        print(failed, 'publications could not be fetched, they will be retried')
+    return total
+
+def getPMCIDs():
+    return corpusStore.getJournalIDs(CONFIG.JOURNAL_DIRS)
+
+def trainModel(workers=None):
+    """Train Word2Vec from SENTENCE_FILE and save it to MODEL_FILE
+
+    The sentences are streamed from the file by every worker thread;
+    no sentence list is kept in memory.
+
+    Args:
+        workers (int, optional): The number of worker threads. Default is the number of CPUs.
+
+    Returns:
+        gensim.models.Word2Vec: The trained model
+
+    """
+    w2v_papers = Word2Vec(corpus_file=SENTENCE_FILE, workers=workers or multiprocessing.cpu_count())
+    w2v_papers.save(MODEL_FILE)
+    saveVectors(w2v_papers)
+    return w2v_papers
+
+def updateModel(pmcids, workers=None):
+    """Train the saved model on the publications it has not seen yet
+
+    Only the sentences of the new publications are tokenized and trained on;
+    their new words are added to the vocabulary with build_vocab(update=True).
+    The new sentences are then appended to SENTENCE_FILE, so that a full
+    retraining still sees every publication. The new publications are only
+    listed in DONE_FILE once their sentences are in SENTENCE_FILE; an
+    interrupted update resumes from UPDATE_FILE. The model is saved with the
+    stamp of the UPDATE_FILE it was trained on, so an update interrupted after
+    the save is merged, not trained again.
+
+    Args:
+        pmcids ([str]): The PMC IDs of the publications; the ones already in DONE_FILE are skipped
+        workers (int, optional): The number of worker threads. Default is the number of CPUs.
+
+    Returns:
+        gensim.models.Word2Vec: The updated model
+
+    """
+    w2v_papers = Word2Vec.load(MODEL_FILE)
+    # an update that was trained and saved, but not merged, is only merged
+    if os.path.exists(UPDATE_FILE) and getattr(w2v_papers, 'update_stamp', None)==fileStamp(UPDATE_FILE):
+        mergeUpdate()
+    # the sentences of an interrupted update are kept, only the missing publications are added
+    buildSentenceFile(pmcids, filename=UPDATE_FILE, done_filename=UPDATE_DONE_FILE)
+    if os.path.getsize(UPDATE_FILE)==0:
+        # no new sentence, the publications without text are still listed as done
+        mergeUpdate()
+        return w2v_papers
+
+    w2v_papers.workers = workers or multiprocessing.cpu_count()
+    w2v_papers.build_vocab(corpus_file=UPDATE_FILE, update=True)
+    w2v_papers.train(corpus_file=UPDATE_FILE, total_examples=w2v_papers.corpus_count,
+        total_words=w2v_papers.corpus_total_words, epochs=w2v_papers.epochs)
+    w2v_papers.update_stamp = fileStamp(UPDATE_FILE)
+    w2v_papers.save(MODEL_FILE)
+    saveVectors(w2v_papers)
+    mergeUpdate()
+    return w2v_papers
+
+def fileStamp(filename):
+    """Version stamp of a file: its modification time and size"""
+    stat = os.stat(filename)
+    return '%d-%d' % (stat.st_mtime_ns, stat.st_size)
+
+def mergeUpdate():
+    """Move the sentences and PMC IDs of a trained update to SENTENCE_FILE and DONE_FILE"""
+    with open(SENTENCE_FILE, 'a', encoding='utf-8') as sentence_file, open(UPDATE_FILE, 'r', encoding='utf-8') as update_file:
+        shutil.copyfileobj(update_file, sentence_file)
+    if os.path.exists(UPDATE_DONE_FILE):
+        with open(DONE_FILE, 'a') as done_file, open(UPDATE_DONE_FILE, 'r') as update_done_file:
+            shutil.copyfileobj(update_done_file, done_file)
+        os.remove(UPDATE_DONE_FILE)
+    os.remove(UPDATE_FILE)
+
+def saveVectors(w2v_papers):
+    """Save the L2-normalized word vectors of a model to VECTORS_FILE
+
+    The vectors are stored in their own .npy file so that every process
+    can memory-map them instead of loading a copy.
+
+    Args:
+        w2v_papers (gensim.models.Word2Vec): The model
+
+    """
+    global vectors
+    normed = KeyedVectors(w2v_papers.wv.vector_size)
+    normed.add_vectors(w2v_papers.wv.index_to_key, w2v_papers.wv.get_normed_vectors())
+    normed.save(VECTORS_FILE, separately=['vectors'])
+    vectors = None
+
+def loadVectors():
+    """Memory-map the normalized word vectors of VECTORS_FILE, once
+
+    Returns:
+        gensim.models.KeyedVectors: The normalized vectors
+
+    """
+    global vectors
+    if vectors is None:
+        vectors = KeyedVectors.load(VECTORS_FILE, mmap='r')
+    return vectors
+
+def similarTerms(terms, topn=10, chunksize=256):
+    """Find the most similar words of many terms at once, e.g. to expand a search query
+
+    The cosine similarities of a chunk of terms with the whole vocabulary are
+    computed with one matrix product of the normalized vectors, and the top
+    words are selected with argpartition instead of a full sort.
+
+    Args:
+        terms ([str]): The terms
+        topn (int, optional): The number of similar words per term. Default is 10.
+        chunksize (int, optional): The number of terms compared at once. Default is 256.
+
+    Returns:
+        dict: The list of (word, similarity) pairs of every term found in the
+        vocabulary, most similar first.
+
+    """
+    kv = loadVectors()
+    known = [term for term in terms if term in kv.key_to_index]
+    topn = min(topn, len(kv.index_to_key)-1)
+    results = {}
+    if topn<1:
+        return results
+
+    for start in range(0, len(known), chunksize):
+        chunk = known[start:start+chunksize]
+        idx = np.array([kv.key_to_index[term] for term in chunk])
+        similarities = kv.vectors[idx].dot(kv.vectors.T)
+        # a term is not similar to itself
+        similarities[np.arange(len(chunk)), idx] = -np.inf
+        top = np.argpartition(-similarities, topn-1, axis=1)[:, :topn]
+        for i, term in enumerate(chunk):
+            best = top[i][np.argsort(-similarities[i, top[i]])]
+            results[term] = [(kv.index_to_key[j], float(similarities[i, j])) for j in best]
+    return results
+
 def main():
-    w2v_papers = None
-    if os.path.exists('./word2vec/paper.model'):
-        w2v_papers = Word2Vec.load('./word2vec/paper.model')
+    """Usage:
+        python word2vec.py                  train the model, or update it with the new publications
+        python word2vec.py term1 term2 ...  print the most similar words of the terms
+    """
+    terms = sys.argv[1:]
+    if terms and os.path.exists(VECTORS_FILE):
+        for term, similar in similarTerms(terms).items():
+            print(json.dumps({'term': term, 'similar': similar}))
+        return
+
+    if os.path.exists(MODEL_FILE):
+        updateModel(getPMCIDs())
     else:
-        using_dir = CONFIG.JOURNAL_DIRS
-
-        filesInDir = []
-        for directory in using_dir:
-            filesInDir += [s for s in os.listdir(directory)]
-
-        pmcids = []
-        for f in filesInDir:
-            pmc_regex = re.search('[\d]+', f)
-            if pmc_regex:
-                pmc = pmc_regex.group(0)
-                pmcids.append(pmc)
-
-        threads = []
-        numThreads = 16
-        numEntriesPerThread = int(len(pmcids)/numThreads)
-        remainder = len(pmcids)%numThreads
-        startIdx = 0
-        endIdx = numEntriesPerThread
-        for i in range(numThreads):
-            if i < remainder:
-                endIdx+=1
-            print(startIdx, endIdx, endIdx-startIdx)
-            pmcid_arr = pmcids[startIdx:endIdx]
-            t = pubThread(i, pmcid_arr)
-            threads.append(t)
-            t.start()
-
-            startIdx = endIdx
-            endIdx+=numEntriesPerThread
-
-        for t in threads:
-            t.join()
-
-
-        w2v_papers = Word2Vec(sentences)
-        w2v_papers.save('./word2vec/paper.model')
-    print(w2v_papers.most_similar('c++', topn=10))
+        buildSentenceFile(getPMCIDs())
+        trainModel()
+    print(json.dumps(similarTerms(terms or ['c++'])))
 
 if __name__ == '__main__':
     main()